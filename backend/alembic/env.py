@@ -19,7 +19,7 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from app.database import Base
-from app.models import User, Diagnosis
+from app.models import User, Diagnosis, DiagnosisRollup
 from app.config import settings
 
 # add your model's MetaData object here
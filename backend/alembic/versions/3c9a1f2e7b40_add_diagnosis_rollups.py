@@ -0,0 +1,42 @@
+"""Add diagnosis rollups
+
+Revision ID: 3c9a1f2e7b40
+Revises: bd5e78d58415
+Create Date: 2026-10-19 09:12:05.114213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9a1f2e7b40'
+down_revision: Union[str, Sequence[str], None] = 'bd5e78d58415'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('diagnosis_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('crop_type', sa.String(), nullable=False),
+    sa.Column('disease_id', sa.String(), nullable=False),
+    sa.Column('diagnosis_count', sa.Integer(), nullable=False),
+    sa.Column('health_score_sum', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('granularity', 'bucket_start', 'crop_type', 'disease_id', name='uq_diagnosis_rollups_bucket')
+    )
+    op.create_index(op.f('ix_diagnosis_rollups_bucket_start'), 'diagnosis_rollups', ['bucket_start'], unique=False)
+    op.create_index(op.f('ix_diagnosis_rollups_id'), 'diagnosis_rollups', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_diagnosis_rollups_id'), table_name='diagnosis_rollups')
+    op.drop_index(op.f('ix_diagnosis_rollups_bucket_start'), table_name='diagnosis_rollups')
+    op.drop_table('diagnosis_rollups')
@@ -0,0 +1,32 @@
+"""Add diagnosis payloads
+
+Revision ID: 8e2d4b7a91c3
+Revises: 3c9a1f2e7b40
+Create Date: 2026-10-19 19:40:26.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2d4b7a91c3'
+down_revision: Union[str, Sequence[str], None] = '3c9a1f2e7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('diagnoses') as batch_op:
+        batch_op.add_column(sa.Column('payload', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('payload_codec', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('diagnoses') as batch_op:
+        batch_op.drop_column('payload_codec')
+        batch_op.drop_column('payload')
@@ -6,7 +6,121 @@ class Settings(BaseSettings):
 
     environment: str = "development"
     model_path: str = "weights/model.keras"
+    # Inference engine: "keras" (full TensorFlow, float32), "tflite" (quantized, see app/model/convert_tflite.py),
+    # "onnx" (ONNX Runtime, see app/model/convert_onnx.py) or "remote" (the shared model server below)
+    inference_backend: str = "keras"
+    tflite_model_path: str = "weights/model_int8.tflite"
+    onnx_model_path: str = "weights/model.onnx"
+    inference_threads: Optional[int] = None  # None = one per core (TFLite threads / ORT intra-op threads)
+    tflite_use_xnnpack: bool = True
+    onnx_inter_op_threads: int = 1
+    onnx_optimization: str = "all"  # disable | basic | extended | all
+    # Test-time augmentation for the local model: "off", "flip" (2 views) or "full" (flips + crops, 8 views).
+    # Views run as one batch; confidence is the view-averaged probability minus penalty x its spread.
+    tta_mode: str = "off"
+    tta_spread_penalty: float = 1.0
+    # Tiled inference (app/model/tiling.py): overlapping input-size tiles of the leaf area run in the same forward
+    # pass as the whole image, for real heatmap regions and the multi-disease warning. The grid is sized so the
+    # tiles cost at most tile_latency_budget_ms of forward time per request (split across a batch's images)
+    tiled_inference: bool = True
+    tile_overlap: float = 0.5
+    tile_max_count: int = 24
+    tile_latency_budget_ms: float = 150.0
+    # Fitted temperature, per-class thresholds and OOD cutoff (python -m app.model.calibration).
+    # Without the file every class uses the 0.65 default and no OOD score is applied.
+    calibration_path: str = "weights/calibration.json"
+    # Class list, input size, preprocessing and checksum for the served weights (see app/model/manifest.py).
+    # None = <weights stem>.manifest.json next to the weights. With a reload interval > 0 the manifest file is
+    # polled and a changed manifest + weights pair is hot-swapped in.
+    model_manifest_path: Optional[str] = None
+    model_reload_interval_s: float = 0.0
+    # Shadow evaluation of a candidate model (POST /api/admin/model/load with shadow_fraction). The candidate runs
+    # on one low-priority thread, at most this many times per second and only while production has spare capacity
+    shadow_max_per_second: float = 2.0
+    shadow_max_active_requests: int = 2
+    # Shared secret for /api/admin/* (X-Admin-Token header); the admin endpoints are disabled while unset
+    admin_token: Optional[str] = None
+    # Who answers an analysis: "gemini_first" (Gemini, MobileNetV2 when it fails), "cascade" (MobileNetV2 first,
+    # Gemini only for unknown/low-confidence/uncovered-crop results, see app/services/routing.py) or "local_only"
+    routing_policy: str = "gemini_first"
+    cascade_confidence_threshold: float = 0.85  # calibrated confidence below which the cascade escalates
+    # Admission control for /analyze* (app/services/admission.py). Per caller (user, else IP): a token bucket of
+    # admission_rate_per_minute images with admission_burst headroom, 0 disables it. Per lane (requests that call
+    # Gemini up front vs local-model-first requests): an in-flight limit plus a bounded wait queue; beyond that,
+    # requests get 503 + Retry-After instead of queueing in the threadpool
+    admission_rate_per_minute: float = 30.0
+    admission_burst: int = 10
+    admission_max_in_flight_gemini: int = 16
+    admission_max_in_flight_local: int = 8
+    admission_max_queue: int = 32
+    admission_queue_timeout_s: float = 2.0
+    # Proxies whose X-Forwarded-For is believed when keying anonymous callers by IP: addresses or CIDRs, or "*" for
+    # whatever connects directly (a platform load balancer with changing addresses, e.g. Render). The client is
+    # the nearest address the trusted proxies report. Empty: the socket peer, which behind a proxy is the proxy
+    # itself, so every anonymous caller would share one bucket
+    trusted_proxies: List[str] = []
+    # Shared per-host model server (python -m app.model.server). API workers talk to it with
+    # INFERENCE_BACKEND=remote; the server itself runs MODEL_SERVER_BACKEND.
+    model_server_socket: str = "/tmp/plantcare-model.sock"
+    model_server_backend: str = "keras"
+    model_server_max_batch: int = 32
+    model_server_max_wait_ms: float = 5.0
+    model_server_shared_memory: bool = True
+    # Load the model and Gemini SDK in a background thread at startup. None = everywhere except development,
+    # so `uvicorn --reload` restarts stay fast and production's first request doesn't pay for the imports
+    preload_models: Optional[bool] = None
     max_image_size_mb: int = 5
+    # Quality gate run before analysis (app/services/image_quality.py): unusable photos get a 422 with retake
+    # advice instead of a diagnosis. Thresholds tuned with python -m benchmarks.bench_quality_gate
+    quality_gate_enabled: bool = True
+    quality_min_side: int = 160
+    quality_min_sharpness: float = 10.0  # variance of the Laplacian at 256 px
+    quality_min_plant_fraction: float = 0.03
+    # Crop to the dominant leaf before MobileNetV2 and Gemini (app/services/leaf_roi.py), padded by roi_margin of
+    # the leaf's size. Gemini gets the crop as a JPEG of at most gemini_image_max_side px instead of the upload
+    roi_crop_enabled: bool = True
+    roi_margin: float = 0.1
+    gemini_image_max_side: int = 1024
+    # Embedding index (app/services/embedding_index.py): each diagnosis's MobileNetV2 embedding, for similar past
+    # cases (similar_cases per answer, 0 disables) and a kNN answer that replaces the Gemini call when at least
+    # knn_min_neighbors of the knn_k nearest Gemini-labeled diagnoses are knn_min_similarity (cosine) close and
+    # knn_min_agreement of them agree. Exact search up to embedding_ivf_min_vectors, then IVF probing
+    # embedding_ivf_nprobe lists. Needs a backend with a feature output (keras). Under gemini_first the local pass
+    # only runs alongside the Gemini call, to index its answer, and kNN never replaces Gemini unless
+    # knn_gemini_first is set (the local pass then runs, and delays the call, before every Gemini request)
+    embedding_index_enabled: bool = True
+    knn_gemini_first: bool = False
+    embedding_index_path: str = "embeddings"
+    similar_cases: int = 5
+    knn_k: int = 10
+    knn_min_similarity: float = 0.92
+    knn_min_neighbors: int = 3
+    knn_min_agreement: float = 0.8
+    embedding_ivf_min_vectors: int = 2048
+    embedding_ivf_nprobe: int = 8
+    # Full AnalysisResponse kept per diagnosis for GET /api/history/{id} (app/services/payload_store.py), compressed
+    # with payload_codec ("zlib", or "zstd" when the zstandard package is installed) against the shared dictionary
+    # payload_dictionary (an id under app/services/payload_dicts/; None = no dictionary, plain gzip)
+    payload_store_enabled: bool = True
+    payload_codec: str = "zlib"
+    payload_dictionary: Optional[str] = "720b54010d04"
+    payload_compression_level: int = 9
+    # Uploaded images (app/services/storage.py, named by content hash), served at /static by
+    # app/services/static_files.py. Content-hash names are cached by clients for good; older uuid names for
+    # static_max_age seconds. ?w=N variants round up to one of static_variant_widths and are built once. Files up
+    # to static_memory_file_kb are kept in a static_memory_cache_mb LRU per worker. With static_accel_redirect (an
+    # internal nginx location aliased to upload_dir) originals are handed to the proxy, which sends them with sendfile
+    upload_dir: str = "uploads"
+    static_max_age: int = 3600
+    static_variant_widths: List[int] = [128, 256, 512, 1024]
+    static_memory_cache_mb: int = 64
+    static_memory_file_kb: int = 1024
+    static_accel_redirect: Optional[str] = None
+
+    # Batch analysis (/analyze/batch)
+    max_batch_images: int = 100
+    batch_decode_workers: int = 8
+    gemini_batch_concurrency: int = 4
     cors_origins: List[str] = [
         "http://localhost:3000", 
         "http://localhost:5173", 
@@ -24,6 +138,32 @@ class Settings(BaseSettings):
     
     # External APIs
     gemini_api_key: Optional[str] = None
+    # Override the Gemini host/transport, e.g. http://127.0.0.1:8765 for the benchmark stand-in
+    gemini_api_endpoint: Optional[str] = None
+    gemini_transport: Optional[str] = None
+    # Gemini quota per API key, shared by all workers on the host (app/services/gemini_quota.py). Calls are paced
+    # to stay under it instead of discovering it from 429s; 0 disables a limit. Interactive calls wait up to
+    # gemini_quota_max_wait_s for budget; background ones (generated treatments) never wait and leave
+    # gemini_quota_background_reserve of each bucket to interactive traffic
+    gemini_rpm_limit: int = 2000  # Gemini 2.x Flash, paid tier 1
+    gemini_tpm_limit: int = 4_000_000
+    gemini_quota_max_wait_s: float = 5.0
+    gemini_quota_background_reserve: float = 0.25
+    # "sqlite" (gemini_quota_path, default <tmp>/plantcare-gemini-quota.db), "memory" or "pkg.module:factory"
+    gemini_quota_backend: str = "sqlite"
+    gemini_quota_path: Optional[str] = None
+
+    # Diagnosis rollups behind /api/analytics (app/services/analytics.py). Hour buckets older than this are pruned
+    # as new diagnoses come in; day buckets (and the week/month views folded from them) are kept. 0 keeps them all
+    analytics_hour_retention_days: int = 90
+
+    # Outbreak detection (per-region, per-disease spike detector)
+    outbreak_bucket_minutes: int = 60
+    outbreak_window_buckets: int = 24
+    outbreak_z_threshold: float = 3.0
+    outbreak_min_count: int = 5
+    outbreak_max_series: int = 200_000
+    outbreak_warm_start_days: int = 7
     
     class Config:
         env_file = ".env"
@@ -1,7 +1,9 @@
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.services.metrics import registry
 
 engine = create_engine(
     settings.database_url, connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
@@ -10,6 +12,21 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+DB_QUERY_SECONDS = registry.histogram(
+    "plantcare_db_query_duration_seconds",
+    "Time spent executing SQL statements.",
+    ("operation",),
+)
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_SECONDS.observe(elapsed, operation=statement.split(None, 1)[0].upper() if statement else "")
+
 # Dependency to get DB session
 def get_db():
     db = SessionLocal()
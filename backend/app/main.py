@@ -1,11 +1,17 @@
 import logging
+import threading
 import traceback
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
-from app.routes import analyze, health, history, auth
+from app.routes import analyze, health, history, auth, analytics, outbreaks, metrics, admin
 from app.config import settings
-from app.database import Base, engine
+from app.database import Base, engine, SessionLocal
+from app.services.outbreak import warm_start as warm_start_outbreaks
+from app.services.gemini_vision import VISION_PROMPT
+from app.services.gemini_client import gemini_enabled
+from app.model.loader import get_model, watch_manifest
+from app.services.static_files import UploadedFiles
 
 logger = logging.getLogger("plantcare")
 
@@ -27,6 +33,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def warm_outbreak_detector():
+    if settings.outbreak_warm_start_days <= 0:
+        return
+    db = SessionLocal()
+    try:
+        warm_start_outbreaks(db, settings.outbreak_warm_start_days)
+    except Exception as e:
+        logger.error(f"Outbreak detector warm start failed: {e}")
+    finally:
+        db.close()
+
+def _preload_models():
+    try:
+        get_model()
+        if gemini_enabled():
+            # Imports the SDK and builds the long-lived vision model with its instructions and schema
+            VISION_PROMPT.model()
+    except Exception as e:
+        logger.error(f"Model preload failed: {e}")
+
+@app.on_event("startup")
+def preload_models():
+    preload = settings.preload_models
+    if preload is None:
+        preload = settings.environment != "development"
+    if preload:
+        # Off the startup path so /health answers while TensorFlow and the Gemini SDK import
+        threading.Thread(target=_preload_models, name="model-preload", daemon=True).start()
+
+@app.on_event("startup")
+def start_manifest_watcher():
+    if settings.model_reload_interval_s > 0:
+        threading.Thread(target=watch_manifest, args=(settings.model_reload_interval_s,),
+                         name="model-manifest-watcher", daemon=True).start()
+
 # Global exception handler — runs INSIDE CORS so headers are always attached
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
@@ -38,9 +80,15 @@ async def global_exception_handler(request: Request, exc: Exception):
 
 # Include Routers
 app.include_router(health.router, tags=["Health"])
+app.include_router(metrics.router, tags=["Metrics"])
 app.include_router(analyze.router, tags=["Analyze"])
 app.include_router(history.router, tags=["History"], prefix="/api")
+app.include_router(analytics.router, tags=["Analytics"], prefix="/api")
+app.include_router(outbreaks.router, tags=["Outbreaks"], prefix="/api")
 app.include_router(auth.router, tags=["Auth"], prefix="/api/auth")
+app.include_router(admin.router, tags=["Admin"], prefix="/api")
+# Where upload_mock_s3 URLs point
+app.mount("/static", UploadedFiles(), name="static")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,375 @@
+"""
+Pluggable inference engines for the leaf classifier.
+
+Every backend takes a float32 NHWC batch that has already been through
+MobileNetV2 preprocessing (values in [-1, 1]) and returns an (N, classes)
+float32 array of softmax probabilities, so inference.py doesn't care which
+engine runs. Pick one with Settings.inference_backend: "keras", "tflite",
+"onnx", or "remote" to use the shared model server.
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.model import ipc
+
+logger = logging.getLogger("plantcare")
+
+
+class InferenceBackend:
+    name = ""
+    provides_features = False
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict_logits(self, batch: np.ndarray) -> Optional[np.ndarray]:
+        """Pre-softmax outputs, or None when the engine only exposes probabilities."""
+        return None
+
+    def predict_features(self, batch: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (logits, penultimate-layer features) from one pass, for the embedding index (app/services/embedding_index.py),
+        or None when the engine only exposes its final output.
+        """
+        return None
+
+    def describe(self) -> dict:
+        return {"backend": self.name}
+
+    def close(self):
+        """Called once a swapped-out model has finished its last request."""
+
+
+class KerasBackend(InferenceBackend):
+    """The original float32 Keras model, run through full TensorFlow."""
+    name = "keras"
+
+    def __init__(self, model_path: str):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self._model = tf.keras.models.load_model(model_path)
+        self._logits_model = self._build_logits_model(tf, self._model)
+        # Logits plus the head's input (MobileNetV2's 1280-d pooled features), both from one pass
+        self._features_model = None
+        if self._logits_model is not None:
+            self._features_model = tf.keras.Model(self._model.inputs,
+                                                  [self._logits_model.output, self._model.layers[-1].input])
+        self.provides_features = self._features_model is not None
+
+    @staticmethod
+    def _build_logits_model(tf, model):
+        """Same network with a linear copy of the softmax head, for energy-based OOD scores."""
+        layers = getattr(model, "layers", None)
+        if not layers or getattr(layers[-1], "activation", None) is not tf.keras.activations.softmax:
+            return None
+        head = layers[-1]
+        try:
+            config = head.get_config()
+            config["activation"] = "linear"
+            linear_head = type(head).from_config(config)
+            outputs = linear_head(head.input)
+            linear_head.set_weights(head.get_weights())
+            return tf.keras.Model(model.inputs, outputs)
+        except Exception as e:
+            logger.warning(f"Could not expose logits for {model.name}: {e}")
+            return None
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self._model.predict(batch, batch_size=len(batch), verbose=0)
+
+    def predict_logits(self, batch: np.ndarray) -> Optional[np.ndarray]:
+        if self._logits_model is None:
+            return None
+        return self._logits_model.predict(batch, batch_size=len(batch), verbose=0)
+
+    def predict_features(self, batch: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        if self._features_model is None:
+            return None
+        logits, features = self._features_model.predict(batch, batch_size=len(batch), verbose=0)
+        return logits, features
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "model_path": self.model_path}
+
+
+def _load_tflite_interpreter():
+    """Prefer the standalone runtimes so TFLite workers never import full TensorFlow."""
+    try:
+        from tflite_runtime.interpreter import Interpreter, OpResolverType
+        return Interpreter, OpResolverType
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter, OpResolverType
+        return Interpreter, OpResolverType
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+
+
+class TFLiteBackend(InferenceBackend):
+    """
+    Quantized (dynamic-range or full-int8) TFLite model built by app.model.convert_tflite.
+
+    XNNPACK is the interpreter's default CPU delegate; it is kept unless
+    use_xnnpack is False. The interpreter is not thread-safe, so invocations
+    from the request threadpool are serialized.
+    """
+    name = "tflite"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None, use_xnnpack: bool = True):
+        Interpreter, OpResolverType = _load_tflite_interpreter()
+        kwargs = {"model_path": model_path, "num_threads": num_threads or os.cpu_count() or 1}
+        if not use_xnnpack:
+            kwargs["experimental_op_resolver_type"] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+
+        self.model_path = model_path
+        self.num_threads = kwargs["num_threads"]
+        self.use_xnnpack = use_xnnpack
+        self._interpreter = Interpreter(**kwargs)
+        self._interpreter.allocate_tensors()
+        self._lock = threading.Lock()
+
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        self._input_scale, self._input_zero_point = self._input["quantization"]
+        self._output_scale, self._output_zero_point = self._output["quantization"]
+
+    def _quantize(self, batch: np.ndarray) -> np.ndarray:
+        dtype = self._input["dtype"]
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        info = np.iinfo(dtype)
+        q = np.round(batch / self._input_scale + self._input_zero_point)
+        return np.clip(q, info.min, info.max).astype(dtype)
+
+    def _dequantize(self, out: np.ndarray) -> np.ndarray:
+        if out.dtype == np.float32:
+            return out
+        return ((out.astype(np.float32) - self._output_zero_point) * self._output_scale).astype(np.float32)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        interp = self._interpreter
+        with self._lock:
+            if len(batch) != self._batch_size:
+                # Resizing re-plans the graph, so keep the last batch size around for the next call
+                interp.resize_tensor_input(self._input["index"], [len(batch), *batch.shape[1:]])
+                interp.allocate_tensors()
+                self._batch_size = len(batch)
+            interp.set_tensor(self._input["index"], self._quantize(batch))
+            interp.invoke()
+            out = interp.get_tensor(self._output["index"])
+        return self._dequantize(out)
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name,
+            "model_path": self.model_path,
+            "input_dtype": np.dtype(self._input["dtype"]).name,
+            "num_threads": self.num_threads,
+            "xnnpack": self.use_xnnpack,
+        }
+
+
+_ORT_OPT_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    ONNX export of the classifier (app.model.convert_onnx) on ONNX Runtime's CPU provider.
+
+    InferenceSession.run is thread-safe, so concurrent requests share one
+    session. Models exported with a fixed batch dimension are fed in
+    fixed-size chunks, padding the last one.
+    """
+    name = "onnx"
+
+    def __init__(self, model_path: str, intra_op_threads: Optional[int] = None, inter_op_threads: int = 1,
+                 optimization: str = "all"):
+        import onnxruntime as ort
+
+        if optimization not in _ORT_OPT_LEVELS:
+            raise ValueError(f"Unknown ONNX graph optimization level '{optimization}'")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 1
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL if inter_op_threads > 1
+                                  else ort.ExecutionMode.ORT_SEQUENTIAL)
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, _ORT_OPT_LEVELS[optimization])
+
+        self.model_path = model_path
+        self.optimization = optimization
+        self.intra_op_threads = options.intra_op_num_threads
+        self.inter_op_threads = inter_op_threads
+        self._session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._output_name = self._session.get_outputs()[0].name
+        # Symbolic (dynamic) batch dimensions come back as strings or None
+        self._fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        size = self._fixed_batch
+        if size is None or len(batch) == size:
+            return self._session.run([self._output_name], {self._input_name: batch})[0]
+
+        outputs = []
+        for start in range(0, len(batch), size):
+            chunk = batch[start:start + size]
+            if len(chunk) < size:
+                chunk = np.concatenate([chunk, np.zeros((size - len(chunk), *chunk.shape[1:]), dtype=np.float32)])
+            outputs.append(self._session.run([self._output_name], {self._input_name: chunk})[0])
+        return np.concatenate(outputs)[:len(batch)]
+
+    def describe(self) -> dict:
+        return {
+            "backend": self.name,
+            "model_path": self.model_path,
+            "batch": self._fixed_batch or "dynamic",
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "optimization": self.optimization,
+        }
+
+
+class RemoteBackend(InferenceBackend):
+    """
+    Client for the shared per-host model server (app.model.server).
+
+    Each request thread keeps its own socket and shared-memory segment, so
+    concurrent requests from the API threadpool don't serialize here; the
+    server batches them instead. Segments are unlinked at exit.
+    """
+    name = "remote"
+
+    # Initial segment size: a batch of 8 224x224x3 float32 tensors
+    _MIN_SEGMENT_BYTES = 8 * 224 * 224 * 3 * 4
+
+    def __init__(self, socket_path: str, use_shared_memory: bool = True, timeout: float = 60.0):
+        self.socket_path = socket_path
+        self.use_shared_memory = use_shared_memory
+        self.timeout = timeout
+        self._local = threading.local()
+        self._segments = set()
+        self._segments_lock = threading.Lock()
+        atexit.register(self.close)
+        self.ping()
+
+    def _connection(self) -> socket.socket:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+            self._local.conn = conn
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _segment(self, nbytes: int):
+        from multiprocessing import shared_memory
+
+        shm = getattr(self._local, "shm", None)
+        if shm is None or shm.size < nbytes:
+            if shm is not None:
+                self._release(shm)
+            shm = shared_memory.SharedMemory(create=True, size=max(nbytes, self._MIN_SEGMENT_BYTES))
+            with self._segments_lock:
+                self._segments.add(shm)
+            self._local.shm = shm
+        return shm
+
+    def _release(self, shm):
+        with self._segments_lock:
+            self._segments.discard(shm)
+        shm.close()
+        shm.unlink()
+
+    def _request(self, batch: np.ndarray) -> np.ndarray:
+        n, height, width, channels = batch.shape
+        conn = self._connection()
+        if self.use_shared_memory:
+            shm = self._segment(batch.nbytes)
+            np.ndarray(batch.shape, dtype=np.float32, buffer=shm.buf)[...] = batch
+            name = shm.name.encode()
+            conn.sendall(ipc.REQUEST.pack(ipc.MAGIC, n, height, width, channels, len(name)) + name)
+        else:
+            conn.sendall(ipc.REQUEST.pack(ipc.MAGIC, n, height, width, channels, 0))
+            conn.sendall(memoryview(batch).cast("B"))
+
+        status, count, size = ipc.REPLY.unpack(ipc.recv_exact(conn, ipc.REPLY.size))
+        if status != ipc.STATUS_OK:
+            raise RuntimeError(f"Model server error: {bytes(ipc.recv_exact(conn, size)).decode()}")
+        return np.frombuffer(ipc.recv_exact(conn, count * size * 4), dtype=np.float32).reshape(count, size)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        try:
+            return self._request(batch)
+        except (ConnectionError, socket.timeout, OSError):
+            # The server may have restarted; retry once on a fresh connection
+            self._drop_connection()
+            return self._request(batch)
+
+    def ping(self):
+        conn = self._connection()
+        conn.sendall(ipc.REQUEST.pack(ipc.MAGIC, 0, 0, 0, 0, 0))
+        ipc.recv_exact(conn, ipc.REPLY.size)
+
+    def close(self):
+        with self._segments_lock:
+            segments = list(self._segments)
+        for shm in segments:
+            try:
+                self._release(shm)
+            except (FileNotFoundError, BufferError):
+                pass
+
+    def describe(self) -> dict:
+        return {"backend": self.name, "socket": self.socket_path, "shared_memory": self.use_shared_memory}
+
+
+_BACKENDS: Dict[str, Callable[..., InferenceBackend]] = {}
+
+
+def register_backend(name: str, factory: Callable[..., InferenceBackend]):
+    _BACKENDS[name] = factory
+
+
+def create_backend(name: str, **options) -> InferenceBackend:
+    try:
+        factory = _BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend '{name}'. Expected one of: {', '.join(sorted(_BACKENDS))}")
+    backend = factory(**options)
+    logger.info(f"Inference backend ready: {backend.describe()}")
+    return backend
+
+
+register_backend("keras", lambda model_path, **_: KerasBackend(model_path))
+register_backend("tflite", lambda model_path, num_threads=None, use_xnnpack=True, **_:
+                 TFLiteBackend(model_path, num_threads=num_threads, use_xnnpack=use_xnnpack))
+register_backend("onnx", lambda model_path, num_threads=None, onnx_inter_op_threads=1, onnx_optimization="all", **_:
+                 OnnxBackend(model_path, intra_op_threads=num_threads, inter_op_threads=onnx_inter_op_threads,
+                             optimization=onnx_optimization))
+register_backend("remote", lambda socket_path, use_shared_memory=True, **_:
+                 RemoteBackend(socket_path, use_shared_memory=use_shared_memory))
@@ -0,0 +1,333 @@
+"""
+Confidence calibration and out-of-distribution rejection for the local model.
+
+Fitted offline on a held-out labelled set (and optionally a set of
+non-plant / non-PlantVillage images), stored as weights/calibration.json
+next to the model, and applied at inference time with a few numpy ops:
+
+  * temperature scaling: softmax(logits / T), with T fitted by minimizing
+    NLL. Backends that only expose probabilities use log-probabilities,
+    which are the logits up to a per-sample constant, so the result is
+    identical.
+  * an in-distribution score: the negative energy T=1 (logsumexp of the
+    logits) when the backend exposes logits, else the calibrated max
+    softmax. Each has its own threshold, set so that --target-tpr of the
+    held-out set passes.
+  * per-class confidence thresholds: the lowest calibrated confidence at
+    which the class's held-out predictions reach --target-precision.
+
+Fit from the backend directory:
+    python -m app.model.calibration --val-dir data/plantvillage/val --ood-dir data/ood
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger("plantcare")
+
+# Used for every class when no calibration file is present (the previous hard-coded global threshold)
+DEFAULT_THRESHOLD = 0.65
+SCORE_ENERGY = "energy"
+SCORE_MAX_SOFTMAX = "max_softmax"
+
+
+def log_softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=1, keepdims=True))
+
+
+def logsumexp(logits: np.ndarray) -> np.ndarray:
+    peak = logits.max(axis=1)
+    return peak + np.log(np.exp(logits - peak[:, None]).sum(axis=1))
+
+
+def file_sha256(path: str) -> Optional[str]:
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Calibration:
+    def __init__(self, temperature: float = 1.0, class_thresholds: Optional[List[float]] = None,
+                 default_threshold: float = DEFAULT_THRESHOLD, ood_thresholds: Optional[Dict[str, float]] = None,
+                 fitted: bool = False):
+        self.temperature = float(temperature)
+        self.default_threshold = float(default_threshold)
+        self.class_thresholds = np.asarray(class_thresholds, dtype=np.float32) if class_thresholds else None
+        self.ood_thresholds = ood_thresholds or {}
+        self.fitted = fitted
+
+    def apply(self, probs: Optional[np.ndarray] = None,
+              logits: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, str]:
+        """Returns (calibrated probabilities, in-distribution score per row, score kind)."""
+        if logits is None:
+            logits = np.log(np.clip(probs, 1e-12, None))
+            kind = SCORE_MAX_SOFTMAX
+        else:
+            kind = SCORE_ENERGY
+        calibrated = np.exp(log_softmax(logits / self.temperature)).astype(np.float32)
+        scores = logsumexp(logits) if kind == SCORE_ENERGY else calibrated.max(axis=1)
+        return calibrated, scores, kind
+
+    def threshold_for(self, class_index: int) -> float:
+        if self.class_thresholds is not None and class_index < len(self.class_thresholds):
+            return float(self.class_thresholds[class_index])
+        return self.default_threshold
+
+    def accept(self, class_index: int, confidence: float, score: Optional[float] = None,
+               score_kind: Optional[str] = None) -> bool:
+        """True when the prediction is both in-distribution and confident enough for its class."""
+        if score is not None and score_kind in self.ood_thresholds and score < self.ood_thresholds[score_kind]:
+            return False
+        return confidence >= self.threshold_for(class_index)
+
+    def to_dict(self) -> dict:
+        return {
+            "temperature": self.temperature,
+            "default_threshold": self.default_threshold,
+            "class_thresholds": self.class_thresholds.round(4).tolist() if self.class_thresholds is not None else None,
+            "ood_thresholds": self.ood_thresholds,
+        }
+
+    @classmethod
+    def load(cls, path: str, model_path: Optional[str] = None) -> "Calibration":
+        with open(path) as f:
+            data = json.load(f)
+        expected = data.get("model_sha256")
+        if expected and model_path and file_sha256(model_path) not in (None, expected):
+            logger.warning(f"{path} was fitted for a different model file than {model_path}; refit it")
+        return cls(
+            temperature=data.get("temperature", 1.0),
+            class_thresholds=data.get("class_thresholds"),
+            default_threshold=data.get("default_threshold", DEFAULT_THRESHOLD),
+            ood_thresholds=data.get("ood_thresholds"),
+            fitted=True,
+        )
+
+
+def load_calibration(path: str, model_path: Optional[str] = None,
+                     default_threshold: float = DEFAULT_THRESHOLD) -> Calibration:
+    """Calibration from path, or T=1 and default_threshold for every class when the file doesn't exist."""
+    try:
+        calibration = Calibration.load(path, model_path)
+        logger.info(f"Loaded calibration from {path}: T={calibration.temperature:.3f}")
+        return calibration
+    except FileNotFoundError:
+        logger.warning(f"No calibration at {path}; using T=1 and threshold {default_threshold}")
+        return Calibration(default_threshold=default_threshold)
+
+
+_uncalibrated = Calibration()
+
+
+def get_calibration() -> Calibration:
+    """Calibration for the model currently being served (loaded with it, see app/model/loader.py)."""
+    from app.model.loader import get_loaded_model
+
+    loaded = get_loaded_model()
+    return loaded.calibration if loaded is not None else _uncalibrated
+
+
+# ---------------------------------------------------------------------------
+# Offline fitting
+# ---------------------------------------------------------------------------
+
+def fit_temperature(logits: np.ndarray, labels: np.ndarray) -> float:
+    """Golden-section search for the NLL-minimizing temperature over log T in [log 0.05, log 20]."""
+    def nll(log_t):
+        return -log_softmax(logits / np.exp(log_t))[np.arange(len(labels)), labels].mean()
+
+    lo, hi = np.log(0.05), np.log(20.0)
+    ratio = (np.sqrt(5) - 1) / 2
+    a, b = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+    fa, fb = nll(a), nll(b)
+    for _ in range(60):
+        if fa < fb:
+            hi, b, fb = b, a, fa
+            a = hi - ratio * (hi - lo)
+            fa = nll(a)
+        else:
+            lo, a, fa = a, b, fb
+            b = lo + ratio * (hi - lo)
+            fb = nll(b)
+    return float(np.exp((lo + hi) / 2))
+
+
+def expected_calibration_error(probs: np.ndarray, labels: np.ndarray, bins: int = 15) -> float:
+    confidence = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == labels
+    edges = np.linspace(0, 1, bins + 1)
+    ece = 0.0
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        mask = (confidence > lo) & (confidence <= hi)
+        if mask.any():
+            ece += mask.mean() * abs(correct[mask].mean() - confidence[mask].mean())
+    return float(ece)
+
+
+def precision_threshold(confidence: np.ndarray, correct: np.ndarray, target: float) -> Optional[float]:
+    """Lowest confidence cut-off at which the predictions above it are at least `target` precise."""
+    order = np.argsort(-confidence)
+    precision = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    passing = np.nonzero(precision >= target)[0]
+    if len(passing) == 0:
+        return None
+    return float(confidence[order][passing[-1]])
+
+
+def auroc(positive: np.ndarray, negative: np.ndarray) -> float:
+    """Probability that an in-distribution sample outscores an OOD one (rank-based)."""
+    scores = np.concatenate([positive, negative])
+    ranks = scores.argsort().argsort() + 1
+    pos_ranks = ranks[: len(positive)].sum()
+    return float((pos_ranks - len(positive) * (len(positive) + 1) / 2) / (len(positive) * len(negative)))
+
+
+def fit(logits: np.ndarray, labels: np.ndarray, has_logits: bool, ood_logits: Optional[np.ndarray] = None,
+        target_tpr: float = 0.95, target_precision: float = 0.9, min_support: int = 20) -> Tuple[Calibration, dict]:
+    """logits may be log-probabilities when the backend has no logits head (has_logits=False)."""
+    temperature = fit_temperature(logits, labels)
+    calibration = Calibration(temperature=temperature)
+    probs = calibration.apply(logits=logits)[0]
+    num_classes = logits.shape[1]
+
+    predicted = probs.argmax(axis=1)
+    confidence = probs.max(axis=1)
+    correct = predicted == labels
+    default = precision_threshold(confidence, correct, target_precision)
+    calibration.default_threshold = default if default is not None else DEFAULT_THRESHOLD
+    thresholds = []
+    for c in range(num_classes):
+        mask = predicted == c
+        threshold = None
+        if mask.sum() >= min_support:
+            threshold = precision_threshold(confidence[mask], correct[mask], target_precision)
+            # A class that never reaches the target precision is never accepted locally
+            threshold = 1.0 if threshold is None else threshold
+        thresholds.append(threshold if threshold is not None else calibration.default_threshold)
+    calibration.class_thresholds = np.asarray(thresholds, dtype=np.float32)
+
+    id_scores = {SCORE_MAX_SOFTMAX: confidence}
+    if has_logits:
+        id_scores[SCORE_ENERGY] = logsumexp(logits)
+    calibration.ood_thresholds = {
+        kind: float(np.quantile(scores, 1 - target_tpr)) for kind, scores in id_scores.items()
+    }
+
+    raw_probs = np.exp(log_softmax(logits))
+    accepted = np.array([calibration.accept(int(p), float(cf)) for p, cf in zip(predicted, confidence)])
+    metrics = {
+        "samples": int(len(labels)),
+        "accuracy": round(float(correct.mean()), 4),
+        "ece_before": round(expected_calibration_error(raw_probs, labels), 4),
+        "ece_after": round(expected_calibration_error(probs, labels), 4),
+        "accepted_rate": round(float(accepted.mean()), 4),
+    }
+    if accepted.any():
+        metrics["accepted_precision"] = round(float(correct[accepted].mean()), 4)
+    if ood_logits is not None and len(ood_logits):
+        ood_probs = calibration.apply(logits=ood_logits)[0]
+        ood_scores = {SCORE_MAX_SOFTMAX: ood_probs.max(axis=1)}
+        if has_logits:
+            ood_scores[SCORE_ENERGY] = logsumexp(ood_logits)
+        for kind, scores in ood_scores.items():
+            metrics[f"ood_auroc_{kind}"] = round(auroc(id_scores[kind], scores), 4)
+            metrics[f"ood_fpr_{kind}"] = round(float(np.mean(scores >= calibration.ood_thresholds[kind])), 4)
+        kind = SCORE_ENERGY if has_logits else SCORE_MAX_SOFTMAX
+        metrics["ood_accepted_rate"] = round(float(np.mean([
+            calibration.accept(int(p), float(ood_probs[i, p]), float(ood_scores[kind][i]), kind)
+            for i, p in enumerate(ood_probs.argmax(axis=1))
+        ])), 4)
+    return calibration, metrics
+
+
+def _collect(backend, manifest, paths: List[str], batch_size: int = 32) -> Tuple[np.ndarray, bool]:
+    from app.model.inference import decode_image, image_to_tensor
+
+    outputs, has_logits = [], True
+    for start in range(0, len(paths), batch_size):
+        tensors = []
+        for path in paths[start:start + batch_size]:
+            with open(path, "rb") as f:
+                tensors.append(image_to_tensor(decode_image(f.read()), manifest))
+        batch = np.stack(tensors)
+        logits = backend.predict_logits(batch)
+        if logits is None:
+            has_logits = False
+            logits = np.log(np.clip(backend.predict(batch), 1e-12, None))
+        outputs.append(logits)
+    return np.concatenate(outputs).astype(np.float64), has_logits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--val-dir", required=True, help="Held-out PlantVillage-style set, one folder per class")
+    parser.add_argument("--ood-dir", default=None, help="Images the model should reject (non-plants, other crops)")
+    parser.add_argument("--backend", default="keras")
+    parser.add_argument("--limit", type=int, default=5000, help="Images to use from each set, sampled at random")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--target-tpr", type=float, default=0.95)
+    parser.add_argument("--target-precision", type=float, default=0.9)
+    parser.add_argument("--min-support", type=int, default=20)
+    parser.add_argument("--out", default=settings.calibration_path)
+    args = parser.parse_args()
+
+    from app.model.convert_tflite import find_images
+    from app.model.loader import load_backend, _model_path_for, _weights_path_for
+    from app.model.manifest import load_manifest
+
+    manifest = load_manifest(_weights_path_for(args.backend))
+    classes = list(manifest.classes)
+    class_dirs = sorted(d for d in os.listdir(args.val_dir) if os.path.isdir(os.path.join(args.val_dir, d)))
+    if len(class_dirs) == len(classes):
+        label_of = {d: i for i, d in enumerate(class_dirs)}
+    else:
+        label_of = {d: classes.index(d) for d in class_dirs if d in classes}
+    # find_images is sorted, so a plain slice would only cover the first class folders
+    rng = random.Random(args.seed)
+    labelled = [path for path in find_images(args.val_dir)
+                if os.path.relpath(path, args.val_dir).split(os.sep)[0] in label_of]
+    rng.shuffle(labelled)
+    paths = labelled[: args.limit]
+    labels = [label_of[os.path.relpath(path, args.val_dir).split(os.sep)[0]] for path in paths]
+    if not paths:
+        parser.error(f"No labelled images found under {args.val_dir}")
+
+    backend = load_backend(args.backend)
+    logits, has_logits = _collect(backend, manifest, paths)
+    ood_logits = None
+    if args.ood_dir:
+        ood_paths = find_images(args.ood_dir)
+        rng.shuffle(ood_paths)
+        ood_logits, _ = _collect(backend, manifest, ood_paths[: args.limit])
+
+    calibration, metrics = fit(logits, np.array(labels), has_logits, ood_logits, args.target_tpr,
+                               args.target_precision, args.min_support)
+    document = {
+        "version": 1,
+        "model_sha256": file_sha256(_model_path_for(args.backend)),
+        "backend": args.backend,
+        "classes": classes,
+        **calibration.to_dict(),
+        "targets": {"tpr": args.target_tpr, "precision": args.target_precision},
+        "metrics": metrics,
+    }
+    with open(args.out, "w") as f:
+        json.dump(document, f, indent=2)
+    print(json.dumps({"out": args.out, "temperature": round(calibration.temperature, 4), **metrics}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
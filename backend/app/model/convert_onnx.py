@@ -0,0 +1,68 @@
+"""
+Export weights/model.keras to ONNX for the ONNX Runtime backend.
+
+The batch dimension is dynamic by default; --static-batch N pins it, which
+lets ONNX Runtime pre-plan memory (the backend pads partial batches).
+After export the ONNX model is run once against Keras on random inputs and
+the script fails if the outputs diverge.
+
+Run from the backend directory:
+    python -m app.model.convert_onnx
+    python -m app.model.convert_onnx --static-batch 8 --out weights/model_b8.onnx
+
+Then set INFERENCE_BACKEND=onnx and ONNX_MODEL_PATH to the output file.
+Serving needs onnxruntime (in requirements.txt); export also needs tf2onnx (pip install tf2onnx).
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+
+def export(model_path: str, out: str, opset: int = 17, static_batch: int = None):
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(model_path)
+    height, width, channels = model.input_shape[1:]
+    spec = (tf.TensorSpec((static_batch, height, width, channels), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=out)
+    return model
+
+
+def check_equivalence(model, onnx_path: str, batch: int, atol: float) -> float:
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    sample = np.random.default_rng(0).uniform(-1, 1, (batch, *model.input_shape[1:])).astype(np.float32)
+    expected = model.predict(sample, verbose=0)
+    actual = session.run(None, {session.get_inputs()[0].name: sample})[0]
+    max_diff = float(np.max(np.abs(expected - actual)))
+    if max_diff > atol or not np.array_equal(expected.argmax(axis=1), actual.argmax(axis=1)):
+        raise ValueError(f"ONNX output diverges from Keras (max abs diff {max_diff:.2e}, atol {atol:.0e})")
+    return max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="weights/model.keras")
+    parser.add_argument("--out", default="weights/model.onnx")
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--static-batch", type=int, default=None)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    model = export(args.model, args.out, args.opset, args.static_batch)
+    try:
+        max_diff = check_equivalence(model, args.out, args.static_batch or 4, args.atol)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    size_mb = os.path.getsize(args.out) / (1024 * 1024)
+    print(f"Wrote {args.out}: {size_mb:.1f} MB, max abs diff vs Keras {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
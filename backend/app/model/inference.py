@@ -2,41 +2,172 @@ import logging
 import numpy as np
 import io
 import time
+from typing import List, Optional, Tuple
+from numpy.lib.stride_tricks import sliding_window_view
 from PIL import Image, UnidentifiedImageError
-import pillow_avif
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-from tensorflow.keras.preprocessing import image
-from app.model.loader import get_model
+from app.config import settings
+from app.model.loader import LoadedModel, get_loaded_model, get_manifest, models
+from app.model.manifest import ModelManifest
+from app.model.shadow import shadow_evaluator
+from app.model.tiling import image_tiles, merge_tiles, multi_disease, record_forward, tile_batch
+from app.services.metrics import timed
 from app.services.disease_mapper import disease_mapper
+from app.services.image_formats import register_avif_if_needed
+from app.services.leaf_analysis import analyze_leaf
+from app.services.leaf_roi import crop_to_leaf
 
 logger = logging.getLogger("plantcare")
 
-def preprocess_image(image_bytes: bytes) -> np.ndarray:
-    """Preprocess the image to 224x224 EXACTLY as in the Colab training script"""
-    # 1. Load image using Keras specifically (matches Colab)
+def decode_image(image_bytes: bytes) -> Image.Image:
+    """Decode uploaded bytes into an RGB PIL image, raising ValueError on anything unreadable"""
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        img = img.convert('RGB')
+        with timed("decode"):
+            register_avif_if_needed(image_bytes)
+            img = Image.open(io.BytesIO(image_bytes))
+            return img.convert('RGB')
     except UnidentifiedImageError:
         raise ValueError("Unsupported image format. Please upload a valid JPEG, PNG, WEBP, or AVIF file.")
     except Exception as e:
         # Catch EVERY other possible parsing failure (corrupted bytes, plugin crashes, EOF)
         raise ValueError(f"Image parsing failed: {str(e)}")
-        
-    img = img.resize((224, 224))
-    
-    # 2. Convert to array using Keras (this casts to float32 unlike PIL np.array)
-    img_array = image.img_to_array(img)
-    
-    # 3. Add batch dimension
-    img_array = np.expand_dims(img_array, axis=0)
-    
-    # 4. Built-in MobileNetV2 preprocessing (-1 to 1)
-    img_array = preprocess_input(img_array)
+
+
+def _to_array(img: Image.Image, size: int, manifest: ModelManifest) -> np.ndarray:
+    img = img.resize((size, size))
     
+    # Same float32 ops as keras img_to_array + the manifest's preprocess_input (mobilenet_v2: -1 to 1),
+    # without importing TensorFlow into the API worker
+    img_array = np.asarray(img, dtype=np.float32)
+    img_array *= manifest.scale
+    img_array += manifest.offset
     return img_array
 
 
+def image_to_tensor(img: Image.Image, manifest: Optional[ModelManifest] = None) -> np.ndarray:
+    """Resize a decoded image to a single model input, 224x224x3 for MobileNetV2 (no batch dimension)"""
+    manifest = manifest or get_manifest()
+    with timed("preprocess"):
+        return _to_array(img, manifest.input_size, manifest)
+
+
+# "full" TTA crops input-size windows out of a resize 1/0.875 larger (224 out of 256) next to the full-frame view
+_TTA_CROP_SCALE = 0.875
+
+
+def tta_views(img: Image.Image, mode: str, manifest: Optional[ModelManifest] = None) -> np.ndarray:
+    """
+    Test-time augmentation views from one decoded image, as a (V, size, size, 3) batch.
+    "flip": full frame + horizontal mirror (2 views).
+    "full": adds the four corner crops, the center crop and its mirror from a larger resize (8 views).
+    """
+    manifest = manifest or get_manifest()
+    size = manifest.input_size
+    with timed("preprocess"):
+        full = _to_array(img, size, manifest)
+        views = [full[None], full[None, :, ::-1]]
+        if mode == "full":
+            crop_base = int(round(size / _TTA_CROP_SCALE))
+            base = _to_array(img, crop_base, manifest)
+            step = crop_base - size
+            corners = sliding_window_view(base, (size, size, 3))[::step, ::step, 0].reshape(-1, size, size, 3)
+            center = base[step // 2:step // 2 + size, step // 2:step // 2 + size]
+            views += [corners, center[None], center[None, :, ::-1]]
+        return np.concatenate(views)
+
+
+def image_to_model_input(img: Image.Image, manifest: Optional[ModelManifest] = None) -> np.ndarray:
+    """
+    A single input tensor, or the stacked TTA views when settings.tta_mode is enabled.
+    Taken from the leaf's region of the full-resolution image (settings.roi_crop_enabled), not the whole frame.
+    """
+    img = crop_to_leaf(img)
+    if settings.tta_mode != "off":
+        return tta_views(img, settings.tta_mode, manifest)
+    return image_to_tensor(img, manifest)
+
+
+def preprocess_image(image_bytes: bytes) -> np.ndarray:
+    """Preprocess the image EXACTLY as in the Colab training script"""
+    # Add batch dimension
+    return np.expand_dims(image_to_tensor(decode_image(image_bytes)), axis=0)
+
+
+def _forward(model: LoadedModel, batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, str, Optional[np.ndarray]]:
+    """
+    Forward pass returning calibrated probabilities, a per-row in-distribution score, the score kind and
+    per-row features for the embedding index (None when it is off or the backend has no feature output).
+    Backends that expose logits get an energy score; the rest fall back to calibrated max softmax.
+    """
+    if settings.embedding_index_enabled:
+        outputs = model.backend.predict_features(batch)
+        if outputs is not None:
+            logits, features = outputs
+            return (*model.calibration.apply(logits=logits), features)
+    logits = model.backend.predict_logits(batch)
+    if logits is None:
+        return (*model.calibration.apply(probs=model.backend.predict(batch)), None)
+    return (*model.calibration.apply(logits=logits), None)
+
+
+def _embedding(features: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    """One image's embedding: its views' features averaged and L2-normalized, as float16 like the index stores it."""
+    if features is None or not len(features):
+        return None
+    vector = features.reshape(len(features), -1).mean(axis=0)
+    norm = float(np.linalg.norm(vector))
+    return (vector / norm).astype(np.float16) if norm > 0 else None
+
+
+def _aggregate_views(preds: np.ndarray) -> Tuple[int, float, Optional[dict]]:
+    """
+    Reduce per-view probabilities (V, classes) to a top class and confidence.
+    With several views the probabilities are averaged and the confidence is discounted by how much
+    the views disagree on the winning class, so unstable predictions stop looking certain.
+    """
+    if len(preds) == 1:
+        return int(np.argmax(preds[0])), float(np.max(preds[0])), None
+    
+    mean = preds.mean(axis=0)
+    top_class_index = int(np.argmax(mean))
+    spread = float(preds[:, top_class_index].std())
+    confidence = max(0.0, float(mean[top_class_index]) - settings.tta_spread_penalty * spread)
+    tta = {
+        "views": len(preds),
+        "agreement": float(np.mean(preds.argmax(axis=1) == top_class_index)),
+        "mean_confidence": float(mean[top_class_index]),
+        "spread": spread,
+    }
+    return top_class_index, confidence, tta
+
+
+def _map_prediction(top_class_index: int, confidence: float, score: Optional[float] = None,
+                    score_kind: Optional[str] = None, model: Optional[LoadedModel] = None) -> str:
+    """
+    Map an argmax index to the manifest's class ID, or "unknown" when the fitted calibration rejects it:
+    either the in-distribution score says the image isn't a known leaf at all, or the
+    confidence is below that class's threshold.
+    """
+    model = model or get_loaded_model()
+    classes = model.manifest.classes if model is not None else get_manifest().classes
+    if top_class_index >= len(classes):
+        return "unknown"
+    if model is not None and not model.calibration.accept(top_class_index, confidence, score, score_kind):
+        logger.info(f"Rejected {classes[top_class_index]} (confidence {confidence:.3f}, {score_kind} {score})")
+        return "unknown"
+    return classes[top_class_index]
+
+
+def _classify(model: LoadedModel, batch: np.ndarray, offsets: List[int]) -> List[Tuple[str, float]]:
+    """(class ID, confidence) per image of a batch split at offsets, as the API would answer it."""
+    preds, scores, score_kind, _ = _forward(model, batch)
+    results = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        top_class_index, confidence, _ = _aggregate_views(preds[start:end])
+        score = float(scores[start:end].mean())
+        results.append((_map_prediction(top_class_index, confidence, score, score_kind, model), confidence))
+    return results
+
+
 def generate_heatmap(image_array: np.ndarray) -> list:
     """Generate Grad-CAM heatmap regions"""
     # This is a placeholder for actual Grad-CAM logic
@@ -47,9 +178,14 @@ def generate_heatmap(image_array: np.ndarray) -> list:
 
 def run_inference(image_bytes: bytes) -> dict:
     """Run model inference and return top predictions"""
-    start_time = time.time()
-    
-    model = get_model()
+    # One LoadedModel for the whole request, so a hot swap can't mix manifests mid-way
+    # or release the engine under it
+    with models.acquire() as model:
+        return _run_inference(model, image_bytes)
+
+
+def _run_inference(model: Optional[LoadedModel], image_bytes: bytes) -> dict:
+    start_time = time.perf_counter()
     
     if model is None:
         # Fallback if model failed to load but server didn't crash
@@ -57,17 +193,32 @@ def run_inference(image_bytes: bytes) -> dict:
             "class_id": "healthy",
             "confidence": 0.5,
             "heatmap": [],
-            "processing_time": int((time.time() - start_time) * 1000)
+            "processing_time": int((time.perf_counter() - start_time) * 1000)
         }
     
-    img_tensor = preprocess_image(image_bytes)
+    img = decode_image(image_bytes)
+    img_tensor = image_to_model_input(img, model.manifest)
+    tiles = image_tiles(img, model.manifest)
+    leaf = analyze_leaf(img)
+    if img_tensor.ndim == 3:
+        img_tensor = np.expand_dims(img_tensor, axis=0)
+    # Tiles ride along in the same forward pass as the whole-image view(s)
+    batch = np.concatenate([img_tensor, tile_batch(tiles, model.manifest)]) if tiles else img_tensor
     
-    # Get raw predictions array [[0.1, 0.8, 0.05, ...]]
-    preds = model.predict(img_tensor)[0] 
+    # Get calibrated predictions array [[0.1, 0.8, 0.05, ...]], one row per view
+    forward_started = time.perf_counter()
+    with timed("forward"):
+        preds, scores, score_kind, features = _forward(model, batch)
+    forward_s = time.perf_counter() - forward_started
+    record_forward(len(batch), forward_s)
+    views = len(img_tensor)
+    embedding = _embedding(features[:views] if features is not None else None)
+    merged = merge_tiles(tiles, preds[views:], scores[views:], score_kind, model) if tiles else None
+    preds, scores = preds[:views], scores[:views]
     
-    # Get index of highest confidence
-    top_class_index = int(np.argmax(preds))
-    confidence = float(np.max(preds))
+    # Get index of highest (view-averaged) confidence
+    top_class_index, confidence, tta = _aggregate_views(preds)
+    ood_score = float(scores.mean())
     
     # ==========================================
     # DEBUGGING: Print exact Colab comparisons
@@ -75,74 +226,112 @@ def run_inference(image_bytes: bytes) -> dict:
     logger.debug(f"Raw preds: {preds}")
     logger.debug(f"Predicted index: {top_class_index}")
     logger.debug(f"Confidence: {confidence}")
+    logger.debug(f"In-distribution score ({score_kind}): {ood_score}")
     
-    # MobileNetV2 was trained on the 38-class PlantVillage dataset.
-    # We map all 38 indexes to their corresponding string IDs.
-    PLANT_VILLAGE_CLASSES = [
-        "apple-scab", # 0
-        "apple-black-rot", # 1
-        "apple-cedar-rust", # 2
-        "apple-healthy", # 3
-        "blueberry-healthy", # 4
-        "cherry-powdery-mildew", # 5
-        "cherry-healthy", # 6
-        "corn-cercospora-leaf-spot", # 7
-        "corn-rust", # 8
-        "corn-northern-leaf-blight", # 9
-        "corn-healthy", # 10
-        "grape-black-rot", # 11
-        "grape-esca", # 12
-        "grape-leaf-blight", # 13
-        "grape-healthy", # 14
-        "orange-haunglongbing", # 15
-        "peach-bacterial-spot", # 16
-        "peach-healthy", # 17
-        "pepper-bell-bacterial-spot", # 18
-        "pepper-bell-healthy", # 19
-        "potato-early-blight", # 20
-        "potato-late-blight", # 21
-        "potato-healthy", # 22
-        "raspberry-healthy", # 23
-        "soybean-healthy", # 24
-        "squash-powdery-mildew", # 25
-        "strawberry-leaf-scorch", # 26
-        "strawberry-healthy", # 27
-        "tomato-bacterial-spot", # 28
-        "tomato-early-blight", # 29
-        "tomato-late-blight", # 30
-        "tomato-leaf-mold", # 31
-        "tomato-septoria-leaf-spot", # 32
-        "tomato-spider-mites", # 33
-        "tomato-target-spot", # 34
-        "tomato-yellow-leaf-curl-virus", # 35
-        "tomato-mosaic-virus", # 36
-        "tomato-healthy", # 37
-    ]
-    
-    # Extract mapped ID safely. MobileNetV2 can hallucinate random plants (e.g. Blueberry) on non-plant images.
-    # Softmax naturally pushes out-of-distribution junk to near 1.0 confidence for generic classes like 'blueberry-healthy'.
-    global_threshold = 0.65
-    
-    if top_class_index < len(PLANT_VILLAGE_CLASSES) and confidence >= global_threshold:
-        top_class_id = PLANT_VILLAGE_CLASSES[top_class_index]
+    top_class_id = _map_prediction(top_class_index, confidence, ood_score, score_kind, model)
         
-        # AGGRESSIVE FILTER: "blueberry-healthy" is the model's favorite hallucination for unknown generic leaves.
-        # Softmax outputs frequently saturate to exactly 1.0 confidence for this class due to float32 rounding.
-        # Since Gemini handles real blueberries perfectly, we aggressively route this MobileNet fallback directly to unknown.
-        if top_class_id == "blueberry-healthy":
-            logger.info(f"Targeted rejection of blueberry-healthy hallucination (confidence {confidence})")
-            top_class_id = "unknown"
-    else:
-        top_class_id = "unknown"
-        
-    heatmap = generate_heatmap(img_tensor)
-    processing_time = int((time.time() - start_time) * 1000)
+    heatmap = merged["heatmap"] if merged else generate_heatmap(img_tensor)
+    processing_time = int((time.perf_counter() - start_time) * 1000)
     
-    logger.info(f"Predicted class index: {top_class_index}, ID mapped: {top_class_id}, Conf: {confidence}")
+    logger.info(f"Predicted class index: {top_class_index}, ID mapped: {top_class_id}, Conf: {confidence}"
+                + (f", TTA: {tta}" if tta else ""))
     
-    return {
+    result = {
         "class_id": top_class_id,
         "confidence": confidence,
+        "ood_score": {"kind": score_kind, "value": ood_score},
         "heatmap": heatmap,
+        "multi_disease": multi_disease(top_class_id, merged),
+        "leaf_analysis": leaf,
         "processing_time": processing_time
     }
+    if tta:
+        result["tta"] = tta
+    if merged:
+        result["tiles"] = {key: merged[key] for key in ("grid", "analyzed", "diseases")}
+    if embedding is not None:
+        result["embedding"] = embedding
+        result["embedding_space"] = model.manifest.embedding_space()
+    shadow_evaluator.offer(model, img_tensor, [0, len(img_tensor)], [(top_class_id, confidence)], forward_s)
+    return result
+
+
+def run_batch_inference(tensors: List[np.ndarray], tiles: Optional[List[Optional[dict]]] = None,
+                        model: Optional[LoadedModel] = None) -> List[dict]:
+    """
+    Run many preprocessed inputs through the model as a single batch.
+    Each input is a (size, size, 3) tensor or a (V, size, size, 3) stack of TTA views from image_to_model_input.
+    tiles optionally holds each image's tile plan from image_tiles (None: not tiled); the tiles join the same batch.
+    Inputs built ahead of the forward pass should be built with model.manifest of a model the caller pinned with
+    models.acquire(), and that model passed here, so a hot swap in between can't hand them to a different model.
+    """
+    if model is not None:
+        return _run_batch_inference(model, tensors, tiles)
+    with models.acquire() as model:
+        return _run_batch_inference(model, tensors, tiles)
+
+
+def _run_batch_inference(model: Optional[LoadedModel], tensors: List[np.ndarray],
+                         tiles: Optional[List[Optional[dict]]] = None) -> List[dict]:
+    start_time = time.perf_counter()
+    
+    if model is None:
+        return [{
+            "class_id": "healthy",
+            "confidence": 0.5,
+            "heatmap": [],
+            "processing_time": int((time.perf_counter() - start_time) * 1000)
+        } for _ in tensors]
+    
+    if not tensors:
+        return []
+    
+    views = [t if t.ndim == 4 else t[None] for t in tensors]
+    plans = tiles or [None] * len(tensors)
+    tile_inputs = [tile_batch(plan, model.manifest) for plan in plans if plan]
+    batch = np.concatenate(views + tile_inputs)
+    forward_started = time.perf_counter()
+    with timed("forward"):
+        preds, scores, score_kind, features = _forward(model, batch)
+    forward_s = time.perf_counter() - forward_started
+    record_forward(len(batch), forward_s)
+    
+    # Amortize the single forward pass across every image in the batch
+    processing_time = int((time.perf_counter() - start_time) * 1000 / len(tensors))
+    
+    results = []
+    offsets = np.cumsum([0] + [len(v) for v in views]).tolist()
+    # Tile rows follow all the image views, in image order
+    tile_rows = iter(np.cumsum([offsets[-1]] + [len(t) for t in tile_inputs]).tolist())
+    tile_start = next(tile_rows)
+    for i, tensor in enumerate(tensors):
+        top_class_index, confidence, tta = _aggregate_views(preds[offsets[i]:offsets[i + 1]])
+        ood_score = float(scores[offsets[i]:offsets[i + 1]].mean())
+        class_id = _map_prediction(top_class_index, confidence, ood_score, score_kind, model)
+        merged = None
+        if plans[i]:
+            tile_end = next(tile_rows)
+            merged = merge_tiles(plans[i], preds[tile_start:tile_end], scores[tile_start:tile_end], score_kind, model)
+            tile_start = tile_end
+        result = {
+            "class_id": class_id,
+            "confidence": confidence,
+            "ood_score": {"kind": score_kind, "value": ood_score},
+            "heatmap": merged["heatmap"] if merged else generate_heatmap(tensor),
+            "multi_disease": multi_disease(class_id, merged),
+            "processing_time": processing_time
+        }
+        if tta:
+            result["tta"] = tta
+        if merged:
+            result["tiles"] = {key: merged[key] for key in ("grid", "analyzed", "diseases")}
+        embedding = _embedding(features[offsets[i]:offsets[i + 1]] if features is not None else None)
+        if embedding is not None:
+            result["embedding"] = embedding
+            result["embedding_space"] = model.manifest.embedding_space()
+        results.append(result)
+    
+    logger.info(f"Batch inference: {len(tensors)} images in {int((time.perf_counter() - start_time) * 1000)}ms")
+    shadow_evaluator.offer(model, batch[:offsets[-1]], offsets, [(r["class_id"], r["confidence"]) for r in results],
+                           forward_s)
+    return results
@@ -0,0 +1,43 @@
+"""
+Wire format between API workers (RemoteBackend) and the shared model server.
+
+One request in flight per connection. A request is a fixed header plus
+either the name of a POSIX shared-memory segment holding the float32 NHWC
+batch (the normal path: the tensor itself never crosses the socket) or,
+when the name is empty, the raw tensor bytes inline. n == 0 is a ping.
+The reply carries the (n, classes) float32 probabilities inline; an error
+reply carries a UTF-8 message instead.
+"""
+import socket
+import struct
+from multiprocessing import shared_memory
+
+MAGIC = b"PCM1"
+REQUEST = struct.Struct("<4sIIIIH")  # magic, n, height, width, channels, shm name length
+REPLY = struct.Struct("<BII")  # status, n, classes (or message length when status != 0)
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytearray:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("Model server connection closed")
+        received += n
+    return buf
+
+
+def attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to a segment another process owns, without this process ever unlinking it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Older Pythons register every attach with the resource tracker, which would unlink the segment on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
@@ -1,19 +1,332 @@
-import tensorflow as tf
 from app.config import settings
+from app.model.backends import InferenceBackend, create_backend
+from app.model.calibration import Calibration, load_calibration
+from app.model.manifest import ModelManifest, load_manifest, manifest_path_for
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+import datetime
+import logging
+import numpy as np
 import os
+import threading
+import time
 
-_model = None
+logger = logging.getLogger("plantcare")
 
-def get_model():
-    """Returns the loaded model, loading it if necessary."""
-    global _model
-    if _model is None:
-        model_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), settings.model_path)
+_load_lock = threading.Lock()
+# Serializes swaps; loading the replacement happens outside _load_lock so requests never wait on it
+_swap_lock = threading.Lock()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+
+def _model_path_for(backend: str) -> str:
+    if backend == "remote":
+        return settings.model_server_socket
+    relative = {
+        "tflite": settings.tflite_model_path,
+        "onnx": settings.onnx_model_path,
+    }.get(backend, settings.model_path)
+    return os.path.join(BACKEND_DIR, relative)
+
+
+def _weights_path_for(backend: str) -> str:
+    """The weights file a backend serves; for remote that's the model server's."""
+    if backend == "remote":
+        return _model_path_for(settings.model_server_backend)
+    return _model_path_for(backend)
+
+
+def load_backend(backend: str, model_path: Optional[str] = None) -> InferenceBackend:
+    """Build an inference backend by name with the engine options from settings."""
+    return create_backend(
+        backend,
+        model_path=model_path or _model_path_for(backend),
+        num_threads=settings.inference_threads,
+        use_xnnpack=settings.tflite_use_xnnpack,
+        onnx_inter_op_threads=settings.onnx_inter_op_threads,
+        onnx_optimization=settings.onnx_optimization,
+        socket_path=settings.model_server_socket,
+        use_shared_memory=settings.model_server_shared_memory,
+    )
+
+
+class LoadedModel:
+    """A backend plus the manifest and calibration describing its weights, swapped as one unit."""
+
+    def __init__(self, backend: InferenceBackend, manifest: ModelManifest, calibration: Calibration,
+                 weights_path: str):
+        self.backend = backend
+        self.manifest = manifest
+        self.calibration = calibration
+        self.weights_path = weights_path
+        self.loaded_at = datetime.datetime.now(datetime.timezone.utc)
+        # Requests currently using this model (see ModelRegistry.acquire)
+        self.active = 0
+        self.retired = False
+
+    def describe(self) -> dict:
+        return {
+            **self.backend.describe(),
+            **self.manifest.describe(),
+            "calibrated": self.calibration.fitted,
+            "loaded_at": self.loaded_at.isoformat(),
+            "active_requests": self.active,
+        }
+
+
+def load_model(backend: str, model_path: Optional[str] = None, manifest_path: Optional[str] = None) -> LoadedModel:
+    """
+    Load weights with their manifest and calibration, and check that they belong together:
+    the manifest's checksum must match the weights and its class list the model's output width.
+    """
+    weights_path = model_path or _weights_path_for(backend)
+    if manifest_path is None and model_path is None:
+        manifest_path = settings.model_manifest_path
+    manifest = load_manifest(weights_path, manifest_path)
+    manifest.check_weights(weights_path)
+    engine = load_backend(backend, model_path if backend != "remote" else None)
+    # Doubles as the warm-up pass, so a swapped-in model is ready before it takes traffic
+    size = manifest.input_size
+    probs = engine.predict(np.zeros((1, size, size, 3), dtype=np.float32))
+    manifest.check_outputs(probs.shape[-1])
+    calibration = load_calibration(manifest.calibration_path(), weights_path, manifest.default_threshold)
+    return LoadedModel(engine, manifest, calibration, weights_path)
+
+
+class ModelRegistry:
+    """
+    The production model plus an optional shadow candidate, swappable while requests are in flight.
+    Each request holds the model it started with (acquire); a swapped-out model is closed once the
+    last of those requests releases it. New versions load and warm up on a background thread.
+    """
+
+    def __init__(self):
+        self._current: Optional[LoadedModel] = None
+        self._candidate: Optional[LoadedModel] = None
+        self.shadow_fraction = 0.0
+        self._lock = threading.Lock()
+        self._draining: List[LoadedModel] = []
+        self.load_status: dict = {"state": "idle"}
+
+    def get(self) -> Optional[LoadedModel]:
+        """The model currently being served, loading it if necessary."""
+        if self._current is not None:
+            return self._current
+        # The startup preload thread and the first request can race here; only one of them loads
+        with _load_lock:
+            if self._current is not None:
+                return self._current
+            backend = settings.inference_backend
+            try:
+                print(f"Loading {backend} model from {_model_path_for(backend)}...")
+                self._current = load_model(backend)
+                print(f"Model loaded successfully: {self._current.manifest.name} {self._current.manifest.version}")
+            except Exception as e:
+                print(f"Error loading model: {e}")
+                self._current = None
+        return self._current
+
+    @contextmanager
+    def acquire(self) -> Iterator[Optional[LoadedModel]]:
+        """Pin the production model for the duration of one request."""
+        self.get()
+        with self._lock:
+            # Read and pinned under the same lock a swap retires under, so a model can't be closed in between
+            model = self._current
+            if model is not None:
+                model.active += 1
+        if model is None:
+            yield None
+            return
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def pin_candidate(self) -> Optional[LoadedModel]:
+        """Pin the shadow candidate for one background evaluation; release() it afterwards."""
+        with self._lock:
+            model = self._candidate
+            if model is not None:
+                model.active += 1
+        return model
+
+    def release(self, model: LoadedModel):
+        with self._lock:
+            model.active -= 1
+            drained = model.retired and model.active == 0 and model in self._draining
+            if drained:
+                self._draining.remove(model)
+        if drained:
+            self._close(model)
+
+    def _retire(self, model: Optional[LoadedModel]):
+        if model is None:
+            return
+        with self._lock:
+            model.retired = True
+            drained = model.active == 0
+            if not drained:
+                self._draining.append(model)
+        if drained:
+            self._close(model)
+
+    @staticmethod
+    def _close(model: LoadedModel):
+        logger.info(f"Releasing model {model.manifest.version}")
+        model.backend.close()
+
+    @property
+    def candidate(self) -> Optional[LoadedModel]:
+        return self._candidate
+
+    def swap(self, replacement: LoadedModel):
+        """Make a loaded, validated model the production one."""
+        with self._lock:
+            previous, self._current = self._current, replacement
+            if self._candidate is replacement:
+                self._candidate = None
+        logger.info(f"Swapped model {previous.manifest.version if previous else None} -> {replacement.manifest.version}")
+        self._retire(previous)
+
+    def set_shadow(self, candidate: LoadedModel, fraction: float):
+        with self._lock:
+            previous, self._candidate = self._candidate, candidate
+            self.shadow_fraction = fraction
+        logger.info(f"Shadowing {candidate.manifest.version} on {fraction:.0%} of traffic")
+        if previous is not candidate:
+            self._retire(previous)
+
+    def clear_shadow(self):
+        with self._lock:
+            previous, self._candidate = self._candidate, None
+        self._retire(previous)
+
+    def promote(self) -> LoadedModel:
+        candidate = self._candidate
+        if candidate is None:
+            raise ValueError("No shadow candidate to promote")
+        self.swap(candidate)
+        return candidate
+
+    def load_in_background(self, model_path: Optional[str] = None, manifest_path: Optional[str] = None,
+                           shadow_fraction: Optional[float] = None) -> bool:
+        """
+        Load, validate and warm a new version off the request path, then either swap it in or
+        (with shadow_fraction) start shadowing it. Returns False if a load is already running.
+        """
+        with self._lock:
+            if self.load_status["state"] == "loading":
+                return False
+            self.load_status = {"state": "loading", "model_path": model_path, "manifest_path": manifest_path,
+                                "target": "shadow" if shadow_fraction is not None else "production"}
+        threading.Thread(target=self._load, args=(model_path, manifest_path, shadow_fraction),
+                         name="model-load", daemon=True).start()
+        return True
+
+    def _load(self, model_path: Optional[str], manifest_path: Optional[str], shadow_fraction: Optional[float]):
+        started = time.perf_counter()
+        try:
+            with _swap_lock:
+                model = load_model(settings.inference_backend, model_path, manifest_path)
+                if shadow_fraction is not None:
+                    self.set_shadow(model, shadow_fraction)
+                else:
+                    self.swap(model)
+            self.load_status = {**self.load_status, "state": "ready", "version": model.manifest.version,
+                                "load_s": round(time.perf_counter() - started, 2)}
+        except Exception as e:
+            logger.error(f"Loading model {model_path or 'from settings'} failed: {e}")
+            self.load_status = {**self.load_status, "state": "failed", "error": str(e)}
+
+    def describe(self) -> dict:
+        with self._lock:
+            draining = [{"version": m.manifest.version, "active_requests": m.active} for m in self._draining]
+        return {
+            "production": self._current.describe() if self._current is not None else None,
+            "shadow": {**self._candidate.describe(), "fraction": self.shadow_fraction}
+            if self._candidate is not None else None,
+            "draining": draining,
+            "last_load": self.load_status,
+        }
+
+
+models = ModelRegistry()
+
+
+def get_loaded_model() -> Optional[LoadedModel]:
+    """The model currently being served, loading it if necessary. Prefer models.acquire() per request."""
+    return models.get()
+
+
+def get_model() -> Optional[InferenceBackend]:
+    """Returns the configured inference backend, loading it if necessary."""
+    loaded = models.get()
+    return loaded.backend if loaded is not None else None
+
+
+_builtin_manifest = None
+
+
+def get_manifest() -> ModelManifest:
+    """Manifest of the served model; the built-in one when no model could be loaded."""
+    global _builtin_manifest
+    loaded = models.get()
+    if loaded is not None:
+        return loaded.manifest
+    if _builtin_manifest is None:
+        _builtin_manifest = ModelManifest.builtin()
+    return _builtin_manifest
+
+
+def swap_model(model_path: Optional[str] = None, manifest_path: Optional[str] = None) -> LoadedModel:
+    """
+    Load and validate a new manifest + weights pair, then make it the served model.
+    Requests already running keep the LoadedModel they started with, so none are dropped;
+    the old backend is released when the last of them finishes. Raises if the pair is invalid,
+    leaving the current model in place.
+    """
+    with _swap_lock:
+        replacement = load_model(settings.inference_backend, model_path, manifest_path)
+        models.swap(replacement)
+    return replacement
+
+
+def is_model_loaded() -> bool:
+    return models._current is not None
+
+
+def model_info() -> Optional[dict]:
+    current = models._current
+    return current.describe() if current is not None else None
+
+
+def _manifest_mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def watch_manifest(interval_s: float):
+    """
+    Hot-swap whenever the served weights' manifest file changes. Deploy by copying the new
+    weights first and the manifest last; a manifest whose checksum doesn't match the weights
+    yet is retried on the next poll.
+    """
+    path = settings.model_manifest_path or manifest_path_for(_weights_path_for(settings.inference_backend))
+    last_seen = _manifest_mtime(path)
+    last_error = None
+    while True:
+        time.sleep(interval_s)
+        mtime = _manifest_mtime(path)
+        if mtime is None or mtime == last_seen:
+            continue
         try:
-            print(f"Loading model from {model_path}...")
-            _model = tf.keras.models.load_model(model_path)
-            print("Model loaded successfully.")
+            swap_model()
+            last_seen, last_error = mtime, None
         except Exception as e:
-            print(f"Error loading model: {e}")
-            _model = None
-    return _model
+            if str(e) != last_error:
+                logger.warning(f"Not swapping to {path} yet: {e}")
+            last_error = str(e)
@@ -0,0 +1,235 @@
+"""
+Model manifest: what the serving code needs to know about a set of weights.
+
+Stored next to the weights as <weights stem>.manifest.json (e.g.
+weights/model.manifest.json for weights/model.keras) and loaded once with
+them, so a retrained model ships its own class list instead of relying on
+the order hard-coded here:
+
+    {
+      "schema": 1,
+      "name": "plantvillage-mobilenetv2",
+      "version": "2024.1",
+      "classes": ["apple-scab", ...],
+      "input_size": 224,
+      "preprocessing": "mobilenet_v2",
+      "thresholds": {"default": 0.65},
+      "calibration": "calibration.json",
+      "weights": "model.keras",
+      "sha256": "..."
+    }
+
+"calibration" is resolved relative to the manifest. "sha256" pins the
+weights: a manifest whose checksum doesn't match is refused, which also
+stops a hot swap from picking up a half-copied weights file. Weights
+without a manifest fall back to the built-in PlantVillage description.
+
+Write a manifest for existing weights from the backend directory:
+    python -m app.model.manifest weights/model.keras --version 2024.1
+"""
+import argparse
+import json
+import logging
+import os
+from typing import Dict, FrozenSet, Optional, Sequence
+
+from app.config import settings
+from app.model.calibration import DEFAULT_THRESHOLD, file_sha256
+
+logger = logging.getLogger("plantcare")
+
+MANIFEST_SCHEMA = 1
+
+# MobileNetV2 was trained on the 38-class PlantVillage dataset.
+# Index -> class ID for weights that don't ship a manifest.
+PLANT_VILLAGE_CLASSES = (
+    "apple-scab", # 0
+    "apple-black-rot", # 1
+    "apple-cedar-rust", # 2
+    "apple-healthy", # 3
+    "blueberry-healthy", # 4
+    "cherry-powdery-mildew", # 5
+    "cherry-healthy", # 6
+    "corn-cercospora-leaf-spot", # 7
+    "corn-rust", # 8
+    "corn-northern-leaf-blight", # 9
+    "corn-healthy", # 10
+    "grape-black-rot", # 11
+    "grape-esca", # 12
+    "grape-leaf-blight", # 13
+    "grape-healthy", # 14
+    "orange-haunglongbing", # 15
+    "peach-bacterial-spot", # 16
+    "peach-healthy", # 17
+    "pepper-bell-bacterial-spot", # 18
+    "pepper-bell-healthy", # 19
+    "potato-early-blight", # 20
+    "potato-late-blight", # 21
+    "potato-healthy", # 22
+    "raspberry-healthy", # 23
+    "soybean-healthy", # 24
+    "squash-powdery-mildew", # 25
+    "strawberry-leaf-scorch", # 26
+    "strawberry-healthy", # 27
+    "tomato-bacterial-spot", # 28
+    "tomato-early-blight", # 29
+    "tomato-late-blight", # 30
+    "tomato-leaf-mold", # 31
+    "tomato-septoria-leaf-spot", # 32
+    "tomato-spider-mites", # 33
+    "tomato-target-spot", # 34
+    "tomato-yellow-leaf-curl-virus", # 35
+    "tomato-mosaic-virus", # 36
+    "tomato-healthy", # 37
+)
+
+# Pixel value transform as (scale, offset): x * scale + offset
+PREPROCESSING: Dict[str, tuple] = {
+    "mobilenet_v2": (1 / 127.5, -1.0),  # keras mobilenet_v2.preprocess_input, -1 to 1
+    "unit": (1 / 255, 0.0),
+    "none": (1.0, 0.0),
+}
+
+
+class ModelManifest:
+    def __init__(self, classes: Sequence[str], input_size: int = 224, preprocessing: str = "mobilenet_v2",
+                 default_threshold: float = DEFAULT_THRESHOLD, calibration: Optional[str] = None,
+                 sha256: Optional[str] = None, name: str = "plantvillage-mobilenetv2",
+                 version: str = "builtin", path: Optional[str] = None):
+        if not classes or len(set(classes)) != len(classes):
+            raise ValueError("Manifest classes must be a non-empty list of unique IDs")
+        if preprocessing not in PREPROCESSING:
+            raise ValueError(f"Unknown preprocessing {preprocessing!r} (expected one of {sorted(PREPROCESSING)})")
+        self.classes = tuple(classes)
+        self.input_size = int(input_size)
+        self.preprocessing = preprocessing
+        self.scale, self.offset = PREPROCESSING[preprocessing]
+        self.default_threshold = float(default_threshold)
+        self.calibration = calibration
+        self.sha256 = sha256
+        self.name = name
+        self.version = version
+        self.path = path
+        # Crops the model knows, e.g. "pepper" from "pepper-bell-healthy"
+        self.crops: FrozenSet[str] = frozenset(class_id.split("-")[0] for class_id in self.classes)
+
+    @classmethod
+    def builtin(cls) -> "ModelManifest":
+        return cls(PLANT_VILLAGE_CLASSES)
+
+    @classmethod
+    def load(cls, path: str) -> "ModelManifest":
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("schema", MANIFEST_SCHEMA) > MANIFEST_SCHEMA:
+            raise ValueError(f"{path} uses manifest schema {data['schema']}; this server reads {MANIFEST_SCHEMA}")
+        return cls(
+            classes=data["classes"],
+            input_size=data.get("input_size", 224),
+            preprocessing=data.get("preprocessing", "mobilenet_v2"),
+            default_threshold=data.get("thresholds", {}).get("default", DEFAULT_THRESHOLD),
+            calibration=data.get("calibration"),
+            sha256=data.get("sha256"),
+            name=data.get("name", "unnamed"),
+            version=str(data.get("version", "unversioned")),
+            path=path,
+        )
+
+    def calibration_path(self) -> str:
+        """The manifest's calibration file, else the globally configured one."""
+        if self.calibration and self.path:
+            return os.path.join(os.path.dirname(self.path), self.calibration)
+        from app.model.loader import BACKEND_DIR
+
+        return os.path.join(BACKEND_DIR, settings.calibration_path)
+
+    def check_weights(self, model_path: str):
+        """Refuse weights whose checksum differs from the one the manifest pins."""
+        if not self.sha256:
+            return
+        actual = file_sha256(model_path)
+        if actual is not None and actual != self.sha256:
+            raise ValueError(f"{model_path} does not match manifest {self.path} (sha256 {actual[:12]}, "
+                             f"expected {self.sha256[:12]})")
+
+    def check_outputs(self, num_outputs: int):
+        if num_outputs != len(self.classes):
+            raise ValueError(f"Model has {num_outputs} outputs but manifest {self.path or 'builtin'} "
+                             f"lists {len(self.classes)} classes")
+
+    def embedding_space(self) -> str:
+        """Filesystem-safe key for these weights' feature space; embeddings from different weights don't compare."""
+        key = f"{self.name}-{self.version}" + (f"-{self.sha256[:12]}" if self.sha256 else "")
+        return "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "classes": len(self.classes),
+            "input_size": self.input_size,
+            "preprocessing": self.preprocessing,
+            "sha256": self.sha256,
+            "manifest": os.path.basename(self.path) if self.path else None,
+        }
+
+    def to_dict(self) -> dict:
+        document = {
+            "schema": MANIFEST_SCHEMA,
+            "name": self.name,
+            "version": self.version,
+            "classes": list(self.classes),
+            "input_size": self.input_size,
+            "preprocessing": self.preprocessing,
+            "thresholds": {"default": self.default_threshold},
+            "sha256": self.sha256,
+        }
+        if self.calibration:
+            document["calibration"] = self.calibration
+        return document
+
+
+def manifest_path_for(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".manifest.json"
+
+
+def load_manifest(model_path: str, manifest_path: Optional[str] = None) -> ModelManifest:
+    """The manifest shipped with model_path, or the built-in PlantVillage one when there is none."""
+    path = manifest_path or manifest_path_for(model_path)
+    if not os.path.isfile(path):
+        if manifest_path:
+            raise FileNotFoundError(path)
+        logger.warning(f"No manifest at {path}; assuming the built-in 38-class PlantVillage layout")
+        return ModelManifest.builtin()
+    return ModelManifest.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("weights", help="Weights file the manifest describes")
+    parser.add_argument("--classes", default=None, help="JSON file with the ordered class list (default: PlantVillage)")
+    parser.add_argument("--name", default="plantvillage-mobilenetv2")
+    parser.add_argument("--version", required=True)
+    parser.add_argument("--input-size", type=int, default=224)
+    parser.add_argument("--preprocessing", default="mobilenet_v2", choices=sorted(PREPROCESSING))
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--calibration", default=None, help="Calibration file, relative to the manifest")
+    parser.add_argument("--out", default=None, help="Default: <weights stem>.manifest.json")
+    args = parser.parse_args()
+
+    classes = PLANT_VILLAGE_CLASSES
+    if args.classes:
+        with open(args.classes) as f:
+            classes = json.load(f)
+    manifest = ModelManifest(classes, input_size=args.input_size, preprocessing=args.preprocessing,
+                             default_threshold=args.threshold, calibration=args.calibration,
+                             sha256=file_sha256(args.weights), name=args.name, version=args.version)
+    document = {**manifest.to_dict(), "weights": os.path.basename(args.weights)}
+    out = args.out or manifest_path_for(args.weights)
+    with open(out, "w") as f:
+        json.dump(document, f, indent=2)
+    print(f"Wrote {out} ({len(classes)} classes, sha256 {manifest.sha256})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Shared inference server: one model per host, batched across all API workers.
+
+Loads MODEL_SERVER_BACKEND once and listens on a Unix socket. API workers
+run with INFERENCE_BACKEND=remote and hand over preprocessed tensors via
+shared memory (see app/model/ipc.py). Requests arriving from different
+workers are coalesced into one forward pass of up to
+MODEL_SERVER_MAX_BATCH images. The batcher only waits (at most
+MODEL_SERVER_MAX_WAIT_MS) while other requests are actually in flight, so
+a lone request is never delayed.
+
+Run next to uvicorn from the backend directory:
+    python -m app.model.server &
+    INFERENCE_BACKEND=remote uvicorn app.main:app --workers 4
+"""
+import argparse
+import logging
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.config import settings
+from app.model.backends import InferenceBackend, create_backend
+from app.model.ipc import MAGIC, REPLY, REQUEST, STATUS_ERROR, STATUS_OK, attach_shared_memory, recv_exact
+from app.model.loader import _model_path_for, load_backend
+from app.model.manifest import load_manifest
+
+logger = logging.getLogger("plantcare")
+
+# Each connection keeps a few attached segments; workers only replace theirs when a bigger batch arrives
+_MAX_ATTACHED_SEGMENTS = 4
+
+
+class _Pending:
+    __slots__ = ("tensor", "done", "result", "error")
+
+    def __init__(self, tensor: np.ndarray):
+        self.tensor = tensor
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[Exception] = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent predict calls into single forward passes on one thread."""
+
+    def __init__(self, backend: InferenceBackend, max_batch: int, max_wait_ms: float):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "images": 0, "batches": 0}
+        threading.Thread(target=self._run, name="model-batcher", daemon=True).start()
+
+    def submit(self, tensor: np.ndarray) -> np.ndarray:
+        pending = _Pending(tensor)
+        with self._lock:
+            self._in_flight += 1
+        self._queue.put(pending)
+        pending.done.wait()
+        with self._lock:
+            self._in_flight -= 1
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _gather(self):
+        items = [self._queue.get()]
+        count = len(items[0].tensor)
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch and len(items) < self._in_flight:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            count += len(item.tensor)
+        return items
+
+    def _run(self):
+        while True:
+            items = self._gather()
+            batch = probs = None
+            try:
+                # A single request goes straight from the shared-memory view into the engine
+                batch = items[0].tensor if len(items) == 1 else np.concatenate([p.tensor for p in items])
+                probs = self.backend.predict(batch)
+                offset = 0
+                for p in items:
+                    p.result = np.ascontiguousarray(probs[offset:offset + len(p.tensor)], dtype=np.float32)
+                    offset += len(p.tensor)
+            except Exception as e:
+                logger.error(f"Model server batch failed: {e}")
+                for p in items:
+                    p.error = e
+            self.stats["requests"] += len(items)
+            self.stats["images"] += sum(len(p.tensor) for p in items)
+            self.stats["batches"] += 1
+            # Release shared-memory views before waking the connections that own them
+            batch = probs = None
+            for p in items:
+                p.tensor = None
+                p.done.set()
+
+
+def _serve_connection(conn: socket.socket, batcher: MicroBatcher):
+    attached: Dict[str, object] = {}
+    try:
+        while True:
+            magic, n, height, width, channels, name_len = REQUEST.unpack(recv_exact(conn, REQUEST.size))
+            if magic != MAGIC:
+                raise ConnectionError("Bad request header")
+            name = bytes(recv_exact(conn, name_len)).decode() if name_len else None
+            if n == 0:
+                conn.sendall(REPLY.pack(STATUS_OK, 0, 0))
+                continue
+
+            shape = (n, height, width, channels)
+            if name:
+                shm = attached.get(name)
+                if shm is None:
+                    if len(attached) >= _MAX_ATTACHED_SEGMENTS:
+                        attached.pop(next(iter(attached))).close()
+                    shm = attached[name] = attach_shared_memory(name)
+                tensor = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+            else:
+                tensor = np.frombuffer(recv_exact(conn, n * height * width * channels * 4), dtype=np.float32)
+                tensor = tensor.reshape(shape)
+
+            try:
+                probs = batcher.submit(tensor)
+                reply = REPLY.pack(STATUS_OK, n, probs.shape[1]) + probs.tobytes()
+            except Exception as e:
+                message = str(e).encode()[:65535]
+                reply = REPLY.pack(STATUS_ERROR, 0, len(message)) + message
+            # Drop the shared-memory view before the segment can be closed
+            tensor = None
+            conn.sendall(reply)
+    except (ConnectionError, OSError):
+        pass
+    finally:
+        conn.close()
+        for shm in attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
+
+
+def serve(socket_path: str, backend: InferenceBackend, max_batch: int, max_wait_ms: float):
+    batcher = MicroBatcher(backend, max_batch, max_wait_ms)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(128)
+
+    def shutdown(*_):
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logger.info(f"Model server stopped: {batcher.stats}")
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    logger.info(f"Model server listening on {socket_path} ({backend.describe()})")
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=_serve_connection, args=(conn, batcher), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=settings.model_server_socket)
+    parser.add_argument("--backend", default=settings.model_server_backend)
+    parser.add_argument("--model-path", default=None, help="Override the backend's configured model file")
+    parser.add_argument("--max-batch", type=int, default=settings.model_server_max_batch)
+    parser.add_argument("--max-wait-ms", type=float, default=settings.model_server_max_wait_ms)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.backend == "remote":
+        parser.error("The model server can't itself use the remote backend")
+    if args.model_path:
+        backend = create_backend(args.backend, model_path=args.model_path, num_threads=settings.inference_threads,
+                                 use_xnnpack=settings.tflite_use_xnnpack,
+                                 onnx_inter_op_threads=settings.onnx_inter_op_threads,
+                                 onnx_optimization=settings.onnx_optimization)
+    else:
+        backend = load_backend(args.backend)
+    size = load_manifest(args.model_path or _model_path_for(args.backend)).input_size
+    backend.predict(np.zeros((1, size, size, 3), dtype=np.float32))  # warm up before taking traffic
+    serve(args.socket, backend, args.max_batch, args.max_wait_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Shadow evaluation: run a candidate model on a sample of production traffic and compare.
+
+The candidate never answers a request. After the production forward pass,
+a sampled fraction of inputs is handed to one low-priority background
+thread. Handing off never blocks the request. Work is dropped when:
+
+  * the token bucket (settings.shadow_max_per_second) is empty,
+  * more than settings.shadow_max_active_requests production requests are
+    running, i.e. the engine has no spare capacity, or
+  * the small queue is full.
+
+Dropping keeps shadowing from raising user-facing latency. Agreement (same
+mapped class ID) and forward-pass latency for both models are exported
+as plantcare_shadow_* metrics and summarized under /api/admin/model.
+"""
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.metrics import registry
+
+logger = logging.getLogger("plantcare")
+
+SHADOW_OFFERS = registry.counter(
+    "plantcare_shadow_offers_total",
+    "Sampled requests offered to the shadow candidate, by outcome.",
+    ("outcome",),
+)
+SHADOW_COMPARISONS = registry.counter(
+    "plantcare_shadow_comparisons_total",
+    "Images scored by both production and the shadow candidate, by whether the mapped class agreed.",
+    ("result",),
+)
+SHADOW_FORWARD_SECONDS = registry.histogram(
+    "plantcare_shadow_forward_seconds",
+    "Forward-pass time of production vs the shadow candidate on the same inputs.",
+    ("model",),
+)
+
+# Niceness of the shadow thread on Linux, so production threads win the CPU when both are runnable
+_SHADOW_NICENESS = 10
+
+
+class ShadowEvaluator:
+    def __init__(self, queue_size: int = 4):
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._refilled = time.monotonic()
+        self._worker: Optional[threading.Thread] = None
+        self._reset(None)
+
+    def _reset(self, version: Optional[str]):
+        self.summary = {"candidate": version, "images": 0, "agreed": 0, "production_ms": 0.0,
+                        "candidate_ms": 0.0, "abs_confidence_delta": 0.0}
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            rate = settings.shadow_max_per_second
+            self._tokens = min(max(rate, 1.0), self._tokens + (now - self._refilled) * rate)
+            self._refilled = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def offer(self, production, batch: np.ndarray, offsets: List[int], results: List[Tuple[str, float]],
+              production_s: float):
+        """
+        Called after production answered; never blocks. results are production's (class ID, confidence)
+        per image, offsets split batch into images as in run_batch_inference.
+        """
+        from app.model.loader import models
+
+        fraction = models.shadow_fraction
+        if models.candidate is None or fraction <= 0 or random.random() >= fraction:
+            return
+        if production.active > settings.shadow_max_active_requests:
+            SHADOW_OFFERS.inc(outcome="busy")
+            return
+        if not self._take_token():
+            SHADOW_OFFERS.inc(outcome="rate_limited")
+            return
+        candidate = models.pin_candidate()
+        if candidate is None:
+            return
+        manifest, ours = candidate.manifest, production.manifest
+        if (manifest.input_size, manifest.preprocessing) != (ours.input_size, ours.preprocessing):
+            # The production tensor isn't a valid input for the candidate
+            models.release(candidate)
+            SHADOW_OFFERS.inc(outcome="incompatible")
+            return
+        try:
+            self._queue.put_nowait((candidate, batch, offsets, results, production_s))
+        except queue.Full:
+            models.release(candidate)
+            SHADOW_OFFERS.inc(outcome="queue_full")
+            return
+        SHADOW_OFFERS.inc(outcome="queued")
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="model-shadow", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        from app.model.inference import _classify
+        from app.model.loader import models
+
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), _SHADOW_NICENESS)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            candidate, batch, offsets, results, production_s = self._queue.get()
+            try:
+                started = time.perf_counter()
+                shadow_results = _classify(candidate, batch, offsets)
+                candidate_s = time.perf_counter() - started
+                self._record(candidate.manifest.version, results, shadow_results, production_s, candidate_s)
+            except Exception as e:
+                SHADOW_OFFERS.inc(outcome="error")
+                logger.warning(f"Shadow inference on {candidate.manifest.version} failed: {e}")
+            finally:
+                models.release(candidate)
+
+    def _record(self, version: str, production: List[Tuple[str, float]], shadow: List[Tuple[str, float]],
+                production_s: float, candidate_s: float):
+        SHADOW_FORWARD_SECONDS.observe(production_s, model="production")
+        SHADOW_FORWARD_SECONDS.observe(candidate_s, model="candidate")
+        agreed = sum(p[0] == s[0] for p, s in zip(production, shadow))
+        SHADOW_COMPARISONS.inc(agreed, result="agree")
+        SHADOW_COMPARISONS.inc(len(production) - agreed, result="disagree")
+        with self._lock:
+            if self.summary["candidate"] != version:
+                self._reset(version)
+            summary = self.summary
+            summary["images"] += len(production)
+            summary["agreed"] += agreed
+            summary["production_ms"] += production_s * 1000
+            summary["candidate_ms"] += candidate_s * 1000
+            summary["abs_confidence_delta"] += sum(abs(p[1] - s[1]) for p, s in zip(production, shadow))
+
+    def describe(self) -> dict:
+        with self._lock:
+            summary = dict(self.summary)
+        images = summary["images"]
+        if not images:
+            return {"candidate": summary["candidate"], "images": 0}
+        return {
+            "candidate": summary["candidate"],
+            "images": images,
+            "agreement": round(summary["agreed"] / images, 4),
+            # Per-image forward time; both models ran the same batches
+            "production_ms_per_image": round(summary["production_ms"] / images, 2),
+            "candidate_ms_per_image": round(summary["candidate_ms"] / images, 2),
+            "mean_abs_confidence_delta": round(summary["abs_confidence_delta"] / images, 4),
+        }
+
+
+shadow_evaluator = ShadowEvaluator()
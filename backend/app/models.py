@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, LargeBinary, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 from app.database import Base
 import datetime
 
@@ -24,5 +24,23 @@ class Diagnosis(Base):
     health_score = Column(Integer)
     image_url = Column(String, nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.datetime.now(datetime.timezone.utc))
+    # The full AnalysisResponse as sent, compressed (app/services/payload_store.py); deferred so lists don't load it
+    payload = deferred(Column(LargeBinary, nullable=True))
+    payload_codec = Column(String, nullable=True)
 
     user = relationship("User", back_populates="diagnoses")
+
+class DiagnosisRollup(Base):
+    """Pre-aggregated diagnosis counts per time bucket, maintained on every write."""
+    __tablename__ = "diagnosis_rollups"
+    __table_args__ = (
+        UniqueConstraint("granularity", "bucket_start", "crop_type", "disease_id", name="uq_diagnosis_rollups_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    granularity = Column(String, nullable=False) # "hour" or "day"
+    bucket_start = Column(DateTime, nullable=False, index=True)
+    crop_type = Column(String, nullable=False)
+    disease_id = Column(String, nullable=False)
+    diagnosis_count = Column(Integer, nullable=False, default=0)
+    health_score_sum = Column(Integer, nullable=False, default=0)
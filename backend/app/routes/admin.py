@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from pydantic import BaseModel, Field
+from app.dependencies import require_admin_token
+from app.model.loader import models
+from app.model.shadow import shadow_evaluator
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+class ModelLoadRequest(BaseModel):
+    weights_path: Optional[str] = None
+    manifest_path: Optional[str] = None
+    # Set to shadow the new version on this fraction of traffic instead of swapping it in
+    shadow_fraction: Optional[float] = Field(None, gt=0, le=1)
+
+class ShadowUpdateRequest(BaseModel):
+    fraction: float = Field(..., ge=0, le=1)
+
+def _status() -> dict:
+    return {**models.describe(), "shadow_evaluation": shadow_evaluator.describe()}
+
+@router.get("/admin/model")
+def get_model_status():
+    """Production and shadow models, versions still draining in-flight requests, and shadow agreement so far."""
+    return _status()
+
+@router.post("/admin/model/load", status_code=202)
+def load_model_version(request: ModelLoadRequest):
+    """
+    Load, validate and warm a manifest + weights pair in the background (paths default to the configured ones),
+    then swap it in or start shadowing it. Poll GET /admin/model for last_load.
+    """
+    if not models.load_in_background(request.weights_path, request.manifest_path, request.shadow_fraction):
+        raise HTTPException(status_code=409, detail="A model load is already in progress")
+    return _status()
+
+@router.post("/admin/model/promote")
+def promote_shadow():
+    """Make the shadow candidate the production model."""
+    try:
+        models.promote()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _status()
+
+@router.put("/admin/model/shadow")
+def update_shadow(request: ShadowUpdateRequest):
+    if models.candidate is None:
+        raise HTTPException(status_code=409, detail="No shadow candidate loaded")
+    models.shadow_fraction = request.fraction
+    return _status()
+
+@router.delete("/admin/model/shadow")
+def stop_shadow():
+    models.clear_shadow()
+    return _status()
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app.database import get_db
+from app.models import User
+from app.dependencies import get_current_user
+from app.config import settings
+from app.services.analytics import QUERY_GRANULARITIES, bucket_start, hour_retention_start, query_analytics
+from pydantic import BaseModel
+import datetime
+
+router = APIRouter()
+
+# Cap on how far back a single request may reach, per granularity, so a
+# query can never fan out into an unbounded number of buckets.
+MAX_RANGE_DAYS = {"hour": 31, "day": 366, "week": 366 * 2, "month": 366 * 5}
+
+class DiseaseCount(BaseModel):
+    disease_id: str
+    count: int
+    prevalence: float
+
+class AnalyticsBucket(BaseModel):
+    bucket_start: datetime.datetime
+    crop_type: str
+    total: int
+    avg_health_score: float
+    diseases: List[DiseaseCount]
+
+class AnalyticsResponse(BaseModel):
+    granularity: str
+    start: datetime.datetime
+    end: datetime.datetime
+    buckets: List[AnalyticsBucket]
+
+def _as_utc(ts: datetime.datetime) -> datetime.datetime:
+    """Treat naive query timestamps as UTC, matching how diagnoses are stored."""
+    return ts.replace(tzinfo=datetime.timezone.utc) if ts.tzinfo is None else ts
+
+@router.get("/analytics", response_model=AnalyticsResponse)
+def get_analytics(
+    granularity: str = Query("day", description="hour, day, week or month"),
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    crop_type: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Disease prevalence and average health score by crop over time buckets.
+    Served from the pre-aggregated rollups, never from a scan of the diagnoses table.
+    start is moved back to the start of its bucket, so the first bucket covers the whole hour/day/week/month.
+    Hour buckets only go back settings.analytics_hour_retention_days.
+    """
+    if granularity not in QUERY_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(QUERY_GRANULARITIES)}")
+
+    end = _as_utc(end) if end else datetime.datetime.now(datetime.timezone.utc)
+    start = _as_utc(start) if start else end - datetime.timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > datetime.timedelta(days=MAX_RANGE_DAYS[granularity]):
+        raise HTTPException(status_code=400, detail=f"Range too large for {granularity} buckets (max {MAX_RANGE_DAYS[granularity]} days)")
+    start = _as_utc(bucket_start(start, granularity))
+    retained = hour_retention_start() if granularity == "hour" else None
+    if retained is not None and start < _as_utc(retained):
+        raise HTTPException(status_code=400, detail=f"Hourly analytics only go back {settings.analytics_hour_retention_days} days; use day buckets")
+
+    buckets = query_analytics(db, granularity, start, end, crop_type=crop_type)
+    return {"granularity": granularity, "start": start, "end": end, "buckets": buckets}
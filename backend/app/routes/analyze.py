@@ -1,14 +1,35 @@
+import contextvars
+import json
 import logging
-from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends
-from typing import Optional, Any
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, File, UploadFile, Form, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import AsyncIterator, Iterator, List, Optional, Any
 from sqlalchemy.orm import Session
-from app.schemas.response import AnalysisResponse, HeatmapRegion, AlternativePrediction
+from app.schemas.response import (
+    AnalysisResponse, HeatmapRegion, AlternativePrediction, OutbreakAlert,
+    BatchAnalysisResponse, BatchItemResult, PlotSummary, SimilarCase
+)
 from app.services.disease_mapper import disease_mapper
 from app.services.health_score import calculate_health_score
+from app.services.image_quality import assess_image
+from app.services.leaf_analysis import analyze_leaf
 from app.services.storage import upload_mock_s3
 from app.services.gemini_vision import analyze_plant_image
-from app.model.inference import run_inference
-from app.database import get_db
+from app.services.analytics import record_diagnosis
+from app.services.outbreak import outbreak_detector
+from app.services.metrics import StageTimer, registry, request_timer, timed
+from app.services import embedding_index, payload_store, routing
+from app.services.admission import GEMINI_LANE, LOCAL_LANE, Ticket, admission, client_ip
+from app.services.gemini_client import gemini_enabled
+from app.model.inference import run_inference, run_batch_inference, decode_image, image_to_model_input
+from app.model.loader import get_manifest, models
+from app.model.manifest import ModelManifest
+from app.model.tiling import image_tiles
+from app.database import get_db, SessionLocal
 from app.models import Diagnosis, User
 from app.dependencies import get_current_user
 from fastapi.security import OAuth2PasswordBearer
@@ -18,6 +39,13 @@ from app.config import settings
 logger = logging.getLogger("plantcare")
 
 router = APIRouter()
+
+ANALYSES = registry.counter(
+    "plantcare_analyses_total",
+    "Completed analyses by endpoint and result source.",
+    ("endpoint", "source"),
+)
+
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
 async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)):
@@ -34,6 +62,44 @@ async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optiona
     user = db.query(User).filter(User.email == email).first()
     return user
 
+
+def _caller_identity(request: Request, current_user: Optional[User]) -> str:
+    if current_user:
+        return f"user:{current_user.id}"
+    return f"ip:{client_ip(request)}"
+
+
+def _admission_lane() -> str:
+    # Requests that go to Gemini up front hold a Gemini slot; cascade escalations borrow one non-blockingly
+    if routing.routing_policy() == routing.GEMINI_FIRST and gemini_enabled():
+        return GEMINI_LANE
+    return LOCAL_LANE
+
+
+async def admit_analysis(request: Request,
+                         current_user: Optional[User] = Depends(get_optional_user)) -> AsyncIterator[Ticket]:
+    """
+    Admission control on the event loop, before the request takes a threadpool thread. The slot is released on
+    the way out, also when the form fails validation after admission and the handler never runs.
+    """
+    ticket = await admission.admit(_caller_identity(request, current_user), _admission_lane())
+    try:
+        yield ticket
+    finally:
+        ticket.release()
+
+
+async def admit_batch(request: Request,
+                      current_user: Optional[User] = Depends(get_optional_user)) -> AsyncIterator[Ticket]:
+    """As admit_analysis, but a batch spends one rate-limit token per image."""
+    form = await request.form()
+    cost = max(1, len(form.getlist("images")))
+    ticket = await admission.admit(_caller_identity(request, current_user), _admission_lane(), cost)
+    try:
+        yield ticket
+    finally:
+        ticket.release()
+
 def safe_int(value: Any, default: int = 0) -> int:
     """Safely convert strings like '75%' or 'high' to an integer without crashing"""
     try:
@@ -53,112 +119,61 @@ def analyze_image(
     cropType: Optional[str] = Form(None),
     mode: Optional[str] = Form("beginner"),
     db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_optional_user)
+    current_user: Optional[User] = Depends(get_optional_user),
+    ticket: Ticket = Depends(admit_analysis)
 ):
+    try:
+        with request_timer() as timer:
+            return _analyze_image(image, cropType, db, current_user, timer)
+    finally:
+        ticket.release()
+
+
+def _analyze_image(image: UploadFile, cropType: Optional[str], db: Session, current_user: Optional[User], timer: StageTimer) -> AnalysisResponse:
     try:
         # 1. Validate content type
         if not image.content_type or not image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File provided is not an image.")
             
         # 1a. Read exact image bytes once into RAM
-        image_bytes = image.file.read()
+        with timed("read"):
+            image_bytes = image.file.read()
         logger.info(f"Received image: {len(image_bytes)} bytes, filename={image.filename}")
         
         if not image_bytes:
             raise HTTPException(status_code=400, detail="Empty image payload received")
+        
+        # 1a. Reject photos nobody could diagnose before storing them or spending a Gemini call
+        problem = _quality_problem(image_bytes)
+        if problem:
+            raise HTTPException(status_code=422, detail=problem)
             
         # 1b. Upload image to 'S3' mock
         safe_filename = image.filename or "upload.jpg"
         image_url = upload_mock_s3(image_bytes, safe_filename)
         
-        # ================================================
-        # PRIMARY PATH: Gemini Vision (smart identification)
-        # ================================================
-        gemini_result = analyze_plant_image(image_bytes)
+        analysis = _route_analysis(image_bytes, cropType)
         
-        if gemini_result:
-            logger.info(f"Using Gemini Vision result: {gemini_result['plant_name']} - {gemini_result['disease_name']}")
-            
-            class_id = gemini_result["disease_id"]
-            confidence = float(gemini_result.get("confidence", 0.85))
-            
-            # Build disease info from Gemini's rich response
-            disease_info = _build_disease_from_gemini(gemini_result)
-            
-            # Use Gemini's AI-calculated health scores directly
-            health_score_data = {
-                "score": safe_int(gemini_result.get("health_score"), 75),
-                "breakdown": {
-                    "leafCondition": safe_int(gemini_result.get("leaf_condition"), 70),
-                    "infectionSeverity": safe_int(gemini_result.get("infection_severity"), 30),
-                    "colorAnalysis": safe_int(gemini_result.get("color_analysis"), 70)
-                }
-            }
-            
-            # Heatmap placeholder
-            heatmap = [{"x": 0.5, "y": 0.5, "radius": 0.15, "intensity": 0.8}] if "healthy" not in class_id else []
-            processing_time = 2000
-            
-        else:
-            # ================================================
-            # FALLBACK: MobileNetV2 (if Gemini fails)
-            # ================================================
-            logger.info("Gemini Vision unavailable, falling back to MobileNetV2")
-            
-            try:
-                inference_result = run_inference(image_bytes)
-            except ValueError as ve:
-                raise HTTPException(status_code=400, detail=str(ve))
-            
-            class_id = inference_result["class_id"]
-            confidence = inference_result["confidence"]
-            disease_info = disease_mapper.map_prediction_to_disease(class_id, confidence=confidence)
-            
-            # Allow user-selected cropType to override "Unrecognized Image" name
-            if class_id == "unknown" and cropType and cropType != "auto":
-                formatted_crop = cropType.capitalize()
-                disease_info["name"] = f"{formatted_crop} (Unrecognized Condition)"
-                disease_info["beginnerDescription"] = f"We couldn't confidently identify a specific condition, but we've recorded this as a {formatted_crop} based on your selection."
-                
-            health_score_data = calculate_health_score(disease_info, confidence)
-            heatmap = inference_result["heatmap"]
-            processing_time = inference_result.get("processing_time", 1500)
-        
-        logger.info(f"Final result: class_id={class_id}, confidence={confidence}")
-        
-        # Generate Alternatives
-        alternatives = [
-            AlternativePrediction(
-                disease=disease_mapper.map_prediction_to_disease("healthy", confidence=0.0),
-                confidence=round(float((1 - confidence) * 0.7), 2)
-            )
-        ]
+        logger.info(f"Final result: class_id={analysis['class_id']}, confidence={analysis['confidence']}")
         
         # Save to Database
-        db_diagnosis = Diagnosis(
-            user_id=current_user.id if current_user else None,
-            crop_type=cropType,
-            disease_id=class_id,
-            confidence=confidence,
-            health_score=health_score_data["score"],
-            image_url=image_url
-        )
+        db_diagnosis = _new_diagnosis(analysis, cropType, image_url, current_user.id if current_user else None)
         db.add(db_diagnosis)
-        db.commit()
-        db.refresh(db_diagnosis)
+        with timed("db_commit"):
+            record_diagnosis(db, db_diagnosis)
+            db.commit()
+            db.refresh(db_diagnosis)
+        _index_and_find_similar(db, [(db_diagnosis, analysis)], current_user.id if current_user else None)
         
-        # Build Response
-        response = AnalysisResponse(
-            disease=disease_info,
-            confidence=confidence,
-            processingTime=processing_time,
-            alternatives=alternatives,
-            healthScore=health_score_data,
-            heatmapRegions=[HeatmapRegion(**h) for h in heatmap],
-            confidenceLevel="high" if confidence > 0.85 else "medium" if confidence > 0.6 else "low",
-            multiDiseaseWarning=False
-        )
+        # Feed the regional outbreak detector and fill in regional context it has learned
+        region = current_user.region if current_user else None
+        alert = outbreak_detector.observe(region, analysis["class_id"], db_diagnosis.created_at)
         
+        ANALYSES.inc(endpoint="analyze", source=analysis["source"])
+        analysis["processing_time"] = timer.elapsed_ms()
+        response = _build_response(analysis, alert, breakdown=timer.breakdown())
+        with timed("payload_store"):
+            payload_store.store(db, [(db_diagnosis, response)])
         return response
 
     except HTTPException:
@@ -170,6 +185,614 @@ def analyze_image(
         raise
 
 
+def _quality_problem(image_bytes: bytes) -> Optional[dict]:
+    """The quality gate's verdict as an error detail ({code, message, checks}), or None when the photo is usable."""
+    if not settings.quality_gate_enabled:
+        return None
+    report = assess_image(image_bytes)
+    if report["ok"]:
+        return None
+    return {"code": report["code"], "message": report["message"], "checks": report["checks"]}
+
+
+def _route_analysis(image_bytes: bytes, cropType: Optional[str]) -> dict:
+    """Run Gemini and/or MobileNetV2 for one image according to the routing policy."""
+    policy = routing.routing_policy()
+    inference_result = None
+    gemini_future = None
+    # With the embedding index the local pass always runs: it is what a Gemini answer gets indexed under,
+    # and its embedding may answer for Gemini (kNN)
+    embeddings = embedding_index.available()
+    if policy == routing.GEMINI_FIRST:
+        reason = "policy"
+        if embeddings and not settings.knn_gemini_first:
+            # Only for the embedding: Gemini is the configured answer, so the local pass runs alongside the
+            # call instead of ahead of it, and no kNN vote can replace it
+            gemini_pool = ThreadPoolExecutor(max_workers=1)
+            gemini_future = gemini_pool.submit(contextvars.copy_context().run, analyze_plant_image, image_bytes)
+            gemini_pool.shutdown(wait=False)
+        if embeddings:
+            inference_result = _run_local(image_bytes)
+    else:
+        # Fast local model first; Gemini only when the cascade doesn't trust its answer
+        reason = routing.escalation_reason(cropType) if policy == routing.CASCADE else None
+        if reason is None or embeddings:
+            inference_result = _run_local(image_bytes)
+            if reason is None and policy == routing.CASCADE:
+                reason = routing.escalation_reason(cropType, inference_result)
+        if reason is None:
+            routing.record_route("local", "confident" if policy == routing.CASCADE else "policy")
+            return _analysis_from_inference(inference_result, cropType)
+    
+    match = embedding_index.knn_answer(inference_result) if gemini_future is None else None
+    if match:
+        routing.record_route("local", "knn_match")
+        return _analysis_from_knn(match, inference_result, cropType)
+    
+    if gemini_future is not None:
+        gemini_result = gemini_future.result()
+    elif policy == routing.CASCADE:
+        gemini_result = _escalate([image_bytes])[0]
+    else:
+        gemini_result = analyze_plant_image(image_bytes)
+    if gemini_result:
+        routing.record_route("gemini", reason)
+        return _with_embedding(_analysis_from_gemini(gemini_result), inference_result)
+    
+    logger.info("Gemini Vision unavailable, falling back to MobileNetV2")
+    routing.record_route("local", "gemini_shed" if gemini_result is _SHED else "gemini_unavailable")
+    if inference_result is None:
+        inference_result = _run_local(image_bytes)
+    return _analysis_from_inference(inference_result, cropType)
+
+
+# Returned by _escalate when the Gemini lane is saturated; falsy like a failed Gemini call
+_SHED: dict = {}
+
+
+def _escalate(images: List[bytes], gemini_map=map) -> List[Optional[dict]]:
+    """
+    Gemini for cascade escalations, if the Gemini lane has a free slot. Under overload the
+    escalation is dropped (the local answer stands) rather than queued behind gemini_first traffic.
+    """
+    if not images:
+        return []
+    slot = admission.try_gemini_slot()
+    if slot is None:
+        return [_SHED] * len(images)
+    try:
+        return list(gemini_map(analyze_plant_image, images))
+    finally:
+        slot.release()
+
+
+def _run_local(image_bytes: bytes) -> dict:
+    try:
+        return run_inference(image_bytes)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+
+@router.post("/analyze/batch", response_model=BatchAnalysisResponse)
+def analyze_batch(
+    images: List[UploadFile] = File(...),
+    cropType: Optional[str] = Form(None),
+    mode: Optional[str] = Form("beginner"),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user),
+    ticket: Ticket = Depends(admit_batch)
+):
+    """
+    Analyze every leaf photographed on a plot in one request.
+    Images are decoded in parallel, Gemini calls fan out under a bounded concurrency limit,
+    any Gemini misses go through MobileNetV2 as one batched tensor, and all diagnoses commit together.
+    Under the cascade policy MobileNetV2 runs first and only the images it is unsure about go to Gemini.
+    """
+    try:
+        return _analyze_batch(images, cropType, db, current_user)
+    finally:
+        ticket.release()
+
+
+def _analyze_batch(images: List[UploadFile], cropType: Optional[str], db: Session,
+                   current_user: Optional[User]) -> BatchAnalysisResponse:
+    started = time.perf_counter()
+    if not images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(images) > settings.max_batch_images:
+        raise HTTPException(status_code=400, detail=f"Too many images (max {settings.max_batch_images} per batch)")
+
+    try:
+        items = []
+        for upload in images:
+            item = {"filename": upload.filename or "upload.jpg", "bytes": b"", "error": None}
+            if not upload.content_type or not upload.content_type.startswith("image/"):
+                item["error"] = "File provided is not an image."
+            else:
+                item["bytes"] = upload.file.read()
+                if not item["bytes"]:
+                    item["error"] = "Empty image payload received"
+            items.append(item)
+
+        pending = [item for item in items if item["error"] is None]
+        logger.info(f"Received batch: {len(items)} images, {sum(len(i['bytes']) for i in pending)} bytes")
+
+        policy = routing.routing_policy()
+        # Decode + store and Gemini fan-out run side by side on separate pools. One model is pinned from decode
+        # to the last forward pass, so a hot swap can't hand tensors and tile plans built for its manifest to another
+        with ThreadPoolExecutor(max_workers=settings.batch_decode_workers) as decode_pool, \
+                ThreadPoolExecutor(max_workers=settings.gemini_batch_concurrency) as gemini_pool, \
+                models.acquire() as model:
+            manifest = model.manifest if model is not None else get_manifest()
+            # Quality gate first, so unusable photos are neither stored nor sent to Gemini
+            for item, problem in zip(pending, list(decode_pool.map(_quality_problem, [i["bytes"] for i in pending]))):
+                if problem:
+                    item["error"] = problem["message"]
+            pending = [item for item in pending if item["error"] is None]
+            decode_futures = [decode_pool.submit(_decode_and_store, item, manifest, len(pending)) for item in pending]
+            gemini_futures = [gemini_pool.submit(analyze_plant_image, item["bytes"]) for item in pending] \
+                if policy == routing.GEMINI_FIRST else None
+
+            for item, future in zip(pending, decode_futures):
+                try:
+                    item["tensor"], item["tiles"], item["leaf"], item["image_url"] = future.result()
+                except ValueError as ve:
+                    item["error"] = str(ve)
+            decoded = [item for item in pending if item["error"] is None]
+
+            if gemini_futures is not None:
+                # Local pass alongside the Gemini fan-out for the embeddings to index Gemini's answers under.
+                # No kNN here: every image has already been sent to Gemini
+                if decoded and embedding_index.available():
+                    for item, inference_result in zip(decoded, run_batch_inference([i["tensor"] for i in decoded],
+                                                                                   [i["tiles"] for i in decoded],
+                                                                                   model)):
+                        item["local"] = inference_result
+                for item, future in zip(pending, gemini_futures):
+                    item["gemini"] = future.result() if item["error"] is None else None
+                    item["reason"] = "policy"
+            else:
+                # Local model first, one batched pass; only the images the cascade doesn't trust go to Gemini
+                reason = routing.escalation_reason(cropType) if policy == routing.CASCADE else None
+                if decoded and (reason is None or embedding_index.available()):
+                    for item, inference_result in zip(decoded, run_batch_inference([i["tensor"] for i in decoded],
+                                                                                   [i["tiles"] for i in decoded],
+                                                                                   model)):
+                        item["local"] = inference_result
+                for item in decoded:
+                    item["gemini"] = None
+                    item["reason"] = reason
+                    if reason is None and policy == routing.CASCADE:
+                        item["reason"] = routing.escalation_reason(cropType, item["local"])
+                    # A close enough match among past Gemini answers stands in for the escalation
+                    item["knn"] = embedding_index.knn_answer(item.get("local")) if item["reason"] else None
+                escalated = [item for item in decoded if item["reason"] and not item["knn"]]
+                for item, gemini_result in zip(escalated, _escalate([i["bytes"] for i in escalated], gemini_pool.map)):
+                    item["gemini"] = gemini_result
+
+            fallback = [item for item in decoded if not item["gemini"] and "local" not in item]
+            if fallback:
+                logger.info(f"Gemini Vision unavailable for {len(fallback)} images, falling back to batched MobileNetV2")
+                for item, inference_result in zip(fallback, run_batch_inference([i["tensor"] for i in fallback],
+                                                                                [i["tiles"] for i in fallback],
+                                                                                model)):
+                    item["local"] = inference_result
+
+        for item in decoded:
+            if item.get("knn"):
+                routing.record_route("local", "knn_match")
+                item["analysis"] = _analysis_from_knn(item["knn"], item["local"], cropType, item["leaf"])
+            elif item["gemini"]:
+                routing.record_route("gemini", item["reason"])
+                item["analysis"] = _with_embedding(_analysis_from_gemini(item["gemini"]), item.get("local"))
+            else:
+                if item["reason"]:
+                    routing.record_route("local", "gemini_shed" if item["gemini"] is _SHED else "gemini_unavailable")
+                else:
+                    routing.record_route("local", "confident" if policy == routing.CASCADE else "policy")
+                item["analysis"] = _analysis_from_inference(item["local"], cropType, item["leaf"])
+
+        # Save every diagnosis in a single transaction
+        for item in decoded:
+            item["diagnosis"] = _new_diagnosis(item["analysis"], cropType, item["image_url"], current_user.id if current_user else None)
+            db.add(item["diagnosis"])
+            record_diagnosis(db, item["diagnosis"])
+        with timed("db_commit"):
+            db.commit()
+        _index_and_find_similar(db, [(item["diagnosis"], item["analysis"]) for item in decoded],
+                                current_user.id if current_user else None)
+
+        region = current_user.region if current_user else None
+        results = []
+        for item in items:
+            if item["error"] is not None:
+                results.append(BatchItemResult(filename=item["filename"], error=item["error"]))
+                continue
+            analysis = item["analysis"]
+            if analysis["processing_time"] is None:
+                analysis["processing_time"] = int((time.perf_counter() - started) * 1000)
+            ANALYSES.inc(endpoint="batch", source=analysis["source"])
+            alert = outbreak_detector.observe(region, analysis["class_id"], item["diagnosis"].created_at)
+            item["response"] = _build_response(analysis, alert)
+            results.append(BatchItemResult(filename=item["filename"], result=item["response"]))
+        with timed("payload_store"):
+            payload_store.store(db, [(item["diagnosis"], item["response"]) for item in decoded])
+
+        return BatchAnalysisResponse(
+            results=results,
+            summary=_summarize_plot(results),
+            processingTime=int((time.perf_counter() - started) * 1000)
+        )
+
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Unhandled error in analyze_batch: {e}")
+        raise
+
+
+@router.post("/analyze/stream")
+def analyze_image_stream(
+    request: Request,
+    image: UploadFile = File(...),
+    cropType: Optional[str] = Form(None),
+    mode: Optional[str] = Form("beginner"),
+    responseFormat: Optional[str] = Form(None),
+    current_user: Optional[User] = Depends(get_optional_user),
+    ticket: Ticket = Depends(admit_analysis)
+):
+    """
+    Same pipeline as /analyze, but streams one event per stage as it completes:
+    received, decoded, local-prediction, gemini-result, stored.
+    The MobileNetV2 result arrives first as a provisional answer and is upgraded when Gemini responds.
+    Events are NDJSON by default, or server-sent events with responseFormat=sse / Accept: text/event-stream.
+    """
+    if not image.content_type or not image.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File provided is not an image.")
+    
+    image_bytes = image.file.read()
+    if not image_bytes:
+        raise HTTPException(status_code=400, detail="Empty image payload received")
+    
+    # The stream outlives this handler (and the dependency that would release the slot when it returns)
+    ticket = ticket.detach()
+    sse = responseFormat == "sse" or (
+        responseFormat is None and "text/event-stream" in request.headers.get("accept", "")
+    )
+    # Only plain values cross into the generator: the request's DB session is gone by the time it runs
+    events = _stream_analysis(
+        image_bytes,
+        image.filename or "upload.jpg",
+        cropType,
+        current_user.id if current_user else None,
+        current_user.region if current_user else None,
+        ticket,
+    )
+    if sse:
+        body = (f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n" for event in events)
+        media_type = "text/event-stream"
+    else:
+        body = (json.dumps(event) + "\n" for event in events)
+        media_type = "application/x-ndjson"
+    
+    # Disable proxy buffering so each stage reaches the client as soon as it is emitted
+    # The generator releases the admission ticket when it finishes; the background task covers a stream never started
+    return StreamingResponse(body, media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(ticket.release))
+
+
+def _stream_analysis(image_bytes: bytes, filename: str, cropType: Optional[str],
+                     user_id: Optional[int], region: Optional[str], ticket: Ticket) -> Iterator[dict]:
+    started = time.perf_counter()
+    stage_started = started
+    
+    def event(stage: str, **payload) -> dict:
+        nonlocal stage_started
+        now = time.perf_counter()
+        record = {
+            "stage": stage,
+            "stageMs": round((now - stage_started) * 1000, 1),
+            "elapsedMs": round((now - started) * 1000, 1),
+            **payload
+        }
+        stage_started = now
+        return record
+    
+    logger.info(f"Received image for streaming analysis: {len(image_bytes)} bytes, filename={filename}")
+    
+    # Gemini is the slow stage, so under gemini_first it starts immediately and runs while we decode and
+    # run MobileNetV2; the other policies only submit it once the local result says it's needed
+    policy = routing.routing_policy()
+    problem = _quality_problem(image_bytes)
+    gemini_pool = ThreadPoolExecutor(max_workers=1)
+    gemini_future = gemini_pool.submit(analyze_plant_image, image_bytes) \
+        if policy == routing.GEMINI_FIRST and not problem else None
+    db = SessionLocal()
+    try:
+        yield event("received", bytes=len(image_bytes), filename=filename)
+        if problem:
+            yield event("error", status=422, detail=problem)
+            return
+        
+        try:
+            img = decode_image(image_bytes)
+        except ValueError as ve:
+            yield event("error", status=400, detail=str(ve))
+            return
+        yield event("decoded", width=img.width, height=img.height)
+        
+        image_url = upload_mock_s3(image_bytes, filename)
+        with models.acquire() as model:
+            # Inputs built for the pinned model's manifest, as run_inference does
+            manifest = model.manifest if model is not None else get_manifest()
+            inference_result = run_batch_inference([image_to_model_input(img, manifest)],
+                                                   [image_tiles(img, manifest)], model)[0]
+        leaf = analyze_leaf(img)
+        local_analysis = _analysis_from_inference(inference_result, cropType, leaf)
+        yield event("local-prediction", provisional=True,
+                    result=_build_response(local_analysis, None).model_dump(mode="json"))
+        
+        reason = "policy"
+        if policy == routing.CASCADE:
+            reason = routing.escalation_reason(cropType, inference_result)
+        # Under gemini_first Gemini is already running, so only a cascade escalation can be answered by kNN
+        match = None
+        if gemini_future is None and reason and policy == routing.CASCADE:
+            match = embedding_index.knn_answer(inference_result)
+            if match is None:
+                gemini_future = gemini_pool.submit(lambda: _escalate([image_bytes])[0])
+        
+        gemini_result = gemini_future.result() if gemini_future is not None else None
+        if match:
+            routing.record_route("local", "knn_match")
+            analysis = _analysis_from_knn(match, inference_result, cropType, leaf)
+            analysis["processing_time"] = int((time.perf_counter() - started) * 1000)
+            yield event("gemini-result", available=False, skipped=True, knn=True,
+                        result=_build_response(analysis, None).model_dump(mode="json"))
+        elif gemini_result:
+            routing.record_route("gemini", reason)
+            analysis = _with_embedding(_analysis_from_gemini(gemini_result), inference_result)
+            analysis["processing_time"] = int((time.perf_counter() - started) * 1000)
+            yield event("gemini-result", available=True,
+                        result=_build_response(analysis, None).model_dump(mode="json"))
+        elif gemini_future is None:
+            routing.record_route("local", "confident" if policy == routing.CASCADE else "policy")
+            analysis = local_analysis
+            yield event("gemini-result", available=False, skipped=True, result=None)
+        else:
+            logger.info("Gemini Vision unavailable, keeping MobileNetV2 result")
+            routing.record_route("local", "gemini_shed" if gemini_result is _SHED else "gemini_unavailable")
+            analysis = local_analysis
+            yield event("gemini-result", available=False, result=None)
+        
+        analysis["processing_time"] = int((time.perf_counter() - started) * 1000)
+        db_diagnosis = _new_diagnosis(analysis, cropType, image_url, user_id)
+        db.add(db_diagnosis)
+        with timed("db_commit"):
+            record_diagnosis(db, db_diagnosis)
+            db.commit()
+        _index_and_find_similar(db, [(db_diagnosis, analysis)], user_id)
+        
+        ANALYSES.inc(endpoint="stream", source=analysis["source"])
+        alert = outbreak_detector.observe(region, analysis["class_id"], db_diagnosis.created_at)
+        response = _build_response(analysis, alert)
+        # Before the event, so the diagnosis id it announces already replays from /api/history/{id}
+        with timed("payload_store"):
+            payload_store.store(db, [(db_diagnosis, response)])
+        yield event("stored", diagnosisId=db_diagnosis.id, result=response.model_dump(mode="json"))
+    
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Unhandled error in streaming analysis: {e}")
+        yield event("error", status=500, detail="Internal server error")
+    finally:
+        db.close()
+        gemini_pool.shutdown(wait=False)
+        ticket.release()
+
+
+def _decode_and_store(item: dict, manifest: ModelManifest, batch_size: int):
+    """
+    Decode one batch image into a model tensor and tile plan for manifest's model (the plan sharing the tile
+    budget with the rest of the batch) and its leaf statistics, and persist its upload.
+    """
+    img = decode_image(item["bytes"])
+    return (image_to_model_input(img, manifest), image_tiles(img, manifest, batch_size), analyze_leaf(img),
+            upload_mock_s3(item["bytes"], item["filename"]))
+
+
+def _analysis_from_gemini(gemini_result: dict) -> dict:
+    logger.info(f"Using Gemini Vision result: {gemini_result['plant_name']} - {gemini_result['disease_name']}")
+    
+    class_id = gemini_result["disease_id"]
+    
+    # Use Gemini's AI-calculated health scores directly
+    health_score_data = {
+        "score": safe_int(gemini_result.get("health_score"), 75),
+        "breakdown": {
+            "leafCondition": safe_int(gemini_result.get("leaf_condition"), 70),
+            "infectionSeverity": safe_int(gemini_result.get("infection_severity"), 30),
+            "colorAnalysis": safe_int(gemini_result.get("color_analysis"), 70)
+        }
+    }
+    
+    return {
+        "class_id": class_id,
+        "confidence": float(gemini_result.get("confidence", 0.85)),
+        # Build disease info from Gemini's rich response
+        "disease_info": _build_disease_from_gemini(gemini_result),
+        "health_score": health_score_data,
+        # Heatmap placeholder
+        "heatmap": [{"x": 0.5, "y": 0.5, "radius": 0.15, "intensity": 0.8}] if "healthy" not in class_id else [],
+        # Filled in by the caller from its own request clock
+        "processing_time": None,
+        "source": "gemini"
+    }
+
+
+def _analysis_from_inference(inference_result: dict, cropType: Optional[str], leaf: Optional[dict] = None) -> dict:
+    class_id = inference_result["class_id"]
+    confidence = inference_result["confidence"]
+    disease_info = disease_mapper.map_prediction_to_disease(class_id, confidence=confidence)
+    
+    # Allow user-selected cropType to override "Unrecognized Image" name
+    if class_id == "unknown" and cropType and cropType != "auto":
+        formatted_crop = cropType.capitalize()
+        disease_info["name"] = f"{formatted_crop} (Unrecognized Condition)"
+        disease_info["beginnerDescription"] = f"We couldn't confidently identify a specific condition, but we've recorded this as a {formatted_crop} based on your selection."
+        
+    return _with_embedding({
+        "class_id": class_id,
+        "confidence": confidence,
+        "disease_info": disease_info,
+        "health_score": calculate_health_score(disease_info, confidence, leaf or inference_result.get("leaf_analysis")),
+        "heatmap": inference_result["heatmap"],
+        "processing_time": inference_result.get("processing_time", 1500),
+        "multi_disease": inference_result.get("multi_disease", False),
+        "source": "local"
+    }, inference_result)
+
+
+def _analysis_from_knn(match: dict, inference_result: dict, cropType: Optional[str], leaf: Optional[dict] = None) -> dict:
+    """The answer Gemini gave the nearest past cases (embedding_index.classify), in place of a Gemini call."""
+    label, confidence = match["label"], match["confidence"]
+    logger.info(f"Using kNN result: {label} ({match['neighbors']} neighbors, confidence {confidence})")
+    # Copy: the stored Gemini disease info is shared by every answer with this label
+    disease_info = dict(match["info"]) if match["info"] else \
+        disease_mapper.map_prediction_to_disease(label, confidence=confidence)
+    return _with_embedding({
+        "class_id": label,
+        "confidence": confidence,
+        "disease_info": disease_info,
+        "health_score": calculate_health_score(disease_info, confidence, leaf or inference_result.get("leaf_analysis")),
+        "heatmap": inference_result["heatmap"],
+        "processing_time": None,
+        "multi_disease": inference_result.get("multi_disease", False),
+        "source": "knn"
+    }, inference_result)
+
+
+def _with_embedding(analysis: dict, inference_result: Optional[dict]) -> dict:
+    """Carry the image's embedding, if the local pass produced one, so the stored diagnosis can be indexed."""
+    if inference_result and inference_result.get("embedding") is not None:
+        analysis["embedding"] = inference_result["embedding"]
+        analysis["embedding_space"] = inference_result["embedding_space"]
+    return analysis
+
+
+def _index_and_find_similar(db: Session, stored: List[tuple], user_id: Optional[int]):
+    """
+    For committed (diagnosis, analysis) pairs with an embedding: look up the nearest past diagnoses as
+    analysis["similar_cases"] (one query for all of them), then add the new ones to the index.
+    Images are only linked for the caller's own diagnoses.
+    """
+    stored = [(diagnosis, analysis) for diagnosis, analysis in stored if analysis.get("embedding") is not None]
+    if not stored:
+        return
+    with timed("similar_cases"):
+        neighbors = [embedding_index.nearest_cases(analysis, settings.similar_cases) for _, analysis in stored]
+        ids = {neighbor["diagnosis_id"] for found in neighbors for neighbor in found}
+        rows = {row.id: row for row in db.query(Diagnosis).filter(Diagnosis.id.in_(ids))} if ids else {}
+        for (_, analysis), found in zip(stored, neighbors):
+            analysis["similar_cases"] = []
+            for neighbor in found:
+                row = rows.get(neighbor["diagnosis_id"])
+                if row is None:  # deleted since it was indexed
+                    continue
+                analysis["similar_cases"].append({
+                    "diagnosisId": row.id,
+                    "diseaseId": row.disease_id,
+                    "similarity": neighbor["similarity"],
+                    "createdAt": row.created_at,
+                    "imageUrl": row.image_url if user_id is not None and row.user_id == user_id else None,
+                })
+    embedding_index.index_diagnoses([{"diagnosis_id": diagnosis.id, "analysis": analysis}
+                                     for diagnosis, analysis in stored])
+
+
+def _new_diagnosis(analysis: dict, cropType: Optional[str], image_url: Optional[str], user_id: Optional[int]) -> Diagnosis:
+    return Diagnosis(
+        user_id=user_id,
+        crop_type=cropType,
+        disease_id=analysis["class_id"],
+        confidence=analysis["confidence"],
+        health_score=analysis["health_score"]["score"],
+        image_url=image_url
+    )
+
+
+def _build_response(analysis: dict, alert: Optional[dict], breakdown: Optional[dict] = None) -> AnalysisResponse:
+    confidence = analysis["confidence"]
+    
+    # Generate Alternatives
+    alternatives = [
+        AlternativePrediction(
+            disease=disease_mapper.map_prediction_to_disease("healthy", confidence=0.0),
+            confidence=round(float((1 - confidence) * 0.7), 2)
+        )
+    ]
+    
+    return AnalysisResponse(
+        disease=_attach_regional_context(analysis["disease_info"], analysis["class_id"]),
+        confidence=confidence,
+        processingTime=analysis["processing_time"] or 0,
+        processingBreakdown=breakdown,
+        alternatives=alternatives,
+        healthScore=analysis["health_score"],
+        heatmapRegions=[HeatmapRegion(**h) for h in analysis["heatmap"]],
+        confidenceLevel="high" if confidence > 0.85 else "medium" if confidence > 0.6 else "low",
+        multiDiseaseWarning=analysis.get("multi_disease", False),
+        outbreakAlert=_to_outbreak_alert(alert),
+        similarCases=[SimilarCase(**case) for case in analysis["similar_cases"]] if "similar_cases" in analysis else None
+    )
+
+
+def _summarize_plot(results: List[BatchItemResult]) -> PlotSummary:
+    analyzed = [r.result for r in results if r.result is not None]
+    disease_counts = Counter(r.disease.id for r in analyzed)
+    healthy = sum(1 for r in analyzed if "healthy" in r.disease.id)
+    diseased = Counter({d: n for d, n in disease_counts.items() if "healthy" not in d and d != "unknown"})
+    
+    return PlotSummary(
+        totalImages=len(results),
+        analyzed=len(analyzed),
+        failed=len(results) - len(analyzed),
+        healthyCount=healthy,
+        diseasedCount=sum(diseased.values()),
+        averageHealthScore=round(sum(r.healthScore.score for r in analyzed) / len(analyzed), 1) if analyzed else 0.0,
+        diseaseCounts=dict(disease_counts),
+        dominantDisease=diseased.most_common(1)[0][0] if diseased else None
+    )
+
+
+def _attach_regional_context(disease_info: dict, class_id: str) -> dict:
+    """Fill empty commonRegions / seasonalRisk from what the outbreak detector has observed."""
+    if disease_info.get("commonRegions") and disease_info.get("seasonalRisk"):
+        return disease_info
+    # Copy: curated entries from diseases.json are shared across requests
+    return {
+        **disease_info,
+        "commonRegions": disease_info.get("commonRegions") or outbreak_detector.common_regions(class_id),
+        "seasonalRisk": disease_info.get("seasonalRisk") or outbreak_detector.seasonal_risk(class_id),
+    }
+
+
+def _to_outbreak_alert(alert: Optional[dict]) -> Optional[OutbreakAlert]:
+    if not alert:
+        return None
+    return OutbreakAlert(
+        region=alert["region"],
+        diseaseId=alert["disease_id"],
+        count=alert["count"],
+        expected=alert["expected"],
+        zScore=alert["z_score"],
+        windowCount=alert["window_count"],
+        bucketStart=alert["bucket_start"]
+    )
+
+
 def _build_disease_from_gemini(gemini: dict) -> dict:
     """Convert Gemini Vision's response into the Disease schema expected by the frontend."""
     disease_id = gemini.get("disease_id", "unknown")
@@ -1,4 +1,5 @@
 from fastapi import APIRouter
+from app.model.loader import is_model_loaded, model_info
 
 router = APIRouter()
 
@@ -6,5 +7,6 @@ router = APIRouter()
 async def health_check():
     return {
         "status": "online",
-        "model_loaded": True # This can be dynamic later based on loader state
+        "model_loaded": is_model_loaded(),
+        "model": model_info()
     }
@@ -1,11 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 from app.database import get_db
 from app.models import Diagnosis, User
 from app.dependencies import get_current_user
+from app.services import payload_store
+from app.services.metrics import timed
+from app.schemas.response import AnalysisResponse
 from pydantic import BaseModel
 import datetime
+import logging
+
+logger = logging.getLogger("plantcare")
 
 router = APIRouter()
 
@@ -31,3 +37,37 @@ def get_history(
     """
     diagnoses = db.query(Diagnosis).filter(Diagnosis.user_id == current_user.id).order_by(Diagnosis.created_at.desc()).all()
     return diagnoses
+
+@router.get("/history/{diagnosis_id}", response_class=Response, responses={200: {"model": AnalysisResponse}})
+def get_history_item(
+    diagnosis_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Replay one past diagnosis: the AnalysisResponse exactly as it was sent, from its stored payload.
+    The bytes go out as stored (or just decompressed), without being parsed or re-serialized.
+    """
+    row = db.query(Diagnosis.payload, Diagnosis.payload_codec) \
+        .filter(Diagnosis.id == diagnosis_id, Diagnosis.user_id == current_user.id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Diagnosis not found")
+    blob, codec = row
+    if blob is None:
+        raise HTTPException(status_code=404, detail="No stored analysis for this diagnosis (made before payloads were kept)")
+    # A payload's bytes never change once written
+    headers = {"Cache-Control": "private, max-age=86400", "Vary": "Accept-Encoding"}
+    if codec == "gzip" and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(content=blob, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    try:
+        with timed("payload_decode"):
+            content = payload_store.decode(blob, codec)
+    except payload_store.CORRUPT_PAYLOAD_ERRORS as e:
+        logger.warning(f"Stored payload of diagnosis {diagnosis_id} ({codec}) is damaged: {e}")
+        raise HTTPException(status_code=404, detail="The stored analysis for this diagnosis is damaged")
+    except (RuntimeError, OSError, ValueError) as e:
+        # Written with a codec or dictionary this host doesn't have; another deployment may still read it
+        logger.warning(f"Cannot decode stored payload of diagnosis {diagnosis_id} ({codec}): {e}")
+        raise HTTPException(status_code=503, detail="The stored analysis can't be read on this server right now")
+    return Response(content=content, media_type="application/json", headers=headers)
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Depends
+from typing import List, Optional
+from app.dependencies import get_current_user, require_admin_token
+from app.models import User
+from app.services.outbreak import outbreak_detector
+from pydantic import BaseModel
+import datetime
+
+router = APIRouter()
+
+class OutbreakResponse(BaseModel):
+    region: str
+    disease_id: str
+    count: int
+    expected: float
+    z_score: float
+    window_count: int
+    bucket_start: datetime.datetime
+
+class OutbreakStatsResponse(BaseModel):
+    series: int
+    max_series: int
+    active_alerts: int
+    events: int
+    evictions: int
+
+@router.get("/outbreaks", response_model=List[OutbreakResponse])
+def get_outbreaks(region: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """
+    Regional disease spikes flagged within the current detection window, strongest first.
+    The detector lives in each worker process: it is warm-started from the diagnoses table, then only sees the
+    analyses that worker served, so counts (and which spikes cross the threshold) differ between workers.
+    """
+    return outbreak_detector.active_alerts(region=region)
+
+@router.get("/outbreaks/stats", response_model=OutbreakStatsResponse, dependencies=[Depends(require_admin_token)])
+def get_outbreak_stats():
+    """Detector size and activity for the worker that answers (operators only, X-Admin-Token)."""
+    return outbreak_detector.stats()
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Dict, Union, Any, Optional
+from datetime import datetime
 
 class TreatmentPlan(BaseModel):
     immediate: List[str]
@@ -42,13 +43,53 @@ class HeatmapRegion(BaseModel):
     y: float
     radius: float
     intensity: Optional[float] = None
+    diseaseId: Optional[str] = None  # tiled inference: the disease detected in this region
+
+class OutbreakAlert(BaseModel):
+    region: str
+    diseaseId: str
+    count: int
+    expected: float
+    zScore: float
+    windowCount: int
+    bucketStart: datetime
+
+class SimilarCase(BaseModel):
+    diagnosisId: int
+    diseaseId: str
+    similarity: float  # cosine similarity of the two images' embeddings
+    createdAt: Optional[datetime] = None
+    imageUrl: Optional[str] = None  # only for the caller's own diagnoses
 
 class AnalysisResponse(BaseModel):
     disease: Disease
     confidence: float
     processingTime: int
+    processingBreakdown: Optional[Dict[str, float]] = None
     alternatives: List[AlternativePrediction]
     healthScore: HealthScore
     heatmapRegions: List[HeatmapRegion]
     confidenceLevel: str
     multiDiseaseWarning: bool
+    outbreakAlert: Optional[OutbreakAlert] = None
+    similarCases: Optional[List[SimilarCase]] = None
+
+class BatchItemResult(BaseModel):
+    filename: str
+    result: Optional[AnalysisResponse] = None
+    error: Optional[str] = None
+
+class PlotSummary(BaseModel):
+    totalImages: int
+    analyzed: int
+    failed: int
+    healthyCount: int
+    diseasedCount: int
+    averageHealthScore: float
+    diseaseCounts: Dict[str, int]
+    dominantDisease: Optional[str] = None
+
+class BatchAnalysisResponse(BaseModel):
+    results: List[BatchItemResult]
+    summary: PlotSummary
+    processingTime: int
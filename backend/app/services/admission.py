@@ -0,0 +1,262 @@
+"""
+Admission control for the analysis endpoints.
+
+Runs as an async dependency, i.e. on the event loop before a request takes
+a threadpool thread, and applies three checks in order:
+
+  1. per-caller token bucket (user ID when signed in, else client IP, read
+     from X-Forwarded-For only behind settings.trusted_proxies), 429 +
+     Retry-After when empty;
+  2. per-lane concurrency limit: "gemini" for requests that call Gemini up
+     front, "local" for requests answered by the local model first. Each
+     lane has its own budget, so a Gemini slowdown can't starve local work;
+  3. a bounded wait queue per lane. Requests beyond the in-flight limit
+     wait up to admission_queue_timeout_s. When the queue already holds
+     admission_max_queue requests, or the wait times out, the request is
+     shed with 503 + Retry-After instead of piling up in the threadpool.
+
+Admitted requests hold a Ticket and release it when done. A slot freed
+by release() goes straight to the oldest waiter. The route dependencies
+yield their ticket and release it on the way out, so a request rejected
+after admission (a malformed form is a 422) can't keep its slot.
+"""
+import asyncio
+import functools
+import ipaddress
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple, Union
+
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.services.metrics import registry
+
+GEMINI_LANE = "gemini"
+LOCAL_LANE = "local"
+
+ADMISSIONS = registry.counter(
+    "plantcare_admission_total",
+    "Admission decisions for analysis requests, by lane and outcome.",
+    ("lane", "outcome"),
+)
+IN_FLIGHT = registry.gauge(
+    "plantcare_admission_in_flight",
+    "Analysis requests currently admitted, by lane.",
+    ("lane",),
+)
+QUEUED = registry.gauge(
+    "plantcare_admission_queued",
+    "Analysis requests waiting for a slot, by lane.",
+    ("lane",),
+)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "plantcare_admission_wait_seconds",
+    "Time admitted requests spent waiting for a slot, by lane.",
+    ("lane",),
+)
+
+
+@functools.lru_cache(maxsize=4)
+def _proxy_networks(proxies: Tuple[str, ...]) -> Tuple[Union[ipaddress.IPv4Network, ipaddress.IPv6Network], ...]:
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies if proxy != "*")
+
+
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _proxy_networks(tuple(settings.trusted_proxies)))
+
+
+def client_ip(request: Request) -> str:
+    """
+    The caller's address: the socket peer, or when that is one of settings.trusted_proxies, the nearest
+    X-Forwarded-For hop that isn't (with "*" only the peer is trusted, i.e. the last hop it appended).
+    """
+    peer = request.client.host if request.client else "unknown"
+    trust_any_peer = "*" in settings.trusted_proxies
+    if not (trust_any_peer or _is_trusted_proxy(peer)):
+        return peer
+    hops = [hop.strip() for header in request.headers.getlist("x-forwarded-for")
+            for hop in header.split(",") if hop.strip()]
+    if not hops:
+        return peer
+    if trust_any_peer:
+        return hops[-1]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0]
+
+
+class RateLimiter:
+    """Token bucket per caller; idle buckets are evicted least-recently-used first."""
+
+    def __init__(self, max_callers: int = 100_000):
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_callers = max_callers
+
+    def take(self, identity: str, cost: float = 1.0) -> float:
+        """0 when admitted, else seconds until enough tokens will have accrued."""
+        rate = settings.admission_rate_per_minute / 60
+        if rate <= 0:
+            return 0.0
+        burst = max(float(settings.admission_burst), cost)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(identity, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[identity] = (tokens, now)
+            while len(self._buckets) > self.max_callers:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class Lane:
+    def __init__(self, name: str):
+        self.name = name
+        self.in_flight = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+        # Smoothed request duration, for Retry-After estimates
+        self._service_s = 1.0
+
+    def limit(self) -> int:
+        if self.name == GEMINI_LANE:
+            return settings.admission_max_in_flight_gemini
+        return settings.admission_max_in_flight_local
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained."""
+        backlog = self.in_flight + len(self._waiters)
+        return max(1, math.ceil(backlog * self._service_s / max(1, self.limit())))
+
+    async def acquire(self) -> bool:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.in_flight < self.limit() and not self._waiters:
+                self.in_flight += 1
+                IN_FLIGHT.set(self.in_flight, lane=self.name)
+                return True
+            if len(self._waiters) >= settings.admission_max_queue:
+                return False
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+            QUEUED.set(len(self._waiters), lane=self.name)
+        try:
+            # release() hands its slot over by resolving the future, so in_flight is already counted
+            await asyncio.wait_for(asyncio.shield(waiter[1]), settings.admission_queue_timeout_s)
+            return True
+        except asyncio.TimeoutError:
+            if self._withdraw(waiter):
+                return False
+            # Lost the race: the slot was handed over just as the wait timed out; keep it
+            return True
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot that may already have been handed over
+            if not self._withdraw(waiter):
+                self.release(None)
+            raise
+
+    def _withdraw(self, waiter) -> bool:
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                QUEUED.set(len(self._waiters), lane=self.name)
+                return True
+            return False
+
+    def release(self, duration_s: Optional[float]):
+        with self._lock:
+            if duration_s is not None:
+                self._service_s += 0.1 * (duration_s - self._service_s)
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                QUEUED.set(len(self._waiters), lane=self.name)
+                if not future.done():
+                    loop.call_soon_threadsafe(_resolve, future)
+                    return
+            self.in_flight -= 1
+            IN_FLIGHT.set(self.in_flight, lane=self.name)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Ticket:
+    """An admitted request's slot; release() is idempotent and thread-safe so every exit path can call it."""
+
+    def __init__(self, lane: Lane, started: Optional[float] = None):
+        self.lane = lane
+        self.started = started if started is not None else time.perf_counter()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def _take(self) -> bool:
+        with self._lock:
+            if self._released:
+                return False
+            self._released = True
+            return True
+
+    def release(self):
+        if self._take():
+            self.lane.release(time.perf_counter() - self.started)
+
+    def detach(self) -> "Ticket":
+        """
+        Move the slot to a new Ticket, for work that outlives the request handler (a streaming body); releasing
+        this one becomes a no-op.
+        """
+        if not self._take():
+            raise RuntimeError("Admission ticket already released")
+        return Ticket(self.lane, self.started)
+
+
+class AdmissionController:
+    def __init__(self):
+        self.rate_limiter = RateLimiter()
+        self.lanes: Dict[str, Lane] = {GEMINI_LANE: Lane(GEMINI_LANE), LOCAL_LANE: Lane(LOCAL_LANE)}
+
+    async def admit(self, identity: str, lane_name: str, cost: float = 1.0) -> Ticket:
+        lane = self.lanes[lane_name]
+        wait = self.rate_limiter.take(identity, cost)
+        if wait > 0:
+            ADMISSIONS.inc(lane=lane_name, outcome="rate_limited")
+            raise HTTPException(status_code=429, detail="Too many analysis requests; slow down",
+                                headers={"Retry-After": str(math.ceil(wait))})
+        started = time.perf_counter()
+        if not await lane.acquire():
+            ADMISSIONS.inc(lane=lane_name, outcome="shed")
+            raise HTTPException(status_code=503, detail="Server is busy; try again shortly",
+                                headers={"Retry-After": str(lane.retry_after())})
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - started, lane=lane_name)
+        ADMISSIONS.inc(lane=lane_name, outcome="admitted")
+        return Ticket(lane)
+
+    def try_gemini_slot(self) -> Optional[Ticket]:
+        """Non-blocking Gemini slot for a cascade escalation; None when the Gemini lane is saturated."""
+        lane = self.lanes[GEMINI_LANE]
+        with lane._lock:
+            if lane.in_flight >= lane.limit() or lane._waiters:
+                ADMISSIONS.inc(lane=GEMINI_LANE, outcome="escalation_shed")
+                return None
+            lane.in_flight += 1
+            IN_FLIGHT.set(lane.in_flight, lane=GEMINI_LANE)
+        ADMISSIONS.inc(lane=GEMINI_LANE, outcome="escalation_admitted")
+        return Ticket(lane)
+
+
+admission = AdmissionController()
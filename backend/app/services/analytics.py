@@ -0,0 +1,248 @@
+import datetime
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Diagnosis, DiagnosisRollup
+
+logger = logging.getLogger("plantcare")
+
+# Granularities that are materialized on write. Coarser buckets (week, month)
+# are folded from the daily rollup at query time, which is still O(buckets).
+ROLLUP_GRANULARITIES = ("hour", "day")
+QUERY_GRANULARITIES = ("hour", "day", "week", "month")
+
+UNSPECIFIED_CROP = "auto"
+
+# Hour buckets are pruned from record_diagnosis() at most this often per process
+_PRUNE_INTERVAL_S = 3600.0
+_last_prune = 0.0
+
+
+def _utc_naive(ts: datetime.datetime) -> datetime.datetime:
+    """SQLite drops tzinfo, so every bucket boundary is stored as naive UTC."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def bucket_start(ts: datetime.datetime, granularity: str) -> datetime.datetime:
+    """Truncate a timestamp to the start of its bucket."""
+    ts = _utc_naive(ts)
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def _normalize_crop(crop_type: Optional[str]) -> str:
+    return (crop_type or UNSPECIFIED_CROP).lower()
+
+
+def _upsert_rollup(db: Session, granularity: str, start: datetime.datetime, crop_type: str,
+                   disease_id: str, count: int, score_sum: int):
+    """Atomically add to a rollup bucket, creating it on first use."""
+    dialect = db.get_bind().dialect.name
+    values = {
+        "granularity": granularity,
+        "bucket_start": start,
+        "crop_type": crop_type,
+        "disease_id": disease_id,
+        "diagnosis_count": count,
+        "health_score_sum": score_sum,
+    }
+
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        table = DiagnosisRollup.__table__
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["granularity", "bucket_start", "crop_type", "disease_id"],
+            set_={
+                "diagnosis_count": table.c.diagnosis_count + stmt.excluded.diagnosis_count,
+                "health_score_sum": table.c.health_score_sum + stmt.excluded.health_score_sum,
+            },
+        )
+        db.execute(stmt)
+        return
+
+    # Generic fallback for dialects without ON CONFLICT support
+    row = db.query(DiagnosisRollup).filter_by(
+        granularity=granularity, bucket_start=start, crop_type=crop_type, disease_id=disease_id
+    ).with_for_update().first()
+    if row is None:
+        db.add(DiagnosisRollup(**values))
+    else:
+        row.diagnosis_count += count
+        row.health_score_sum += score_sum
+
+
+def record_diagnosis(db: Session, diagnosis: Diagnosis):
+    """
+    Fold a new diagnosis into the rollup tables.
+    Runs inside the caller's transaction so the rollups commit (or roll back) with the row itself.
+    """
+    if diagnosis.created_at is None:
+        diagnosis.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+    crop_type = _normalize_crop(diagnosis.crop_type)
+    disease_id = diagnosis.disease_id or "unknown"
+    score = int(diagnosis.health_score or 0)
+
+    for granularity in ROLLUP_GRANULARITIES:
+        _upsert_rollup(db, granularity, bucket_start(diagnosis.created_at, granularity),
+                       crop_type, disease_id, 1, score)
+
+    global _last_prune
+    if time.monotonic() - _last_prune >= _PRUNE_INTERVAL_S:
+        _last_prune = time.monotonic()
+        prune_hour_rollups(db)
+
+
+def hour_retention_start(now: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+    """Oldest hour bucket that is kept (naive UTC), or None when hour buckets are kept forever."""
+    if settings.analytics_hour_retention_days <= 0:
+        return None
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return bucket_start(now - datetime.timedelta(days=settings.analytics_hour_retention_days), "hour")
+
+
+def prune_hour_rollups(db: Session, now: Optional[datetime.datetime] = None) -> int:
+    """
+    Delete hour buckets older than settings.analytics_hour_retention_days, in the caller's transaction.
+    Day buckets are never pruned: week and month views are folded from them. Returns the rows deleted.
+    """
+    cutoff = hour_retention_start(now)
+    if cutoff is None:
+        return 0
+    table = DiagnosisRollup.__table__
+    result = db.execute(delete(table).where(table.c.granularity == "hour", table.c.bucket_start < cutoff))
+    return result.rowcount or 0
+
+
+def rebuild_rollups(db: Session, batch_size: int = 10000) -> int:
+    """
+    Recompute every rollup bucket from the raw diagnoses table.
+    Only needed to backfill rows written before rollups existed; returns the number of diagnoses scanned.
+    """
+    totals: Dict[Tuple[str, datetime.datetime, str, str], List[int]] = defaultdict(lambda: [0, 0])
+    scanned = 0
+    hour_cutoff = hour_retention_start()
+
+    rows = db.query(Diagnosis.created_at, Diagnosis.crop_type, Diagnosis.disease_id, Diagnosis.health_score)
+    for created_at, crop_type, disease_id, health_score in rows.yield_per(batch_size):
+        if created_at is None:
+            continue
+        scanned += 1
+        crop = _normalize_crop(crop_type)
+        disease = disease_id or "unknown"
+        for granularity in ROLLUP_GRANULARITIES:
+            start = bucket_start(created_at, granularity)
+            if granularity == "hour" and hour_cutoff is not None and start < hour_cutoff:
+                continue
+            entry = totals[(granularity, start, crop, disease)]
+            entry[0] += 1
+            entry[1] += int(health_score or 0)
+
+    db.query(DiagnosisRollup).delete()
+    mappings = [
+        {
+            "granularity": granularity,
+            "bucket_start": start,
+            "crop_type": crop,
+            "disease_id": disease,
+            "diagnosis_count": count,
+            "health_score_sum": score_sum,
+        }
+        for (granularity, start, crop, disease), (count, score_sum) in totals.items()
+    ]
+    for i in range(0, len(mappings), batch_size):
+        db.bulk_insert_mappings(DiagnosisRollup, mappings[i:i + batch_size])
+    db.commit()
+
+    logger.info(f"Rebuilt {len(mappings)} rollup buckets from {scanned} diagnoses")
+    return scanned
+
+
+def query_analytics(
+    db: Session,
+    granularity: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    crop_type: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Disease prevalence and average health score per crop and time bucket, read from the rollups.
+    Cost is proportional to the number of buckets in range, not the number of diagnoses.
+    start is widened to the start of its bucket (week: Monday, month: the 1st), so the first bucket is complete.
+    """
+    if granularity not in QUERY_GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+
+    source = "hour" if granularity == "hour" else "day"
+    table = DiagnosisRollup.__table__
+    query = select(
+        table.c.bucket_start,
+        table.c.crop_type,
+        table.c.disease_id,
+        table.c.diagnosis_count,
+        table.c.health_score_sum,
+    ).where(
+        table.c.granularity == source,
+        table.c.bucket_start >= bucket_start(start, granularity),
+        table.c.bucket_start < _utc_naive(end),
+    )
+    if crop_type:
+        query = query.where(table.c.crop_type == _normalize_crop(crop_type))
+
+    buckets: Dict[Tuple[datetime.datetime, str], Dict] = {}
+    for row_start, crop, disease, count, score_sum in db.execute(query):
+        if granularity in ("week", "month"):
+            row_start = bucket_start(row_start, granularity)
+        key = (row_start, crop)
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {"total": 0, "score_sum": 0, "diseases": defaultdict(int)}
+        bucket["total"] += count
+        bucket["score_sum"] += score_sum
+        bucket["diseases"][disease] += count
+
+    results = []
+    for (start_ts, crop), bucket in sorted(buckets.items()):
+        total = bucket["total"]
+        diseases = sorted(bucket["diseases"].items(), key=lambda item: item[1], reverse=True)
+        results.append({
+            "bucket_start": start_ts,
+            "crop_type": crop,
+            "total": total,
+            "avg_health_score": round(bucket["score_sum"] / total, 2) if total else 0.0,
+            "diseases": [
+                {"disease_id": disease, "count": count, "prevalence": round(count / total, 4)}
+                for disease, count in diseases
+            ],
+        })
+    return results
+
+
+if __name__ == "__main__":
+    # Backfill: python -m app.services.analytics
+    from app.database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        print(f"Rolled up {rebuild_rollups(session)} diagnoses")
+    finally:
+        session.close()
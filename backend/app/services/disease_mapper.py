@@ -1,18 +1,29 @@
 import json
-import os
 from pathlib import Path
 from typing import List, Dict, Any, Optional
-import google.generativeai as genai
-from app.config import settings
+from app.services.gemini_client import StructuredPrompt, gemini_enabled
+from app.services.gemini_quota import BACKGROUND, gemini_governor
 
-# Configure Gemini once
-if hasattr(settings, 'gemini_api_key') and settings.gemini_api_key:
-    genai.configure(api_key=settings.gemini_api_key)
-else:
-    # Fallback to direct environment variable if pydantic config misses it
-    api_key = os.environ.get("GEMINI_API_KEY", "")
-    if api_key:
-        genai.configure(api_key=api_key)
+_STEPS = {"type": "array", "items": {"type": "string"}, "description": "3-5 short actionable steps"}
+
+TREATMENT_PROMPT = StructuredPrompt(
+    purpose="treatment",
+    model_name="gemini-2.5-flash",
+    system_instruction="You are an agriculture expert. For the plant disease you are given, write a treatment "
+                       "plan as short, actionable steps. No extra explanation.",
+    response_schema={
+        "type": "object",
+        "properties": {
+            "immediate_action": _STEPS,
+            "organic_treatment": _STEPS,
+            "chemical_treatment": _STEPS,
+            "prevention": _STEPS,
+        },
+        "required": ["immediate_action", "organic_treatment", "chemical_treatment", "prevention"],
+    },
+    # Short prompt, ~20 short steps back
+    token_estimate=600,
+)
 
 class DiseaseMapper:
     def __init__(self):
@@ -95,31 +106,12 @@ class DiseaseMapper:
             
         # --- DYNAMIC GEMINI GENERATION ---
         treatment_plan = None
-        if "healthy" not in name_lower:
+        # Enrichment, not the diagnosis itself: skipped rather than queued when interactive calls need the quota
+        if "healthy" not in name_lower and gemini_enabled() \
+                and gemini_governor.acquire(TREATMENT_PROMPT.token_estimate, BACKGROUND):
             try:
-                gemini = genai.GenerativeModel("gemini-2.5-flash")
-                prompt = f"""
-You are an agriculture expert.
-
-Disease detected: {formatted_name}
-Confidence: {confidence * 100:.1f}%
-
-Return ONLY valid JSON with exactly these keys:
-immediate_action, organic_treatment, chemical_treatment, prevention
-
-Each key must contain an array of 3-5 short actionable steps (strings).
-No extra explanation. Only JSON.
-"""
-                response = gemini.generate_content(prompt)
-                
-                # Clean response text (remove markdown json blocks if present)
-                json_text = response.text.strip()
-                if json_text.startswith("```json"):
-                    json_text = json_text[7:-3].strip()
-                elif json_text.startswith("```"):
-                    json_text = json_text[3:-3].strip()
-                    
-                raw_plan = json.loads(json_text)
+                raw_plan = TREATMENT_PROMPT.generate(f"Disease detected: {formatted_name}\n"
+                                                     f"Confidence: {confidence * 100:.1f}%")
                 
                 # Map Gemini keys to our Frontend expected keys
                 treatment_plan = {
@@ -0,0 +1,536 @@
+"""
+Embedding index: similar past cases, and a kNN answer for repeat Gemini-class photos.
+
+MobileNetV2 only knows its 38 PlantVillage classes. Anything else goes to
+Gemini, and the same uncovered disease photographed again costs another
+call. Every diagnosis therefore also keeps the image's embedding: the
+model's penultimate-layer features (1280-d for MobileNetV2, from backends
+with a feature output, see InferenceBackend.predict_features), averaged
+over views, L2-normalized. It is labeled with the answer and who gave it
+(SOURCES). There is one index per feature space, because embeddings from
+different weights don't compare (ModelManifest.embedding_space). Each lives
+in settings.embedding_index_path/<space>/:
+
+  index.json   dimension, row count and capacity, label vocabulary, the
+               Gemini disease info per Gemini label, last indexed diagnosis
+  vectors.f16  (capacity, dim) float16: 2.5 KB per diagnosis at 1280-d
+  ids.i64, labels.i32, sources.u8
+               per row: diagnosis id, label, source
+
+All four are memory-mapped, so the workers on a host share one copy through
+the page cache. Capacity doubles as rows are appended. Appends hold an
+flock on the directory. A worker that sees index.json change maps the rows
+the others appended.
+
+Search is exact (every row scored) below settings.embedding_ivf_min_vectors
+rows. Past that, an inverted-file (IVF) index is trained on a background
+thread, and trained again whenever the index has doubled since:
+
+  projection  PCA of a sample down to _COARSE_DIM dimensions
+  lists       k-means on the projected sample, sqrt(N) centroids; every row
+              is filed under its nearest centroid with its projection as a
+              float16 code (128 bytes, in this process), new rows as they
+              arrive
+  query       the rows in the settings.embedding_ivf_nprobe nearest lists are
+              ranked by their codes, and the best _RERANK_PER_RESULT per
+              requested neighbor are scored exactly on their full vectors
+
+classify() is the kNN answer. Neighbors at cosine similarity of at least
+settings.knn_min_similarity, among the settings.knn_k nearest Gemini-labeled
+rows, vote, weighted by similarity. It answers when at least
+settings.knn_min_neighbors of them vote and one label gets
+settings.knn_min_agreement of the vote. Only Gemini's labels vote, so
+the classifier never learns from its own answers.
+It stands in for cascade escalations; under gemini_first only with
+settings.knn_gemini_first, since there Gemini is the answer asked for.
+
+Index the diagnoses made before the index existed (images under uploads/):
+    python -m app.services.embedding_index
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.services.metrics import registry, timed
+
+logger = logging.getLogger("plantcare")
+
+# Who labeled a row; "unknown" is a backfilled diagnosis whose answer could have come from either model
+SOURCES = ("unknown", "gemini", "local", "knn")
+
+_HEADER = "index.json"
+_LOCK = "lock"
+_COLUMNS = {
+    "vectors": ("vectors.f16", np.float16),
+    "ids": ("ids.i64", np.int64),
+    "labels": ("labels.i32", np.int32),
+    "sources": ("sources.u8", np.uint8),
+}
+_INITIAL_CAPACITY = 1024
+_COARSE_DIM = 64
+_KMEANS_ITERATIONS = 8
+_TRAIN_POINTS_PER_LIST = 40
+_PCA_SAMPLE = 20_000
+# Rows converted to float32 at a time when scanning the matrix
+_CHUNK_ROWS = 65_536
+# IVF candidates scored exactly per requested neighbor, best first by their codes
+_RERANK_PER_RESULT = 64
+
+KNN_RESULTS = registry.counter(
+    "plantcare_knn_total",
+    "kNN classification attempts by outcome (match, too_few_neighbors, disagreement).",
+    ("outcome",),
+)
+INDEX_VECTORS = registry.gauge(
+    "plantcare_embedding_index_vectors",
+    "Embeddings in the index of the served model's feature space.",
+)
+
+
+def _nearest(projected: np.ndarray, centroids: np.ndarray, half_norms: np.ndarray) -> np.ndarray:
+    # argmin |p - c|^2 == argmax p.c - |c|^2 / 2
+    return np.argmax(projected @ centroids.T - half_norms, axis=1)
+
+
+class _IVF:
+    """
+    Coarse quantizer: PCA projection, k-means centroids, and per centroid the rows filed under it with their
+    projections (float16 codes, which rank a probe's candidates before the full vectors are read).
+    """
+
+    def __init__(self, mean: np.ndarray, components: np.ndarray, centroids: np.ndarray):
+        self.mean = mean
+        self.components = components
+        self.centroids = centroids
+        self._half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+        self.lists: List[np.ndarray] = [np.empty(0, np.int64) for _ in range(len(centroids))]
+        self.codes: List[np.ndarray] = [np.empty((0, components.shape[1]), np.float16) for _ in range(len(centroids))]
+        self.rows = 0  # rows [0, rows) are filed
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, count: int, rng: np.random.Generator) -> "_IVF":
+        nlist = max(1, int(np.sqrt(count)))
+        sample = vectors[np.sort(rng.choice(count, min(count, nlist * _TRAIN_POINTS_PER_LIST), replace=False))]
+        sample = sample.astype(np.float32)
+        mean = sample.mean(axis=0)
+        sample -= mean
+        # Principal directions from the (dim x dim) covariance of a subsample, cheaper than an SVD of the sample
+        pca = sample[::max(1, len(sample) // _PCA_SAMPLE)]
+        _, eigenvectors = np.linalg.eigh(pca.T @ pca)
+        components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :_COARSE_DIM], dtype=np.float32)
+        projected = sample @ components
+
+        centroids = projected[rng.choice(len(projected), nlist, replace=False)].copy()
+        for _ in range(_KMEANS_ITERATIONS):
+            assignments = _nearest(projected, centroids, 0.5 * (centroids ** 2).sum(axis=1))
+            counts = np.bincount(assignments, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, projected)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        return cls(mean, components, centroids)
+
+    def add(self, vectors: np.ndarray, end: int):
+        """File rows [self.rows, end) under their nearest centroids."""
+        for start in range(self.rows, end, _CHUNK_ROWS):
+            stop = min(end, start + _CHUNK_ROWS)
+            projected = (vectors[start:stop].astype(np.float32) - self.mean) @ self.components
+            assignments = _nearest(projected, self.centroids, self._half_norms)
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            codes = projected.astype(np.float16)
+            for list_id in np.flatnonzero(np.diff(bounds)):
+                members = order[bounds[list_id]:bounds[list_id + 1]]
+                self.lists[list_id] = np.concatenate([self.lists[list_id], members + start])
+                self.codes[list_id] = np.concatenate([self.codes[list_id], codes[members]])
+        self.rows = max(self.rows, end)
+
+    def probe(self, query: np.ndarray, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows in the nprobe lists nearest to the query, with an approximate closeness for each: minus the squared
+        distance between the projections, up to a per-query constant (vectors are unit length, so nearer is more similar).
+        """
+        projected = (query - self.mean) @ self.components
+        closeness = self.centroids @ projected - self._half_norms
+        nprobe = min(nprobe, len(closeness))
+        nearest = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+        codes = np.concatenate([self.codes[i] for i in nearest]).astype(np.float32)
+        approx = 2 * (codes @ projected) - np.einsum("ij,ij->i", codes, codes)
+        return np.concatenate([self.lists[i] for i in nearest]), approx
+
+    def nbytes(self) -> int:
+        arrays = [self.mean, self.components, self.centroids] + self.lists + self.codes
+        return sum(array.nbytes for array in arrays)
+
+
+def _similarities(vectors: np.ndarray, query: np.ndarray, count: int, rows: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Cosine similarity of the query with rows (all of [0, count) when None); vectors are unit length.
+    Converting float16 to float32 is most of the cost (~2 ns an element), hence the IVF's candidate ranking.
+    """
+    if rows is None:
+        return np.concatenate([vectors[start:min(count, start + _CHUNK_ROWS)].astype(np.float32) @ query
+                               for start in range(0, count, _CHUNK_ROWS)])
+    return np.asarray(vectors[rows], dtype=np.float32) @ query if len(rows) else np.empty(0, np.float32)
+
+
+class EmbeddingIndex:
+    """One feature space's embeddings and labels on disk, with this process's IVF over them."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._header = {"dim": None, "count": 0, "capacity": 0, "labels": [], "label_info": {},
+                        "last_diagnosis_id": 0}
+        self._header_stat = None
+        self._label_ids: Dict[str, int] = {}
+        self._columns: Dict[str, np.memmap] = {}
+        self._ivf: Optional[_IVF] = None
+        self._trained_on = 0
+        self._training = False
+        with self._lock:
+            self._sync()
+
+    @property
+    def count(self) -> int:
+        return self._header["count"]
+
+    @property
+    def last_diagnosis_id(self) -> int:
+        return self._header["last_diagnosis_id"]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._path(_LOCK), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _map(self, dim: int, capacity: int):
+        self._columns = {
+            name: np.memmap(self._path(filename), dtype=dtype, mode="r+",
+                            shape=(capacity, dim) if name == "vectors" else (capacity,))
+            for name, (filename, dtype) in _COLUMNS.items()
+        }
+
+    def _sync(self):
+        """Map the rows other workers appended since this one last looked. Caller holds self._lock."""
+        try:
+            stat = os.stat(self._path(_HEADER))
+        except FileNotFoundError:
+            return
+        # index.json is replaced on every write, so a new inode (or size, or mtime) means new rows
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if key == self._header_stat:
+            return
+        with open(self._path(_HEADER)) as f:
+            header = json.load(f)
+        if header["capacity"] != self._header["capacity"]:
+            self._map(header["dim"], header["capacity"])
+        self._header, self._header_stat = header, key
+        self._label_ids = {label: i for i, label in enumerate(header["labels"])}
+        self._catch_up()
+
+    def _write_header(self):
+        tmp = self._path(f"{_HEADER}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._header, f)
+        os.replace(tmp, self._path(_HEADER))
+        stat = os.stat(self._path(_HEADER))
+        self._header_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _grow(self, dim: int, capacity: int):
+        for name, (filename, dtype) in _COLUMNS.items():
+            with open(self._path(filename), "ab") as f:
+                f.truncate(capacity * np.dtype(dtype).itemsize * (dim if name == "vectors" else 1))
+        self._header["capacity"] = capacity
+        self._map(dim, capacity)
+
+    def add(self, entries: Sequence[dict]):
+        """
+        Append diagnoses, each {"diagnosis_id", "vector", "label", "source", "info"}. info is the disease info
+        of a Gemini answer, kept per label so a kNN answer can reuse it.
+        """
+        if not entries:
+            return
+        vectors = np.stack([np.asarray(entry["vector"], np.float16).ravel() for entry in entries])
+        with self._lock, self._file_lock():
+            self._sync()
+            header = self._header
+            if header["dim"] is None:
+                header["dim"] = vectors.shape[1]
+            elif vectors.shape[1] != header["dim"]:
+                raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, the index {header['dim']}")
+            start, end = header["count"], header["count"] + len(entries)
+            if end > header["capacity"]:
+                capacity = max(_INITIAL_CAPACITY, header["capacity"])
+                while capacity < end:
+                    capacity *= 2
+                self._grow(header["dim"], capacity)
+
+            labels = []
+            for entry in entries:
+                label = entry["label"]
+                if label not in self._label_ids:
+                    self._label_ids[label] = len(header["labels"])
+                    header["labels"].append(label)
+                if entry.get("info") is not None and entry["source"] == "gemini":
+                    header["label_info"][label] = entry["info"]
+                labels.append(self._label_ids[label])
+            columns = self._columns
+            columns["vectors"][start:end] = vectors
+            columns["ids"][start:end] = [entry["diagnosis_id"] for entry in entries]
+            columns["labels"][start:end] = labels
+            columns["sources"][start:end] = [SOURCES.index(entry["source"]) for entry in entries]
+            # Rows first, header last: a reader never sees a count covering unwritten rows
+            header["count"] = end
+            header["last_diagnosis_id"] = max([header["last_diagnosis_id"]] + [e["diagnosis_id"] for e in entries])
+            self._write_header()
+            self._catch_up()
+
+    def _catch_up(self):
+        """File new rows in the IVF, and start (re)training it when due. Caller holds self._lock."""
+        INDEX_VECTORS.set(self.count)
+        if self._ivf is not None and self._ivf.rows < self.count:
+            self._ivf.add(self._columns["vectors"], self.count)
+        due = self.count >= settings.embedding_ivf_min_vectors and \
+            (self._ivf is None or self.count >= 2 * self._trained_on)
+        if due and not self._training:
+            self._training = True
+            threading.Thread(target=self.train, name="embedding-ivf", daemon=True).start()
+
+    def train(self):
+        """Train the IVF on the rows there are now; runs on a background thread unless called directly."""
+        with self._lock:
+            vectors, count = self._columns.get("vectors"), self.count
+        try:
+            if not count:
+                return
+            started = time.perf_counter()
+            ivf = _IVF.train(vectors, count, np.random.default_rng(count))
+            ivf.add(vectors, count)
+            with self._lock:
+                # Rows appended while training, from the current (possibly grown) mapping
+                ivf.add(self._columns["vectors"], self.count)
+                self._ivf, self._trained_on = ivf, count
+            logger.info(f"Embedding IVF trained: {count} vectors, {len(ivf.lists)} lists in "
+                        f"{time.perf_counter() - started:.1f}s ({self.directory})")
+        except Exception as e:
+            logger.warning(f"Embedding IVF training failed for {self.directory}: {e}")
+        finally:
+            self._training = False
+
+    def search(self, vector: np.ndarray, k: int, sources: Optional[Sequence[str]] = None,
+               exact: bool = False) -> List[dict]:
+        """
+        The k nearest rows by cosine similarity, best first, as {"diagnosis_id", "label", "source", "similarity"}.
+        sources limits the rows to those labeled by them; exact skips the IVF.
+        """
+        query = np.asarray(vector, np.float32).ravel()
+        with self._lock:
+            self._sync()
+            count, header, columns, ivf = self.count, self._header, self._columns, self._ivf
+        if not count or k <= 0 or len(query) != header["dim"]:
+            return []
+
+        codes = [SOURCES.index(source) for source in sources] if sources is not None else None
+        rows = None
+        if ivf is not None and not exact:
+            rows, approx = ivf.probe(query, settings.embedding_ivf_nprobe)
+            if codes is not None:
+                keep = np.isin(columns["sources"][rows], codes)
+                rows, approx = rows[keep], approx[keep]
+            rerank = k * _RERANK_PER_RESULT
+            if len(rows) > rerank:
+                rows = rows[np.argpartition(-approx, rerank - 1)[:rerank]]
+            rows = np.sort(rows)
+        similarities = _similarities(columns["vectors"], query, count, rows)
+        if codes is not None and rows is None:
+            similarities[~np.isin(columns["sources"][:count], codes)] = -np.inf
+
+        k = min(k, len(similarities))
+        if not k:
+            return []
+        best = np.argpartition(-similarities, k - 1)[:k]
+        best = best[np.argsort(-similarities[best])]
+        best = best[np.isfinite(similarities[best])]
+        found = best if rows is None else rows[best]
+        return [{
+            "diagnosis_id": int(columns["ids"][row]),
+            "label": header["labels"][columns["labels"][row]],
+            "source": SOURCES[columns["sources"][row]],
+            "similarity": round(float(similarity), 4),
+        } for row, similarity in zip(found, similarities[best])]
+
+    def classify(self, vector: np.ndarray) -> Optional[dict]:
+        """
+        The label Gemini-labeled near neighbors agree on, as {"label", "confidence", "neighbors", "info"},
+        or None when too few of them are close enough or they disagree.
+        """
+        with timed("knn"):
+            neighbors = [neighbor for neighbor in self.search(vector, settings.knn_k, sources=("gemini",))
+                         if neighbor["similarity"] >= settings.knn_min_similarity]
+        if len(neighbors) < settings.knn_min_neighbors:
+            KNN_RESULTS.inc(outcome="too_few_neighbors")
+            return None
+        votes: Dict[str, float] = {}
+        for neighbor in neighbors:
+            votes[neighbor["label"]] = votes.get(neighbor["label"], 0.0) + neighbor["similarity"]
+        label, weight = max(votes.items(), key=lambda vote: vote[1])
+        agreement = weight / sum(votes.values())
+        if agreement < settings.knn_min_agreement:
+            KNN_RESULTS.inc(outcome="disagreement")
+            return None
+        KNN_RESULTS.inc(outcome="match")
+        supporting = [neighbor["similarity"] for neighbor in neighbors if neighbor["label"] == label]
+        return {
+            "label": label,
+            "confidence": round(agreement * float(np.mean(supporting)), 4),
+            "neighbors": len(supporting),
+            "info": self._header["label_info"].get(label),
+        }
+
+    def describe(self) -> dict:
+        return {
+            "directory": self.directory,
+            "vectors": self.count,
+            "dim": self._header["dim"],
+            "labels": len(self._header["labels"]),
+            "ivf_lists": len(self._ivf.lists) if self._ivf is not None else None,
+            "ivf_bytes": self._ivf.nbytes() if self._ivf is not None else 0,
+        }
+
+
+_indexes: Dict[str, EmbeddingIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(space: str) -> EmbeddingIndex:
+    """The index for one feature space (ModelManifest.embedding_space), opened on first use."""
+    with _indexes_lock:
+        index = _indexes.get(space)
+        if index is None:
+            index = _indexes[space] = EmbeddingIndex(os.path.join(settings.embedding_index_path, space))
+        return index
+
+
+def available() -> bool:
+    """Whether analyses get embeddings: the index is on and the served backend has a feature output."""
+    if not settings.embedding_index_enabled:
+        return False
+    from app.model.loader import get_loaded_model
+
+    model = get_loaded_model()
+    return model is not None and model.backend.provides_features
+
+
+def knn_answer(inference_result: Optional[dict]) -> Optional[dict]:
+    """classify() for an inference result with an embedding; None without one or when the index fails."""
+    if not inference_result or inference_result.get("embedding") is None:
+        return None
+    try:
+        return get_index(inference_result["embedding_space"]).classify(inference_result["embedding"])
+    except (OSError, ValueError) as e:
+        logger.warning(f"kNN lookup failed: {e}")
+        return None
+
+
+def nearest_cases(analysis: dict, k: int) -> List[dict]:
+    """search() for an analysis with an embedding; [] without one or when the index fails."""
+    if k <= 0 or analysis.get("embedding") is None:
+        return []
+    try:
+        return get_index(analysis["embedding_space"]).search(analysis["embedding"], k)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Similar-case lookup failed: {e}")
+        return []
+
+
+def index_diagnoses(entries: Sequence[dict]):
+    """
+    Add committed diagnoses, each {"diagnosis_id", "analysis"} where the analysis carries an embedding.
+    An index that can't be written is logged and skipped; the diagnoses themselves are already stored.
+    """
+    by_space: Dict[str, List[dict]] = {}
+    for entry in entries:
+        analysis = entry["analysis"]
+        if analysis.get("embedding") is None:
+            continue
+        by_space.setdefault(analysis["embedding_space"], []).append({
+            "diagnosis_id": entry["diagnosis_id"],
+            "vector": analysis["embedding"],
+            "label": analysis["class_id"],
+            "source": analysis["source"],
+            "info": analysis["disease_info"] if analysis["source"] == "gemini" else None,
+        })
+    for space, rows in by_space.items():
+        try:
+            get_index(space).add(rows)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not index {len(rows)} diagnoses in {space}: {e}")
+
+
+def backfill(db, batch_size: int = 32) -> int:
+    """
+    Embed the stored diagnoses newer than the served model's index and add them. Their answering model
+    isn't recorded: labels outside the model's classes can only have come from Gemini, the rest are "unknown".
+    """
+    from app.model.inference import decode_image, image_to_model_input, run_batch_inference
+    from app.model.loader import get_loaded_model
+    from app.models import Diagnosis
+
+    if not available():
+        raise RuntimeError("Embeddings are off, or the served model has no feature output to embed with")
+    model = get_loaded_model()
+    index = get_index(model.manifest.embedding_space())
+    rows = db.query(Diagnosis).filter(Diagnosis.id > index.last_diagnosis_id, Diagnosis.image_url.isnot(None)) \
+        .order_by(Diagnosis.id).all()
+    added = 0
+    for start in range(0, len(rows), batch_size):
+        chunk, tensors = [], []
+        for diagnosis in rows[start:start + batch_size]:
+            path = os.path.join(settings.upload_dir, os.path.basename(diagnosis.image_url))
+            try:
+                with open(path, "rb") as f:
+                    tensors.append(image_to_model_input(decode_image(f.read()), model.manifest))
+            except (OSError, ValueError):
+                continue
+            chunk.append(diagnosis)
+        entries = []
+        for diagnosis, result in zip(chunk, run_batch_inference(tensors, model=model)):
+            if result.get("embedding") is None:
+                continue
+            entries.append({
+                "diagnosis_id": diagnosis.id,
+                "vector": result["embedding"],
+                "label": diagnosis.disease_id,
+                "source": "gemini" if diagnosis.disease_id not in model.manifest.classes else "unknown",
+            })
+        index.add(entries)
+        added += len(entries)
+    return added
+
+
+if __name__ == "__main__":
+    # Backfill: python -m app.services.embedding_index
+    from app.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print(f"Indexed {backfill(session)} diagnoses")
+    finally:
+        session.close()
@@ -0,0 +1,154 @@
+"""
+One long-lived Gemini client per process, shared by gemini_vision and disease_mapper.
+
+The SDK is imported and configured once (get_genai). Each kind of call is a
+StructuredPrompt: its static instructions go in the model's
+system_instruction and its output is constrained by a JSON response schema.
+The GenerativeModel is built once and reused, so every call sends only the
+per-call content and reuses the SDK's pooled connection. The static
+instructions stay an identical prefix across calls, which is what Gemini's
+implicit context caching keys on. Explicit CachedContent needs a few
+thousand tokens and these prompts are well under that.
+
+Every call records its latency and how its response parsed in
+plantcare_gemini_request_seconds and plantcare_gemini_responses_total, both
+labelled by purpose.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence
+from app.config import settings
+from app.services.gemini_quota import gemini_governor
+from app.services.metrics import registry
+
+GEMINI_REQUEST_SECONDS = registry.histogram(
+    "plantcare_gemini_request_seconds",
+    "Latency of individual Gemini generate_content calls (one attempt, no retries), by purpose.",
+    ("purpose",),
+)
+GEMINI_RESPONSES = registry.counter(
+    "plantcare_gemini_responses_total",
+    "Gemini calls by purpose and outcome: parsed, fenced (JSON wrapped in markdown, recovered), "
+    "invalid_json, missing_keys or error (the call itself failed).",
+    ("purpose", "outcome"),
+)
+
+# google.generativeai (and its grpc/protobuf stack) is imported on first use, not at app import
+_genai = None
+_lock = threading.Lock()
+
+
+def gemini_api_key() -> str:
+    return settings.gemini_api_key or os.environ.get("GEMINI_API_KEY", "")
+
+
+def gemini_enabled() -> bool:
+    """Cheap check that doesn't import the SDK."""
+    return bool(gemini_api_key())
+
+
+def get_genai():
+    """
+    Import and configure the google.generativeai SDK from settings on first call.
+    Returns None when no API key is configured.
+    gemini_api_endpoint points the SDK at another host, e.g. the benchmark's local Gemini stand-in.
+    """
+    global _genai
+    if _genai is not None:
+        return _genai
+    api_key = gemini_api_key()
+    if not api_key:
+        return None
+
+    with _lock:
+        if _genai is None:
+            import google.generativeai as genai
+
+            options = {"api_key": api_key}
+            if settings.gemini_transport:
+                options["transport"] = settings.gemini_transport
+            if settings.gemini_api_endpoint:
+                options["client_options"] = {"api_endpoint": settings.gemini_api_endpoint}
+                # Only the REST transport understands plain http:// endpoints
+                options.setdefault("transport", "rest")
+            genai.configure(**options)
+            _genai = genai
+    return _genai
+
+
+def usage_tokens(response) -> Optional[int]:
+    """Total tokens a generate_content call was billed for, when the response reports it."""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    return int(total) if total else None
+
+
+class StructuredPrompt:
+    """A Gemini call with fixed instructions and a JSON response schema; generate() returns the parsed object."""
+
+    def __init__(self, purpose: str, model_name: str, system_instruction: str, response_schema: Dict[str, Any],
+                 token_estimate: int):
+        self.purpose = purpose
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.response_schema = response_schema
+        self.required: Sequence[str] = tuple(response_schema.get("required", ()))
+        # Charged against the tokens-per-minute quota before the call, corrected from usage_metadata after
+        self.token_estimate = token_estimate
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        if self._model is None:
+            genai = get_genai()
+            if genai is None:
+                raise RuntimeError("Gemini API key not configured")
+            with self._lock:
+                if self._model is None:
+                    self._model = genai.GenerativeModel(
+                        self.model_name,
+                        system_instruction=self.system_instruction,
+                        generation_config={
+                            "response_mime_type": "application/json",
+                            "response_schema": self.response_schema,
+                        },
+                    )
+        return self._model
+
+    def generate(self, *contents) -> Dict[str, Any]:
+        """
+        One call, no retries. Raises what the SDK raises (429s included) and ValueError when the
+        response isn't a JSON object with the schema's required keys.
+        """
+        model = self.model()
+        started = time.perf_counter()
+        try:
+            response = model.generate_content(list(contents))
+        except Exception:
+            GEMINI_RESPONSES.inc(purpose=self.purpose, outcome="error")
+            raise
+        finally:
+            GEMINI_REQUEST_SECONDS.observe(time.perf_counter() - started, purpose=self.purpose)
+        gemini_governor.settle(self.token_estimate, usage_tokens(response))
+        return self._parse(response.text)
+
+    def _parse(self, text: str) -> Dict[str, Any]:
+        outcome = "parsed"
+        text = text.strip()
+        if text.startswith("```"):
+            # Schema-constrained output shouldn't be fenced; count it when a model does it anyway
+            outcome = "fenced"
+            text = text[3:].removeprefix("json").removesuffix("```").strip()
+        try:
+            result = json.loads(text)
+        except json.JSONDecodeError:
+            GEMINI_RESPONSES.inc(purpose=self.purpose, outcome="invalid_json")
+            raise
+        missing = [key for key in self.required if key not in result] if isinstance(result, dict) else self.required
+        if missing:
+            GEMINI_RESPONSES.inc(purpose=self.purpose, outcome="missing_keys")
+            raise ValueError(f"Gemini {self.purpose} response missing required keys: {', '.join(missing)}")
+        GEMINI_RESPONSES.inc(purpose=self.purpose, outcome=outcome)
+        return result
@@ -0,0 +1,262 @@
+"""
+Gemini quota governor shared by every API worker on a host.
+
+Gemini enforces requests-per-minute and tokens-per-minute quotas per API
+key. Without a shared view, each worker only learns the quota is gone from
+a 429, and then each one sleeps and retries on its own, so N workers
+multiply the storm. Every Gemini call here first takes from two token
+buckets that live in a shared store:
+
+  requests  settings.gemini_rpm_limit per minute (0: unlimited)
+  tokens    settings.gemini_tpm_limit per minute (0: unlimited), charged an
+            estimate up front and corrected from usage_metadata afterwards
+
+Callers are paced: when a bucket is empty, acquire() sleeps until it has
+refilled, up to settings.gemini_quota_max_wait_s. Priorities:
+
+  interactive  a user is waiting on the answer (vision analysis); may wait
+  background   enrichment the request can do without (DiseaseMapper's
+               generated treatments); never waits, and only runs while the
+               buckets hold more than settings.gemini_quota_background_reserve
+               of their capacity, so it can't crowd out interactive calls
+
+A 429 that gets through anyway drains the shared buckets (backoff()), so
+all workers pause together instead of each retrying into the limit. The
+debt stays short of gemini_quota_max_wait_s, so interactive calls are paced
+through it rather than all falling back at once; the call that hit the 429
+may wait as long as its back-off for the retry.
+
+Stores (settings.gemini_quota_backend):
+  sqlite   default; one SQLite file per host (settings.gemini_quota_path),
+           updated in BEGIN IMMEDIATE transactions so workers serialize
+  memory   per process, for single-worker deployments and tests
+  pkg.module:factory
+           anything else is imported and called with no arguments; it must
+           return an object with the QuotaStore interface, e.g. a Redis-backed
+           store shared across hosts
+"""
+import importlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.metrics import registry
+
+logger = logging.getLogger("plantcare")
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+REQUESTS = "requests"
+TOKENS = "tokens"
+
+# Headroom left under gemini_quota_max_wait_s by backoff(), for the time acquire() itself takes
+_BACKOFF_MARGIN_S = 0.25
+
+QUOTA_REMAINING = registry.gauge(
+    "plantcare_gemini_quota_remaining",
+    "Gemini budget left in the shared bucket as last seen by this worker, by budget (requests or tokens).",
+    ("budget",),
+)
+QUOTA_ACQUIRES = registry.counter(
+    "plantcare_gemini_quota_acquires_total",
+    "Gemini quota acquisitions by priority and outcome (granted, paced, exhausted).",
+    ("priority", "outcome"),
+)
+QUOTA_WAIT_SECONDS = registry.histogram(
+    "plantcare_gemini_quota_wait_seconds",
+    "Time Gemini calls were paced before sending, by priority.",
+    ("priority",),
+)
+
+# A bucket is (tokens, last refill as Unix time); wall-clock time so every process agrees on it
+Bucket = Tuple[float, float]
+State = Dict[str, Bucket]
+
+
+class QuotaStore:
+    """Holds the shared buckets. transact() must run fn atomically with respect to every other caller."""
+
+    def transact(self, fn: Callable[[State], Tuple[State, object]]) -> object:
+        raise NotImplementedError
+
+
+class MemoryQuotaStore(QuotaStore):
+    def __init__(self):
+        self._state: State = {}
+        self._lock = threading.Lock()
+
+    def transact(self, fn):
+        with self._lock:
+            self._state, result = fn(dict(self._state))
+        return result
+
+
+class SqliteQuotaStore(QuotaStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode, so BEGIN IMMEDIATE below controls the transaction
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS gemini_quota (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+            self._local.conn = conn
+        return conn
+
+    def transact(self, fn):
+        conn = self._connection()
+        # Takes the write lock up front: the read-modify-write below is serialized across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = {name: (tokens, updated)
+                     for name, tokens, updated in conn.execute("SELECT name, tokens, updated FROM gemini_quota")}
+            new_state, result = fn(state)
+            conn.executemany("INSERT OR REPLACE INTO gemini_quota (name, tokens, updated) VALUES (?, ?, ?)",
+                             [(name, tokens, updated) for name, (tokens, updated) in new_state.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+
+def _build_store() -> QuotaStore:
+    backend = settings.gemini_quota_backend
+    if backend == "memory":
+        return MemoryQuotaStore()
+    if backend == "sqlite":
+        path = settings.gemini_quota_path or os.path.join(tempfile.gettempdir(), "plantcare-gemini-quota.db")
+        return SqliteQuotaStore(path)
+    module_name, _, factory = backend.partition(":")
+    if not factory:
+        raise ValueError(f"Unknown gemini_quota_backend {backend!r} (expected sqlite, memory or pkg.module:factory)")
+    return getattr(importlib.import_module(module_name), factory)()
+
+
+class GeminiGovernor:
+    def __init__(self, store: Optional[QuotaStore] = None):
+        self._store = store
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> QuotaStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = _build_store()
+        return self._store
+
+    def _limits(self) -> Dict[str, float]:
+        """Per-minute capacity of each enabled budget."""
+        limits = {REQUESTS: settings.gemini_rpm_limit, TOKENS: settings.gemini_tpm_limit}
+        return {name: float(limit) for name, limit in limits.items() if limit > 0}
+
+    @staticmethod
+    def _refill(state: State, limits: Dict[str, float], now: float) -> Dict[str, float]:
+        levels = {}
+        for name, capacity in limits.items():
+            tokens, updated = state.get(name, (capacity, now))
+            levels[name] = min(capacity, tokens + max(0.0, now - updated) * capacity / 60)
+        return levels
+
+    def _take(self, cost: Dict[str, float], priority: str) -> float:
+        """Take cost from every bucket if all can cover it; else take nothing and return the seconds to wait."""
+        limits = self._limits()
+        reserve = settings.gemini_quota_background_reserve if priority == BACKGROUND else 0.0
+
+        def fn(state: State):
+            now = time.time()
+            levels = self._refill(state, limits, now)
+            wait = 0.0
+            for name, capacity in limits.items():
+                floor = reserve * capacity
+                short = floor + cost.get(name, 0.0) - levels[name]
+                if short > 0:
+                    wait = max(wait, short / (capacity / 60))
+            if wait == 0.0:
+                levels = {name: level - cost.get(name, 0.0) for name, level in levels.items()}
+            return {name: (level, now) for name, level in levels.items()}, (wait, levels)
+
+        wait, levels = self.store.transact(fn)
+        for name, level in levels.items():
+            QUOTA_REMAINING.set(level, budget=name)
+        return wait
+
+    def enabled(self) -> bool:
+        return bool(self._limits())
+
+    def acquire(self, estimated_tokens: int, priority: str = INTERACTIVE, min_wait_s: float = 0.0) -> bool:
+        """
+        Reserve one request and estimated_tokens tokens, sleeping until the shared buckets allow it.
+        False when the budget won't be there within gemini_quota_max_wait_s, or min_wait_s if longer (a retry
+        after backoff()); background calls never wait. The caller should then skip the Gemini call.
+        """
+        if not self._limits():
+            return True
+        cost = {REQUESTS: 1.0, TOKENS: float(estimated_tokens)}
+        max_wait = max(settings.gemini_quota_max_wait_s, min_wait_s) if priority == INTERACTIVE else 0.0
+        started, paced = time.perf_counter(), False
+        while True:
+            try:
+                wait = self._take(cost, priority)
+            except sqlite3.Error as e:
+                # A broken quota store must not take Gemini down with it; Gemini's own 429s still apply
+                logger.warning(f"Gemini quota store unavailable, not pacing: {e}")
+                return True
+            waited = time.perf_counter() - started
+            if wait == 0.0:
+                QUOTA_WAIT_SECONDS.observe(waited, priority=priority)
+                QUOTA_ACQUIRES.inc(priority=priority, outcome="paced" if paced else "granted")
+                return True
+            if waited + wait > max_wait:
+                QUOTA_ACQUIRES.inc(priority=priority, outcome="exhausted")
+                return False
+            time.sleep(wait)
+            paced = True
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Correct the token bucket once the response reports what the call really used."""
+        if actual_tokens is None or TOKENS not in self._limits() or actual_tokens == estimated_tokens:
+            return
+        self._adjust(TOKENS, estimated_tokens - actual_tokens)
+
+    def backoff(self, seconds: float):
+        """
+        Gemini answered 429 anyway: empty the request bucket so every worker waits about `seconds`, but never so
+        long that an interactive acquire() (the debt plus one request's refill) can't make it within
+        gemini_quota_max_wait_s, which would turn the slowdown into every worker falling back.
+        """
+        limits = self._limits()
+        if REQUESTS in limits:
+            longest = settings.gemini_quota_max_wait_s - 60 / limits[REQUESTS] - _BACKOFF_MARGIN_S
+            self._adjust(REQUESTS, None, debt_s=max(0.0, min(seconds, longest)))
+
+    def _adjust(self, name: str, delta: Optional[float], debt_s: float = 0.0):
+        limits = self._limits()
+
+        def fn(state: State):
+            now = time.time()
+            levels = self._refill(state, limits, now)
+            if delta is not None:
+                levels[name] = min(limits[name], levels[name] + delta)
+            else:
+                # Negative balance that takes debt_s to refill back to zero
+                levels[name] = min(levels[name], -debt_s * limits[name] / 60)
+            return {n: (level, now) for n, level in levels.items()}, levels[name]
+
+        try:
+            QUOTA_REMAINING.set(self.store.transact(fn), budget=name)
+        except sqlite3.Error as e:
+            logger.warning(f"Gemini quota store unavailable: {e}")
+
+
+gemini_governor = GeminiGovernor()
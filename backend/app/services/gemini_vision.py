@@ -1,110 +1,110 @@
-import json
 import logging
 import time
-import os
-import google.generativeai as genai
 from typing import Dict, Any, Optional
-from app.config import settings
+from app.services.gemini_client import StructuredPrompt, gemini_enabled
+from app.services.gemini_quota import INTERACTIVE, gemini_governor
+from app.services.leaf_roi import gemini_image
+from app.services.metrics import registry, timed
 
 logger = logging.getLogger("plantcare")
 
-# Configure Gemini
-_gemini_configured = False
-if hasattr(settings, 'gemini_api_key') and settings.gemini_api_key:
-    genai.configure(api_key=settings.gemini_api_key)
-    _gemini_configured = True
-else:
-    api_key = os.environ.get("GEMINI_API_KEY", "")
-    if api_key:
-        genai.configure(api_key=api_key)
-        _gemini_configured = True
+GEMINI_CALLS = registry.counter(
+    "plantcare_gemini_calls_total",
+    "Gemini Vision calls by outcome.",
+    ("outcome",),
+)
 
+_STEPS = {"type": "array", "items": {"type": "string"}}
 
-def analyze_plant_image(image_bytes: bytes, max_retries: int = 2) -> Optional[Dict[str, Any]]:
-    """
-    Send the raw image to Gemini Vision and get a complete plant analysis.
-    Returns None if Gemini is unavailable or fails (caller should fallback to MobileNetV2).
-    Retries on rate limit errors (HTTP 429).
-    """
-    if not _gemini_configured:
-        logger.warning("Gemini API key not configured, skipping vision analysis")
-        return None
-
-    for attempt in range(max_retries + 1):
-        try:
-            model = genai.GenerativeModel("gemini-2.0-flash")
-
-            # Send image bytes directly to Gemini (it accepts raw bytes)
-            image_part = {
-                "mime_type": "image/jpeg",
-                "data": image_bytes
-            }
-
-            prompt = """You are an expert plant pathologist and agricultural scientist.
-Analyze this plant/leaf image carefully and return ONLY valid JSON (no markdown, no explanation).
-
-Your JSON must have EXACTLY these keys:
-
-{
-  "plant_name": "Common name of the plant (e.g. Tomato, Rose, Mango)",
-  "disease_name": "Name of disease detected, or 'Healthy' if no disease",
-  "disease_id": "kebab-case ID like 'tomato-early-blight' or 'rose-healthy'",
-  "severity": "low" or "medium" or "high",
-  "confidence": 0.0 to 1.0 (your confidence in the diagnosis),
-  "health_score": 0 to 100 (overall plant health),
-  "leaf_condition": 0 to 100 (how healthy the leaf tissue looks),
-  "infection_severity": 0 to 100 (how severe the infection/damage is, 0 if healthy),
-  "color_analysis": 0 to 100 (how normal the leaf coloring is),
-  "beginner_description": "Simple 1-2 sentence explanation for a beginner gardener",
-  "advanced_description": "Detailed pathological assessment for an expert",
-  "recommendations": ["actionable step 1", "actionable step 2", "actionable step 3"],
-  "treatment": {
-    "immediate": ["step 1", "step 2", "step 3"],
-    "organic": ["step 1", "step 2"],
-    "chemical": ["step 1", "step 2"],
-    "prevention": ["step 1", "step 2", "step 3"],
-    "recoveryTimeline": "Expected recovery duration"
-  }
-}
+VISION_PROMPT = StructuredPrompt(
+    purpose="vision",
+    model_name="gemini-2.0-flash",
+    system_instruction="""You are an expert plant pathologist and agricultural scientist.
+Analyze the plant/leaf image you are given carefully and answer with the JSON object described by the response schema.
 
 Rules:
 - If the image is NOT a plant or is completely unidentifiable, set plant_name to a short description of what you clearly see (e.g., 'Unrecognized: Coffee Mug', 'Unrecognized: Blurry Leaf'), disease_name to 'Unknown', and disease_id to 'unknown'
 - YOU MUST STILL INCLUDE ALL KEYS even if unrecognized. Use 'low' for severity, and 0 for health_score, leaf_condition, infection_severity, and color_analysis.
 - If the plant is healthy, set severity to "low", infection_severity to 0, health_score to 90-100
 - Be accurate about the plant species — look at leaf shape, color, texture, veins
-- Provide realistic health scores based on what you actually see in the image
-- Return ONLY the JSON object, nothing else"""
+- Provide realistic health scores based on what you actually see in the image""",
+    response_schema={
+        "type": "object",
+        "properties": {
+            "plant_name": {"type": "string", "description": "Common name of the plant (e.g. Tomato, Rose, Mango)"},
+            "disease_name": {"type": "string", "description": "Name of disease detected, or 'Healthy' if no disease"},
+            "disease_id": {"type": "string",
+                           "description": "kebab-case ID like 'tomato-early-blight' or 'rose-healthy'"},
+            "severity": {"type": "string", "format": "enum", "enum": ["low", "medium", "high"]},
+            "confidence": {"type": "number", "description": "0.0 to 1.0, your confidence in the diagnosis"},
+            "health_score": {"type": "integer", "description": "0 to 100, overall plant health"},
+            "leaf_condition": {"type": "integer", "description": "0 to 100, how healthy the leaf tissue looks"},
+            "infection_severity": {"type": "integer",
+                                   "description": "0 to 100, how severe the infection/damage is, 0 if healthy"},
+            "color_analysis": {"type": "integer", "description": "0 to 100, how normal the leaf coloring is"},
+            "beginner_description": {"type": "string",
+                                     "description": "Simple 1-2 sentence explanation for a beginner gardener"},
+            "advanced_description": {"type": "string", "description": "Detailed pathological assessment for an expert"},
+            "recommendations": {**_STEPS, "description": "3 actionable steps"},
+            "treatment": {
+                "type": "object",
+                "properties": {
+                    "immediate": _STEPS,
+                    "organic": _STEPS,
+                    "chemical": _STEPS,
+                    "prevention": _STEPS,
+                    "recoveryTimeline": {"type": "string", "description": "Expected recovery duration"},
+                },
+                "required": ["immediate", "organic", "chemical", "prevention", "recoveryTimeline"],
+            },
+        },
+        "required": ["plant_name", "disease_name", "disease_id", "severity", "confidence", "health_score",
+                     "leaf_condition", "infection_severity", "color_analysis", "beginner_description",
+                     "advanced_description", "recommendations", "treatment"],
+    },
+    # One image (258 tokens), the instructions and the JSON answer
+    token_estimate=1500,
+)
+
 
-            response = model.generate_content([prompt, image_part])
+def analyze_plant_image(image_bytes: bytes, max_retries: int = 2) -> Optional[Dict[str, Any]]:
+    """
+    Send the image (the leaf crop from gemini_image) to Gemini Vision and get a complete plant analysis.
+    Returns None if Gemini is unavailable or fails (caller should fallback to MobileNetV2).
+    Calls are paced by the shared quota governor; a 429 that still gets through backs every worker off and is retried.
+    """
+    if not gemini_enabled():
+        logger.warning("Gemini API key not configured, skipping vision analysis")
+        GEMINI_CALLS.inc(outcome="unconfigured")
+        return None
 
-            # Clean response text
-            json_text = response.text.strip()
-            if json_text.startswith("```json"):
-                json_text = json_text[7:]
-            if json_text.startswith("```"):
-                json_text = json_text[3:]
-            if json_text.endswith("```"):
-                json_text = json_text[:-3]
-            json_text = json_text.strip()
+    # Includes retries and rate-limit back-off, i.e. everything the request waits on
+    payload, mime_type = gemini_image(image_bytes)
+    with timed("gemini"):
+        result = _analyze_with_retries(payload, mime_type, max_retries)
+    GEMINI_CALLS.inc(outcome="success" if result else "failure")
+    return result
 
-            result = json.loads(json_text)
 
-            # Validate required fields exist
-            required = ["plant_name", "disease_name", "disease_id", "severity",
-                         "confidence", "health_score", "leaf_condition",
-                         "infection_severity", "color_analysis"]
-            for key in required:
-                if key not in result:
-                    logger.error(f"Gemini response missing required key: {key}")
-                    return None
+def _analyze_with_retries(image_bytes: bytes, mime_type: str, max_retries: int) -> Optional[Dict[str, Any]]:
+    backoff_s = 0.0
+    for attempt in range(max_retries + 1):
+        # After a 429 this waits out the back-off, even past the usual pacing limit
+        if not gemini_governor.acquire(VISION_PROMPT.token_estimate, INTERACTIVE, min_wait_s=backoff_s):
+            logger.warning("Gemini quota exhausted for the next few seconds, falling back")
+            return None
+        try:
+            # Send image bytes directly to Gemini (it accepts raw bytes); the instructions are already on the model
+            result = VISION_PROMPT.generate({"mime_type": mime_type, "data": image_bytes})
 
             logger.info(f"Gemini Vision identified: {result['plant_name']} - {result['disease_name']} "
                          f"(confidence: {result['confidence']}, health: {result['health_score']})")
 
             return result
 
-        except json.JSONDecodeError as e:
-            logger.error(f"Gemini returned invalid JSON: {e}")
+        except ValueError as e:
+            # Includes json.JSONDecodeError; a retry would most likely come back malformed too
+            logger.error(f"Gemini returned an unusable response: {e}")
             return None
         except Exception as e:
             error_str = str(e)
@@ -113,7 +113,12 @@ Rules:
                 wait_time = (attempt + 1) * 5  # 5s, 10s
                 logger.warning(f"Gemini rate limited (attempt {attempt+1}/{max_retries+1}), retrying in {wait_time}s...")
                 if attempt < max_retries:
-                    time.sleep(wait_time)
+                    if gemini_governor.enabled():
+                        # Drains the shared bucket: every worker waits it out, and the next acquire() paces this retry
+                        gemini_governor.backoff(wait_time)
+                        backoff_s = wait_time
+                    else:
+                        time.sleep(wait_time)
                     continue
                 else:
                     logger.error(f"Gemini rate limited after {max_retries+1} attempts, falling back")
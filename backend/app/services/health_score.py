@@ -1,52 +1,60 @@
-import hashlib
-import time
-import random
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
-def calculate_health_score(disease: Dict[str, Any], confidence: float) -> Dict[str, Any]:
+from app.services.leaf_analysis import MIN_TISSUE_COVERAGE
+
+
+def _clamp(value: float, low: float = 0, high: float = 100) -> int:
+    return int(round(max(low, min(high, value))))
+
+
+def calculate_health_score(disease: Dict[str, Any], confidence: float,
+                           leaf: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Health score from the diagnosis and, when given, the measured leaf statistics (see
+    app/services/leaf_analysis.py). Deterministic: the same image and prediction always score the same.
+    """
     severity = disease.get("severity", "low")
-    
+
     # Ensure confidence dictates the dynamic range
     # A sick plant at 99% confidence should score much lower than a sick plant at 65% confidence
-    
+
     if severity == 'high':
         # 20 to 50 range
         base_drop = 50 + (confidence * 30)
     elif severity == 'medium':
         # 40 to 75 range
         base_drop = 25 + (confidence * 35)
-    else: 
+    else:
         # healthy, minimal drop
         base_drop = 0
-        
+
     base = max(10, 100 - base_drop)
-    
-    # We use a pseudo-random hash based on time and randomness 
-    # so we get realistic, organically varying non-round numbers every time.
-    seed_str = f"{disease.get('id', 'unknown')}_{confidence:.4f}_{time.time()}_{random.random()}"
-    hash_val = int(hashlib.md5(seed_str.encode()).hexdigest(), 16)
-    
-    # Add a realistic jitter [-4, +4] based on hash for uniqueness
-    jitter = (hash_val % 9) - 4
-    score = max(5, min(100, base + jitter))
-    
-    # Calculate breakdown
     is_healthy = "healthy" in disease.get("id", "").lower()
-    
-    # Generate realistic, non-round breakdown
-    l_jitter = (hash_val // 10 % 7) - 3
-    i_jitter = (hash_val // 100 % 7) - 3
-    c_jitter = (hash_val // 1000 % 7) - 3
-    
-    leaf_condition = max(88, min(100, 94 + l_jitter)) if is_healthy else max(10, score - 8 + l_jitter)
-    infection_severity = 0 if is_healthy else min(100, max(0, 100 - score + 5 + i_jitter))
-    color_analysis = max(85, min(100, 92 + c_jitter)) if is_healthy else max(15, score - 3 + c_jitter)
-    
+
+    if leaf is None or leaf["coverage"] < MIN_TISSUE_COVERAGE:
+        # Nothing measured (or no leaf in frame): the breakdown follows from the diagnosis alone
+        return {
+            "score": _clamp(base, 5),
+            "breakdown": {
+                "leafCondition": 94 if is_healthy else _clamp(base - 8, 10),
+                "infectionSeverity": 0 if is_healthy else _clamp(100 - base + 5),
+                "colorAnalysis": 92 if is_healthy else _clamp(base - 3, 15)
+            }
+        }
+
+    # Lesions count fully against the leaf, yellowing half
+    leaf_condition = 100 * (1 - leaf["lesion_ratio"] - 0.5 * leaf["chlorosis_ratio"])
+    # A lesion area of half the leaf is as severe as it gets
+    infection_severity = 100 * min(1.0, 2 * leaf["lesion_ratio"] + 0.5 * leaf["chlorosis_ratio"])
+    color_analysis = 100 * (1 - leaf["chlorosis_index"])
+    measured = (leaf_condition + (100 - infection_severity) + color_analysis) / 3
+
     return {
-        "score": int(score),
+        # Diagnosis and measurement weigh equally: either alone can be fooled by lighting or a wrong class
+        "score": _clamp((base + measured) / 2, 5),
         "breakdown": {
-            "leafCondition": int(leaf_condition),
-            "infectionSeverity": int(infection_severity),
-            "colorAnalysis": int(color_analysis)
+            "leafCondition": _clamp(leaf_condition),
+            "infectionSeverity": _clamp(infection_severity),
+            "colorAnalysis": _clamp(color_analysis)
         }
     }
@@ -0,0 +1,18 @@
+"""
+Image formats Pillow only opens with a plugin.
+
+pillow_avif registers the AVIF opener when it is imported, and importing it
+is not free, so that happens once the first AVIF/HEIF upload arrives. Kept
+out of app/model so the quality gate and the Gemini payload can decode
+uploads without pulling in the model layer.
+"""
+
+_avif_registered = False
+
+
+def register_avif_if_needed(image_bytes: bytes):
+    """Load the AVIF plugin only once an AVIF/HEIF upload ('ftyp' box at offset 4) actually arrives"""
+    global _avif_registered
+    if not _avif_registered and image_bytes[4:8] == b"ftyp":
+        import pillow_avif  # noqa: F401  (registers the AVIF opener with Pillow)
+        _avif_registered = True
@@ -0,0 +1,122 @@
+"""
+Image-quality gate run before any analysis.
+
+A blurred, black or blown-out photo, a thumbnail, or a picture with no
+plant in it gets a confident-looking but meaningless diagnosis from either
+model, and a Gemini call is spent on it. assess_image() catches those in a
+few milliseconds so the user can retake the photo instead:
+
+  too_small    shorter side under settings.quality_min_side pixels
+  too_dark     mean brightness under _DARK_MEAN, or most pixels near black
+  overexposed  mean brightness over _BRIGHT_MEAN, or most pixels clipped
+  blurry       variance of the Laplacian under settings.quality_min_sharpness
+  no_plant     under settings.quality_min_plant_fraction of pixels with a
+               saturated yellow-to-green hue (leaves, healthy or not)
+
+Checks run in that order on a small copy (longest side GATE_SIZE): JPEGs are
+decoded straight at 1/2-1/8 scale with Image.draft(), so a 12 MP upload never
+gets decoded in full. Sharpness is measured at that scale too, which is
+close to what the 224 px model sees. Images the gate can't decode pass
+through; decode_image() reports those with its own error.
+"""
+
+import io
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.services.image_formats import register_avif_if_needed
+from app.services.metrics import registry, timed
+
+GATE_SIZE = 256
+
+# Gray levels (0..255)
+_DARK_LEVEL, _BRIGHT_LEVEL = 25, 245
+_DARK_MEAN, _BRIGHT_MEAN = 35, 225
+_MAX_CLIPPED = 0.75  # share of pixels at either extreme
+# Plant pixels in OpenCV HSV (hue 0..179): yellow-brown through cyan-green, a wider band than
+# leaf_analysis uses, as diseased leaves must still pass
+_PLANT_HUE = (10, 90)
+_PLANT_MIN_SATURATION = 40
+_PLANT_MIN_VALUE = 40
+
+MESSAGES = {
+    "too_small": "The photo is too small to analyze. Use your camera's full resolution and fill the frame with the leaf.",
+    "too_dark": "The photo is too dark. Move into daylight or turn on more light and retake it.",
+    "overexposed": "The photo is overexposed. Avoid direct sun or flash on the leaf and retake it.",
+    "blurry": "The photo is blurry. Hold the camera steady, tap the leaf to focus and retake it.",
+    "no_plant": "We couldn't find a plant in this photo. Center a leaf in the frame and retake it.",
+}
+
+GATE_RESULTS = registry.counter(
+    "plantcare_quality_gate_total",
+    "Image-quality gate verdicts by outcome (passed, undecodable, or the rejection code).",
+    ("outcome",),
+)
+
+
+def _load_small(image_bytes: bytes):
+    """(original size, RGB copy with longest side <= GATE_SIZE), or None when the bytes don't decode."""
+    try:
+        register_avif_if_needed(image_bytes)
+        img = Image.open(io.BytesIO(image_bytes))
+        size = img.size
+        # JPEG only: the decoder scales by 1/2..1/8 to the smallest size that still covers the request
+        img.draft("RGB", (GATE_SIZE, GATE_SIZE))
+        img = img.convert("RGB")
+        img.thumbnail((GATE_SIZE, GATE_SIZE), Image.BILINEAR)
+        return size, img
+    except Exception:
+        return None
+
+
+def assess_image(image_bytes: bytes) -> Dict[str, Any]:
+    """
+    Quality verdict for one upload: {"ok", "code", "message", "checks"}. code and message name the
+    first failed check (None when ok); checks holds the measured values.
+    """
+    import cv2
+
+    with timed("quality_gate"):
+        loaded = _load_small(image_bytes)
+        if loaded is None:
+            GATE_RESULTS.inc(outcome="undecodable")
+            return {"ok": True, "code": None, "message": None, "checks": {}}
+        (width, height), img = loaded
+
+        rgb = np.asarray(img, dtype=np.uint8)
+        gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+        hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+        hue, sat, val = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+        plant = (hue >= _PLANT_HUE[0]) & (hue < _PLANT_HUE[1]) & \
+            (sat >= _PLANT_MIN_SATURATION) & (val >= _PLANT_MIN_VALUE)
+
+        checks = {
+            "width": width,
+            "height": height,
+            "brightness": round(float(gray.mean()), 1),
+            "dark_fraction": round(int(np.count_nonzero(gray <= _DARK_LEVEL)) / gray.size, 4),
+            "bright_fraction": round(int(np.count_nonzero(gray >= _BRIGHT_LEVEL)) / gray.size, 4),
+            "sharpness": round(float(cv2.Laplacian(gray, cv2.CV_32F).var()), 1),
+            "plant_fraction": round(int(np.count_nonzero(plant)) / plant.size, 4),
+        }
+        code = _first_failure(checks)
+        GATE_RESULTS.inc(outcome=code or "passed")
+        return {"ok": code is None, "code": code, "message": MESSAGES.get(code), "checks": checks}
+
+
+def _first_failure(checks: Dict[str, float]) -> Optional[str]:
+    if min(checks["width"], checks["height"]) < settings.quality_min_side:
+        return "too_small"
+    if checks["brightness"] < _DARK_MEAN or checks["dark_fraction"] > _MAX_CLIPPED:
+        return "too_dark"
+    if checks["brightness"] > _BRIGHT_MEAN or checks["bright_fraction"] > _MAX_CLIPPED:
+        return "overexposed"
+    # Exposure first: a black frame also has no edges, and the advice for it is different
+    if checks["sharpness"] < settings.quality_min_sharpness:
+        return "blurry"
+    if checks["plant_fraction"] < settings.quality_min_plant_fraction:
+        return "no_plant"
+    return None
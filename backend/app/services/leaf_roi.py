@@ -0,0 +1,158 @@
+"""
+Leaf region of interest: where in the photo the leaf is.
+
+A leaf that fills a tenth of a 12 MP photo ends up a few dozen pixels wide
+once the whole frame is squashed to the model's 224x224, and Gemini gets
+megabytes of background with it. locate_leaf() finds the dominant leaf with
+the same green segmentation as app/services/leaf_analysis.py, on its
+128 px copy (about a millisecond), and maps the box back to the full
+image:
+
+  box      bounding box of the largest leaf region, padded by
+           settings.roi_margin of its size on every side, then widened
+           towards a square (the model input is square, so a long thin
+           box would be stretched), clipped to the frame
+  no crop  no leaf found, or the box already covers _MAX_CROP_AREA of the
+           frame (cropping would only cut off context)
+
+crop_to_leaf() applies it to a decoded image for MobileNetV2.
+gemini_image() turns upload bytes into the Gemini payload: turned upright
+by its EXIF orientation (the re-encoded JPEG doesn't carry the tag),
+cropped, at most settings.gemini_image_max_side pixels on a side and
+re-encoded as JPEG. A JPEG's leaf is located on a 1/8-scale probe first,
+and the full decode then uses the coarsest draft scale that still leaves
+the crop max_side pixels wide.
+"""
+
+import io
+import logging
+import math
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.services.image_formats import register_avif_if_needed
+from app.services.leaf_analysis import downsample, green_mask, leaf_contours
+from app.services.metrics import registry, timed
+
+logger = logging.getLogger("plantcare")
+
+Box = Tuple[int, int, int, int]  # left, top, right, bottom in image pixels
+
+_MAX_CROP_AREA = 0.8
+# Longest side JPEGs are probed at for the leaf box (draft mode picks the 1/8 scale of a phone photo)
+_PROBE_SIDE = 256
+# EXIF orientations that rotate by 90 degrees
+_ORIENTATION = 0x0112
+_SWAPS_SIDES = (5, 6, 7, 8)
+_GEMINI_JPEG_QUALITY = 90
+
+ROI_RESULTS = registry.counter(
+    "plantcare_roi_total",
+    "Leaf region-of-interest lookups by outcome (cropped, full_frame, no_leaf).",
+    ("outcome",),
+)
+GEMINI_IMAGE_BYTES = registry.histogram(
+    "plantcare_gemini_image_bytes",
+    "Size of the image sent to Gemini, by stage (upload as received, payload as sent).",
+    ("stage",),
+    buckets=(16e3, 32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6),
+)
+
+
+def locate_leaf(img: Image.Image) -> Optional[Box]:
+    """Crop box around the dominant leaf in img, or None when the whole frame should be used."""
+    import cv2
+
+    rgb = downsample(img)
+    contours = leaf_contours(green_mask(cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)))
+    if not contours:
+        ROI_RESULTS.inc(outcome="no_leaf")
+        return None
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+
+    # Back to full-image pixels; the small copy keeps the aspect ratio up to rounding
+    sx, sy = img.width / rgb.shape[1], img.height / rgb.shape[0]
+    x, y, w, h = x * sx, y * sy, w * sx, h * sy
+    pad_w = pad_h = settings.roi_margin * max(w, h)
+    # Towards square, as far as the frame allows
+    if w < h:
+        pad_w += (h - w) / 2
+    else:
+        pad_h += (w - h) / 2
+    box = (max(0, int(x - pad_w)), max(0, int(y - pad_h)),
+           min(img.width, int(np.ceil(x + w + pad_w))), min(img.height, int(np.ceil(y + h + pad_h))))
+
+    if (box[2] - box[0]) * (box[3] - box[1]) >= _MAX_CROP_AREA * img.width * img.height:
+        ROI_RESULTS.inc(outcome="full_frame")
+        return None
+    ROI_RESULTS.inc(outcome="cropped")
+    return box
+
+
+def crop_to_leaf(img: Image.Image) -> Image.Image:
+    """img cropped to its leaf region (settings.roi_crop_enabled), else img itself."""
+    if not settings.roi_crop_enabled:
+        return img
+    with timed("roi"):
+        box = locate_leaf(img)
+        return img.crop(box) if box else img
+
+
+def _upright_leaf_fractions(img: Image.Image) -> Optional[Tuple[float, float, float, float]]:
+    """locate_leaf's box on img turned upright, as fractions of that frame's width and height."""
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    with timed("roi"):
+        box = locate_leaf(img)
+    if box is None:
+        return None
+    return box[0] / img.width, box[1] / img.height, box[2] / img.width, box[3] / img.height
+
+
+def gemini_image(image_bytes: bytes) -> Tuple[bytes, str]:
+    """
+    (payload, mime type) to send Gemini for an upload: the leaf crop, downscaled and re-encoded.
+    The upload itself when it can't be decoded here or re-encoding wouldn't make it smaller.
+    """
+    GEMINI_IMAGE_BYTES.observe(len(image_bytes), stage="upload")
+    payload, mime = image_bytes, "image/jpeg"
+    with timed("gemini_payload"):
+        try:
+            register_avif_if_needed(image_bytes)
+            img = Image.open(io.BytesIO(image_bytes))
+            mime = Image.MIME.get(img.format, mime)
+            jpeg = img.format == "JPEG"
+            max_side = settings.gemini_image_max_side
+            box = None
+            if jpeg:
+                if settings.roi_crop_enabled:
+                    # Where the leaf is, from a 1/8-scale decode, so the full decode below can be sized to the crop
+                    probe = Image.open(io.BytesIO(image_bytes))
+                    probe.draft("RGB", (_PROBE_SIDE, _PROBE_SIDE))
+                    box = _upright_leaf_fractions(probe)
+                width, height = img.size
+                if img.getexif().get(_ORIENTATION) in _SWAPS_SIDES:
+                    width, height = height, width
+                span = max((box[2] - box[0]) * width, (box[3] - box[1]) * height) if box else max(width, height)
+                scale = min(1.0, max_side / span)
+                # Decodes at 1/2..1/8 scale, but never so small that the crop ends up under max_side
+                img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+            # Upright before cropping, so the box is in the frame that gets encoded
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            if box:
+                img = img.crop((round(box[0] * img.width), round(box[1] * img.height),
+                                round(box[2] * img.width), round(box[3] * img.height)))
+            elif not jpeg:
+                # Other formats have no reduced-scale decode: locate the leaf on the full image
+                img = crop_to_leaf(img)
+            img.thumbnail((max_side, max_side), Image.BILINEAR)
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=_GEMINI_JPEG_QUALITY)
+            if buf.tell() < len(image_bytes):
+                payload, mime = buf.getvalue(), "image/jpeg"
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.debug(f"Sending Gemini the upload as received: {e}")
+    GEMINI_IMAGE_BYTES.observe(len(payload), stage="payload")
+    return payload, mime
@@ -0,0 +1,268 @@
+import calendar
+import datetime
+import logging
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.config import settings
+
+logger = logging.getLogger("plantcare")
+
+# Regions that carry no location information and are never tracked
+_UNTRACKED_REGIONS = {"", "auto", "unknown", "none"}
+
+_MONTH_NAMES = list(calendar.month_name)[1:]
+
+# Gemini can invent disease ids, so per-disease summaries are capped too
+_MAX_DISEASE_SUMMARIES = 5000
+
+
+def normalize_region(region: Optional[str]) -> Optional[str]:
+    if region is None:
+        return None
+    region = region.strip()
+    return None if region.lower() in _UNTRACKED_REGIONS else region
+
+
+def is_trackable_disease(disease_id: Optional[str]) -> bool:
+    return bool(disease_id) and disease_id != "unknown" and "healthy" not in disease_id
+
+
+class _Series:
+    """Sliding-window state for one (region, disease) pair, ~400 bytes including its dict entry."""
+    __slots__ = ("bucket", "ring", "window_sum", "mean", "var")
+
+    def __init__(self, bucket: int, window: int):
+        self.bucket = bucket
+        self.ring = array("H", bytes(2 * window))
+        self.window_sum = 0
+        self.mean = 0.0
+        self.var = 0.0
+
+
+class _TopRegions:
+    """Space-Saving heavy-hitters sketch: the top-k regions for a disease in O(k) memory."""
+    __slots__ = ("capacity", "counts")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+
+    def add(self, region: str):
+        if region in self.counts or len(self.counts) < self.capacity:
+            self.counts[region] = self.counts.get(region, 0) + 1
+            return
+        victim = min(self.counts, key=self.counts.get)
+        floor = self.counts.pop(victim)
+        self.counts[region] = floor + 1
+
+    def top(self, n: int) -> List[str]:
+        return [r for r, _ in sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]]
+
+
+class OutbreakDetector:
+    """
+    Streaming per-region, per-disease spike detector.
+
+    Each event lands in a fixed-width time bucket. Completed buckets feed an
+    exponentially weighted mean/variance baseline, and the live bucket is
+    scored against it with a Poisson-floored z-score. Every observation is
+    O(1); total memory is capped by evicting the least recently seen series.
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: int = 3600,
+        window_buckets: int = 24,
+        z_threshold: float = 3.0,
+        min_count: int = 5,
+        max_series: int = 200_000,
+        alpha: Optional[float] = None,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.z_threshold = z_threshold
+        self.min_count = min_count
+        self.max_series = max_series
+        # Baseline half-life of roughly one window
+        self.alpha = alpha if alpha is not None else 1 - 0.5 ** (1 / window_buckets)
+
+        self._series: "OrderedDict[Tuple[str, str], _Series]" = OrderedDict()
+        self._alerts: Dict[Tuple[str, str], Dict] = {}
+        self._top_regions: Dict[str, _TopRegions] = {}
+        self._months: Dict[str, array] = {}
+        self._lock = threading.Lock()
+        self.events = 0
+        self.evictions = 0
+
+    def _bucket_of(self, ts: datetime.datetime) -> int:
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=datetime.timezone.utc)
+        return int(ts.timestamp()) // self.bucket_seconds
+
+    def _advance(self, series: _Series, bucket: int):
+        """Close out buckets up to `bucket`, folding each into the baseline."""
+        steps = bucket - series.bucket
+        if steps <= 0:
+            return
+        a = self.alpha
+        w = self.window_buckets
+        # Fold in the bucket being closed...
+        diff = series.ring[series.bucket % w] - series.mean
+        incr = a * diff
+        series.mean += incr
+        series.var = (1 - a) * (series.var + diff * incr)
+        # ...then the (steps - 1) silent buckets after it, in closed form
+        silent = steps - 1
+        if silent:
+            decay = (1 - a) ** silent
+            series.var = decay * (series.var + series.mean * series.mean * (1 - decay))
+            series.mean *= decay
+        for i in range(1, min(steps, w) + 1):
+            slot = (series.bucket + i) % w
+            series.window_sum -= series.ring[slot]
+            series.ring[slot] = 0
+        series.bucket = bucket
+
+    def _score(self, series: _Series) -> Tuple[int, float, float]:
+        count = series.ring[series.bucket % self.window_buckets]
+        expected = series.mean
+        # Counts are Poisson-like, so the spread is never allowed below sqrt(mean) or 1
+        std = math.sqrt(max(series.var, expected, 1.0))
+        return count, expected, (count - expected) / std
+
+    def observe(self, region: Optional[str], disease_id: Optional[str],
+                ts: Optional[datetime.datetime] = None) -> Optional[Dict]:
+        """Record one diagnosis; returns the active alert for its series, if any."""
+        region = normalize_region(region)
+        if region is None or not is_trackable_disease(disease_id):
+            return None
+        ts = ts or datetime.datetime.now(datetime.timezone.utc)
+        bucket = self._bucket_of(ts)
+        key = (region, disease_id)
+
+        with self._lock:
+            self.events += 1
+            series = self._series.get(key)
+            if series is None:
+                series = _Series(bucket, self.window_buckets)
+                self._series[key] = series
+                if len(self._series) > self.max_series:
+                    evicted, _ = self._series.popitem(last=False)
+                    self._alerts.pop(evicted, None)
+                    self.evictions += 1
+            else:
+                self._series.move_to_end(key)
+                if bucket < series.bucket:
+                    # Late event for an already-closed bucket: count it in the window only
+                    slot = bucket % self.window_buckets
+                    if series.bucket - bucket < self.window_buckets and series.ring[slot] < 0xFFFF:
+                        series.ring[slot] += 1
+                        series.window_sum += 1
+                    return self._alerts.get(key)
+                self._advance(series, bucket)
+
+            slot = bucket % self.window_buckets
+            if series.ring[slot] < 0xFFFF:
+                series.ring[slot] += 1
+                series.window_sum += 1
+
+            sketch = self._top_regions.get(disease_id)
+            if sketch is None and len(self._top_regions) < _MAX_DISEASE_SUMMARIES:
+                sketch = self._top_regions[disease_id] = _TopRegions(16)
+                self._months[disease_id] = array("I", bytes(4 * 12))
+            if sketch is not None:
+                sketch.add(region)
+                self._months[disease_id][ts.month - 1] += 1
+
+            count, expected, z = self._score(series)
+            if count >= self.min_count and z >= self.z_threshold:
+                alert = {
+                    "region": region,
+                    "disease_id": disease_id,
+                    "count": count,
+                    "expected": round(expected, 3),
+                    "z_score": round(z, 2),
+                    "window_count": series.window_sum,
+                    "bucket_start": datetime.datetime.fromtimestamp(
+                        bucket * self.bucket_seconds, tz=datetime.timezone.utc),
+                }
+                self._alerts[key] = alert
+                return alert
+            return self._alerts.get(key) if self._alert_is_live(key, bucket) else None
+
+    def _alert_is_live(self, key: Tuple[str, str], current_bucket: int) -> bool:
+        alert = self._alerts.get(key)
+        if alert is None:
+            return False
+        alert_bucket = int(alert["bucket_start"].timestamp()) // self.bucket_seconds
+        return current_bucket - alert_bucket < self.window_buckets
+
+    def active_alerts(self, region: Optional[str] = None,
+                      now: Optional[datetime.datetime] = None) -> List[Dict]:
+        """Alerts raised within the last window, strongest first."""
+        current = self._bucket_of(now or datetime.datetime.now(datetime.timezone.utc))
+        region = normalize_region(region) if region else None
+        with self._lock:
+            expired = [key for key in self._alerts if not self._alert_is_live(key, current)]
+            for key in expired:
+                del self._alerts[key]
+            alerts = [dict(a) for key, a in self._alerts.items() if region is None or key[0] == region]
+        return sorted(alerts, key=lambda a: a["z_score"], reverse=True)
+
+    def common_regions(self, disease_id: str, limit: int = 5) -> List[str]:
+        with self._lock:
+            sketch = self._top_regions.get(disease_id)
+            return sketch.top(limit) if sketch else []
+
+    def seasonal_risk(self, disease_id: str, min_events: int = 24) -> List[str]:
+        """Months carrying clearly more than their even share of a disease's sightings."""
+        with self._lock:
+            months = self._months.get(disease_id)
+            counts = list(months) if months else []
+        total = sum(counts)
+        if total < min_events:
+            return []
+        return [_MONTH_NAMES[i] for i, c in enumerate(counts) if c * 12 >= 1.5 * total]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "series": len(self._series),
+                "max_series": self.max_series,
+                "active_alerts": len(self._alerts),
+                "events": self.events,
+                "evictions": self.evictions,
+            }
+
+    def replay(self, rows: Iterable[Tuple[Optional[str], Optional[str], datetime.datetime]]) -> int:
+        """Feed historical (region, disease_id, created_at) rows in chronological order."""
+        n = 0
+        for region, disease_id, created_at in rows:
+            self.observe(region, disease_id, created_at)
+            n += 1
+        return n
+
+
+outbreak_detector = OutbreakDetector(
+    bucket_seconds=settings.outbreak_bucket_minutes * 60,
+    window_buckets=settings.outbreak_window_buckets,
+    z_threshold=settings.outbreak_z_threshold,
+    min_count=settings.outbreak_min_count,
+    max_series=settings.outbreak_max_series,
+)
+
+
+def warm_start(db, days: int) -> int:
+    """Replay recent diagnoses so a freshly started worker has a baseline."""
+    from app.models import Diagnosis, User
+
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    rows = db.query(User.region, Diagnosis.disease_id, Diagnosis.created_at).join(
+        User, Diagnosis.user_id == User.id
+    ).filter(Diagnosis.created_at >= since).order_by(Diagnosis.created_at).yield_per(5000)
+    n = outbreak_detector.replay(rows)
+    logger.info(f"Outbreak detector warmed with {n} diagnoses from the last {days} days")
+    return n
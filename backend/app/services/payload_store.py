@@ -0,0 +1,270 @@
+"""
+Stored analysis payloads: the full AnalysisResponse of every diagnosis, for history replay.
+
+A Diagnosis row's columns only summarize the answer. The treatment plan,
+descriptions, health-score breakdown, heatmap and similar cases Gemini or
+the model produced are kept as the response JSON exactly as it was sent,
+compressed, in Diagnosis.payload. GET /api/history/{id} returns those bytes
+without rebuilding or re-validating the response.
+
+Payloads are a few KB of mostly the same text: JSON keys, the curated
+diseases.json entries every local answer carries, the healthy alternative
+every response lists, Gemini's stock phrasing. Each is therefore compressed
+against a shared dictionary, recorded per row in Diagnosis.payload_codec as
+"<codec>:<dictionary id>":
+
+  dictionary  raw content: the fragments that recur across typical payloads
+              (train()), the most valuable last, within deflate's 32 KB
+              window. Stored as payload_dicts/<id>.dict next to this module;
+              the id is a hash of the bytes, so a row always finds the
+              dictionary it was written with. settings.payload_dictionary
+              picks the one new rows use
+  codec       "zlib" (stdlib raw deflate with a preset dictionary) or "zstd"
+              (the zstandard package, when installed, with the same bytes as
+              a raw-content dictionary), settings.payload_codec. With no
+              dictionary rows are plain "gzip", which replay can hand to a
+              client that accepts gzip untouched
+
+Train a dictionary from the curated diseases plus the newest stored payloads,
+from the backend directory:
+    python -m app.services.payload_store --from-db 5000
+"""
+import argparse
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import os
+import zlib
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.config import settings
+from app.services.metrics import registry
+
+logger = logging.getLogger("plantcare")
+
+DICTIONARY_DIR = os.path.join(os.path.dirname(__file__), "payload_dicts")
+# Deflate can only reach back 32 KB minus its lookahead; dictionary bytes beyond that are never used
+DICTIONARY_SIZE = 32768 - 262
+# Fragments shorter than this cost about as much to reference as to spell out
+_MIN_FRAGMENT = 8
+
+PAYLOAD_BYTES = registry.histogram(
+    "plantcare_payload_bytes",
+    "Size of stored analysis payloads, by stage (json as serialized, stored as compressed).",
+    ("stage",),
+    buckets=(128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib covers every deployment
+    zstandard = None
+
+# What decode() raises for bytes that aren't a valid payload of their codec. Anything else it raises (RuntimeError,
+# OSError, ValueError) means this host can't read the codec: zstandard missing, or the dictionary missing or altered
+CORRUPT_PAYLOAD_ERRORS = (zlib.error, EOFError, gzip.BadGzipFile) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+@functools.lru_cache(maxsize=8)
+def load_dictionary(dictionary_id: str) -> bytes:
+    with open(os.path.join(DICTIONARY_DIR, f"{dictionary_id}.dict"), "rb") as f:
+        data = f.read()
+    if dictionary_id != dictionary_id_for(data):
+        raise ValueError(f"Payload dictionary {dictionary_id} does not match its contents")
+    return data
+
+
+def dictionary_id_for(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+@functools.lru_cache(maxsize=8)
+def _zstd_dictionary(dictionary_id: str):
+    return zstandard.ZstdCompressionDict(load_dictionary(dictionary_id), dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+
+def _write_codec() -> str:
+    """The codec new rows are written with, falling back to what this host can do."""
+    codec = settings.payload_codec
+    if codec == "zstd" and zstandard is None:
+        codec = "zlib"
+    if codec not in ("zlib", "zstd"):
+        raise ValueError(f"Unknown payload codec {settings.payload_codec!r} (expected zlib or zstd)")
+    dictionary_id = settings.payload_dictionary
+    if not dictionary_id:
+        return "gzip"
+    try:
+        load_dictionary(dictionary_id)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Payload dictionary unavailable ({e}); storing payloads as plain gzip")
+        return "gzip"
+    return f"{codec}:{dictionary_id}"
+
+
+def encode(payload: bytes, codec: Optional[str] = None) -> Tuple[bytes, str]:
+    """payload compressed with the configured codec and dictionary, and the codec string to store with it."""
+    codec = codec or _write_codec()
+    level = settings.payload_compression_level
+    name, _, dictionary_id = codec.partition(":")
+    if name == "gzip":
+        return gzip.compress(payload, compresslevel=level, mtime=0), codec
+    if name == "zlib":
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=load_dictionary(dictionary_id))
+        return compressor.compress(payload) + compressor.flush(), codec
+    if name == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level, dict_data=_zstd_dictionary(dictionary_id),
+                                              write_checksum=False, write_dict_id=False)
+        return compressor.compress(payload), codec
+    raise ValueError(f"Unknown payload codec {codec!r}")
+
+
+def decode(blob: bytes, codec: str) -> bytes:
+    name, _, dictionary_id = codec.partition(":")
+    if name == "gzip":
+        return gzip.decompress(blob)
+    if name == "zlib":
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=load_dictionary(dictionary_id))
+        return decompressor.decompress(blob) + decompressor.flush()
+    if name == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This payload was stored with zstd; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor(dict_data=_zstd_dictionary(dictionary_id)).decompress(blob)
+    raise ValueError(f"Unknown payload codec {codec!r}")
+
+
+def store(db, stored: Sequence[tuple]):
+    """
+    Attach the compressed response to each committed (diagnosis, AnalysisResponse) pair and commit. The diagnosis
+    itself is already saved, so a failure here only costs its replay and is logged rather than raised.
+    """
+    if not settings.payload_store_enabled or not stored:
+        return
+    try:
+        codec = _write_codec()
+        for diagnosis, response in stored:
+            payload = response.model_dump_json().encode()
+            diagnosis.payload, diagnosis.payload_codec = encode(payload, codec)
+            PAYLOAD_BYTES.observe(len(payload), stage="json")
+            PAYLOAD_BYTES.observe(len(diagnosis.payload), stage="stored")
+        db.commit()
+    except (SQLAlchemyError, ValueError, zlib.error) as e:
+        db.rollback()
+        logger.warning(f"Could not store {len(stored)} analysis payloads: {e}")
+
+
+def _fragments(value, out: List[str]):
+    """Every subtree of a decoded payload as it appears serialized, plus each object key."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            out.append(json.dumps(key) + ":")
+            _fragments(item, out)
+    elif isinstance(value, list):
+        for item in value:
+            _fragments(item, out)
+    if isinstance(value, (dict, list, str)):
+        out.append(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+
+
+def train(samples: Iterable[bytes], size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    A raw-content dictionary from sample payloads: the serialized subtrees (objects, lists, strings, keys) that
+    occur in more than one sample, by bytes they would save (length x samples), skipping any already covered
+    by a better one. The most valuable go last, closest to the data and the last to leave deflate's window.
+    """
+    counts: Counter = Counter()
+    for sample in samples:
+        out: List[str] = []
+        _fragments(json.loads(sample), out)
+        text = sample.decode()
+        counts.update({fragment for fragment in out if len(fragment) >= _MIN_FRAGMENT and fragment in text})
+    ranked = sorted((fragment for fragment, count in counts.items() if count > 1),
+                    key=lambda fragment: len(fragment.encode()) * counts[fragment], reverse=True)
+    chosen: List[bytes] = []
+    used = 0
+    for fragment in ranked:
+        data = fragment.encode()
+        if used + len(data) > size or any(data in kept for kept in chosen):
+            continue
+        chosen.append(data)
+        used += len(data)
+    return b"".join(reversed(chosen))
+
+
+def curated_samples() -> List[bytes]:
+    """Responses as the local model would send them for every curated disease, at a few confidence levels."""
+    from app.schemas.response import AnalysisResponse
+    from app.services.disease_mapper import disease_mapper
+    from app.services.health_score import calculate_health_score
+
+    healthy = disease_mapper.map_prediction_to_disease("healthy", confidence=0.0)
+    diseases = list(disease_mapper.diseases) + [disease_mapper.map_prediction_to_disease("unknown", confidence=0.5)]
+    samples = []
+    for disease in diseases:
+        for confidence in (0.97, 0.78, 0.62):
+            samples.append(AnalysisResponse(
+                disease=disease,
+                confidence=confidence,
+                processingTime=850,
+                alternatives=[{"disease": healthy, "confidence": round((1 - confidence) * 0.7, 2)}],
+                healthScore=calculate_health_score(disease, confidence),
+                heatmapRegions=[{"x": 0.42, "y": 0.57, "radius": 0.18, "intensity": confidence}],
+                confidenceLevel="high" if confidence > 0.85 else "medium" if confidence > 0.6 else "low",
+                multiDiseaseWarning=False,
+            ).model_dump_json().encode())
+    return samples
+
+
+def stored_samples(db, limit: int) -> List[bytes]:
+    """The newest `limit` stored payloads, decompressed."""
+    from app.models import Diagnosis
+
+    rows = db.query(Diagnosis.payload, Diagnosis.payload_codec).filter(Diagnosis.payload.isnot(None)) \
+        .order_by(Diagnosis.id.desc()).limit(limit)
+    samples = []
+    for blob, codec in rows:
+        try:
+            samples.append(decode(blob, codec))
+        except (OSError, ValueError, RuntimeError, *CORRUPT_PAYLOAD_ERRORS):
+            continue
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-db", type=int, default=0, help="Also train on this many of the newest stored payloads")
+    parser.add_argument("--size", type=int, default=DICTIONARY_SIZE)
+    args = parser.parse_args()
+
+    samples = curated_samples()
+    if args.from_db:
+        from app.database import SessionLocal
+
+        session = SessionLocal()
+        try:
+            samples += stored_samples(session, args.from_db)
+        finally:
+            session.close()
+    dictionary = train(samples, args.size)
+    dictionary_id = dictionary_id_for(dictionary)
+    os.makedirs(DICTIONARY_DIR, exist_ok=True)
+    with open(os.path.join(DICTIONARY_DIR, f"{dictionary_id}.dict"), "wb") as f:
+        f.write(dictionary)
+
+    raw = sum(len(sample) for sample in samples)
+    report = {"dictionary": dictionary_id, "bytes": len(dictionary), "samples": len(samples),
+              "json_bytes_per_row": round(raw / len(samples))}
+    codecs = ["gzip", f"zlib:{dictionary_id}"] + ([f"zstd:{dictionary_id}"] if zstandard is not None else [])
+    for codec in codecs:
+        stored = sum(len(encode(sample, codec)[0]) for sample in samples)
+        report[f"{codec.split(':')[0]}_bytes_per_row"] = round(stored / len(samples))
+    print(json.dumps(report, indent=2))
+    print(f"Use it for new rows with PAYLOAD_DICTIONARY={dictionary_id}")
+
+
+if __name__ == "__main__":
+    main()
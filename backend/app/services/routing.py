@@ -0,0 +1,69 @@
+"""
+Decides which model answers an analysis request (settings.routing_policy):
+
+  gemini_first  Gemini for every image, MobileNetV2 only when Gemini fails
+  cascade       MobileNetV2 first; escalate to Gemini only when the local answer can't be trusted
+  local_only    never call Gemini
+
+Every decision is counted in plantcare_routing_decisions_total so the Gemini call rate can be read off /metrics.
+"""
+from typing import Optional
+
+from app.config import settings
+from app.model.loader import get_manifest
+from app.services.metrics import registry
+
+GEMINI_FIRST = "gemini_first"
+CASCADE = "cascade"
+LOCAL_ONLY = "local_only"
+POLICIES = (GEMINI_FIRST, CASCADE, LOCAL_ONLY)
+
+# Escalation reasons, in the order they are checked
+CROP_NOT_COVERED = "crop_not_covered"
+UNKNOWN_CLASS = "unknown_class"
+CROP_MISMATCH = "crop_mismatch"
+LOW_CONFIDENCE = "low_confidence"
+
+ROUTING_DECISIONS = registry.counter(
+    "plantcare_routing_decisions_total",
+    "Which model answered each analysis, and why.",
+    ("policy", "route", "reason"),
+)
+
+
+def routing_policy() -> str:
+    policy = settings.routing_policy
+    return policy if policy in POLICIES else GEMINI_FIRST
+
+
+def _selected_crop(crop_type: Optional[str]) -> Optional[str]:
+    if not crop_type or crop_type == "auto":
+        return None
+    return crop_type.strip().lower()
+
+
+def escalation_reason(crop_type: Optional[str], inference_result: Optional[dict] = None) -> Optional[str]:
+    """
+    Why a cascade should hand this image to Gemini, or None when the local prediction stands.
+    Called without an inference result it only checks what is known before running the model.
+    """
+    crop = _selected_crop(crop_type)
+    if crop is not None and crop not in get_manifest().crops:
+        return CROP_NOT_COVERED
+    if inference_result is None:
+        return None
+    class_id = inference_result["class_id"]
+    if class_id == "unknown":
+        return UNKNOWN_CLASS
+    if crop is not None and class_id.split("-")[0] != crop:
+        return CROP_MISMATCH
+    if inference_result["confidence"] < settings.cascade_confidence_threshold:
+        return LOW_CONFIDENCE
+    return None
+
+
+def record_route(route: str, reason: str):
+    """route is "gemini" or "local"; reason is an escalation reason, "confident", "policy", "gemini_unavailable",
+    "gemini_shed" (the Gemini lane was saturated, see app/services/admission.py) or "knn_match" (past Gemini
+    answers for near-identical images stood in for the call, see app/services/embedding_index.py)."""
+    ROUTING_DECISIONS.inc(policy=routing_policy(), route=route, reason=reason)
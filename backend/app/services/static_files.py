@@ -0,0 +1,294 @@
+"""
+Uploaded images at /static (mounted in app/main.py).
+
+Uploads are named by the hash of their content (app/services/storage.py), so
+a name always means the same bytes:
+
+  caching   content-hash names go out with a year's max-age and "immutable",
+            and the hash is their ETag, so If-None-Match is answered with a
+            304 before anything is opened or even stat'ed. Older uuid names
+            get settings.static_max_age and an mtime/size ETag
+  sending   by preference the ASGI server's sendfile
+            (http.response.pathsend, where the server offers it), else the
+            proxy's (X-Accel-Redirect into settings.static_accel_redirect, an
+            internal nginx location aliased to the upload directory; originals
+            only), else from a per-worker LRU of small files
+            (settings.static_memory_*), filled by one threadpool read per
+            miss. Larger files stream from disk
+  ranges    one "bytes=" range gets a 206 (If-Range honored). A request for
+            several ranges gets the whole file, which RFC 9110 allows
+  variants  ?w=N is the image scaled to the smallest width in
+            settings.static_variant_widths that is at least N (the largest
+            for anything wider). Each is built once on a worker thread (JPEGs
+            decode straight at a reduced scale) and kept under
+            <upload_dir>/variants; requests that arrive during a build wait
+            for that build. Formats other than JPEG, PNG and WebP (GIF, HEIC,
+            AVIF...) get JPEG variants. An image no wider than the width
+            that is already in its variant's format is linked, not re-encoded
+"""
+import asyncio
+import os
+import re
+import shutil
+import uuid
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import FileResponse, PlainTextResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from app.config import settings
+from app.services.image_formats import register_avif_if_needed
+from app.services.metrics import registry
+
+# Names storage.py writes (content hash, or the uuids before it); anything else, subdirectories included, is a 404
+_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}\.[A-Za-z0-9]{1,5}$")
+_CONTENT_HASH = re.compile(r"^([0-9a-f]{32})\.")
+_IMMUTABLE = "public, max-age=31536000, immutable"
+_MEDIA_TYPES = {
+    "jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif",
+    "avif": "image/avif", "heic": "image/heic", "bmp": "image/bmp", "tif": "image/tiff", "tiff": "image/tiff",
+}
+_VARIANT_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+_VARIANT_QUALITY = 82
+
+STATIC_REQUESTS = registry.counter(
+    "plantcare_static_requests_total",
+    "Requests for uploaded images at /static, by how they were answered.",
+    ("outcome",),
+)
+
+
+class _MemoryCache:
+    """Whole small files by path, least recently used evicted first. Only touched from the event loop."""
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+        self.size = 0
+
+    def get(self, path: str, mtime_ns: int) -> Optional[bytes]:
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        self._entries.move_to_end(path)
+        return entry[1]
+
+    def put(self, path: str, mtime_ns: int, data: bytes):
+        budget = settings.static_memory_cache_mb * 2 ** 20
+        if len(data) > budget:
+            return
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self.size -= len(old[1])
+        self._entries[path] = (mtime_ns, data)
+        self.size += len(data)
+        while self.size > budget:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def _read(path: str, start: int = 0, length: int = -1) -> bytes:
+    with open(path, "rb") as f:
+        if start:
+            f.seek(start)
+        return f.read(length)
+
+
+def _variant_width(requested: int) -> int:
+    widths = sorted(settings.static_variant_widths)
+    return next((w for w in widths if w >= requested), widths[-1])
+
+
+def _build_variant(source: str, target: str, width: int):
+    """
+    Write source scaled to `width` px wide at target, atomically. When it isn't wider it keeps its size, and is
+    linked rather than re-encoded if it is already in the target's format.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+    fmt = _VARIANT_FORMATS.get(target.rsplit(".", 1)[-1], "JPEG")
+    try:
+        register_avif_if_needed(_read(source, 0, 12))
+        with Image.open(source) as img:
+            same_format = img.format == fmt
+            # JPEG: decode at 1/2, 1/4 or 1/8 scale, as long as both sides still cover the width (EXIF may rotate it)
+            img.draft("RGB", (width, width))
+            img = ImageOps.exif_transpose(img)
+            if img.width <= width and same_format:
+                try:
+                    os.link(source, tmp)
+                except OSError:
+                    shutil.copyfile(source, tmp)
+            else:
+                if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                if img.width > width:
+                    img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+                img.save(tmp, fmt, quality=_VARIANT_QUALITY)
+        os.replace(tmp, target)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end exclusive) of a single "bytes=" range; None to send the whole file (no usable range, or several);
+    raises ValueError when the range can't be satisfied.
+    """
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(size, int(last) + 1) if last else size
+        else:
+            # bytes=-N: the last N bytes
+            start, end = max(0, size - int(last)), size
+    except ValueError:
+        return None
+    if start >= end or start >= size:
+        raise ValueError(spec)
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return any((tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()) == bare for tag in header.split(","))
+
+
+class UploadedFiles:
+    """ASGI app serving settings.upload_dir; mount it at the prefix upload URLs use."""
+
+    def __init__(self):
+        self._memory = _MemoryCache()
+        self._building: Dict[str, asyncio.Future] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        request = Request(scope, receive)
+        try:
+            response = await self._respond(request)
+        except FileNotFoundError:
+            STATIC_REQUESTS.inc(outcome="not_found")
+            response = PlainTextResponse("Not Found", status_code=404)
+        await response(scope, receive, send)
+
+    async def _respond(self, request: Request) -> Response:
+        if request.method not in ("GET", "HEAD"):
+            return PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+        # Mounted: the part of the path after the mount point (older Starlette versions hand over only that part)
+        path, root = request.scope["path"], request.scope.get("root_path", "")
+        name = (path[len(root):] if root and path.startswith(root) else path).lstrip("/")
+        if not _NAME.match(name):
+            raise FileNotFoundError(name)
+        stem, ext = name.rsplit(".", 1)
+        ext = ext.lower()
+        content_hash = _CONTENT_HASH.match(name)
+        path = os.path.join(settings.upload_dir, name)
+
+        width = None
+        if "w" in request.query_params:
+            try:
+                width = _variant_width(int(request.query_params["w"]))
+            except ValueError:
+                return PlainTextResponse("w must be an integer width in pixels", status_code=400)
+
+        # Content-hash names never change, so a client holding the hash needs nothing read from disk
+        if content_hash:
+            etag = f'"{content_hash.group(1)}-w{width}"' if width else f'"{content_hash.group(1)}"'
+            headers = {"ETag": etag, "Cache-Control": _IMMUTABLE}
+            if _etag_matches(request.headers.get("if-none-match", ""), etag):
+                STATIC_REQUESTS.inc(outcome="not_modified")
+                return Response(status_code=304, headers=headers)
+
+        stat = os.stat(path)  # page-cached metadata: cheaper inline than a threadpool hop
+        if not content_hash:
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}' + (f'-w{width}"' if width else '"')
+            headers = {"ETag": etag, "Cache-Control": f"public, max-age={settings.static_max_age}"}
+            if _etag_matches(request.headers.get("if-none-match", ""), etag):
+                STATIC_REQUESTS.inc(outcome="not_modified")
+                return Response(status_code=304, headers=headers)
+
+        media_type = _MEDIA_TYPES.get(ext, "application/octet-stream")
+        if width:
+            variant_ext = ext if ext in _VARIANT_FORMATS else "jpg"
+            variant = os.path.join(settings.upload_dir, "variants", f"{stem}.w{width}.{variant_ext}")
+            try:
+                await self._ensure_variant(path, variant, width, stat)
+            except (OSError, ValueError, Image.DecompressionBombError):
+                return PlainTextResponse("Not a resizable image", status_code=400)
+            path, stat = variant, os.stat(variant)
+            media_type = _MEDIA_TYPES[variant_ext]
+        elif settings.static_accel_redirect:
+            # The proxy sends the file itself (sendfile), ranges and all
+            STATIC_REQUESTS.inc(outcome="accel")
+            headers["X-Accel-Redirect"] = settings.static_accel_redirect.rstrip("/") + "/" + name
+            return Response(headers=headers, media_type=media_type)
+
+        headers["Last-Modified"] = formatdate(stat.st_mtime, usegmt=True)
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = None
+        if "range" in request.headers:
+            if_range = request.headers.get("if-range")
+            if if_range is None or if_range in (etag, headers["Last-Modified"]):
+                try:
+                    byte_range = _parse_range(request.headers["range"], stat.st_size)
+                except ValueError:
+                    return PlainTextResponse("Range Not Satisfiable", status_code=416,
+                                             headers={"Content-Range": f"bytes */{stat.st_size}"})
+        head = request.method == "HEAD"
+
+        if byte_range is None and "http.response.pathsend" in request.scope.get("extensions", {}):
+            STATIC_REQUESTS.inc(outcome="pathsend")
+            return FileResponse(path, stat_result=stat, headers=headers, media_type=media_type)
+
+        data = self._memory.get(path, stat.st_mtime_ns)
+        small = stat.st_size <= settings.static_memory_file_kb * 1024
+        if data is None and small and not head:
+            data = await run_in_threadpool(_read, path)
+            self._memory.put(path, stat.st_mtime_ns, data)
+            STATIC_REQUESTS.inc(outcome="file")
+        elif data is not None:
+            STATIC_REQUESTS.inc(outcome="memory")
+
+        if byte_range is not None:
+            start, end = byte_range
+            STATIC_REQUESTS.inc(outcome="range")
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{stat.st_size}"
+            if head:
+                body = b""
+            elif data is not None:
+                body = data[start:end]
+            else:
+                body = await run_in_threadpool(_read, path, start, end - start)
+            headers["Content-Length"] = str(end - start)
+            return Response(body, status_code=206, headers=headers, media_type=media_type)
+        if head:
+            headers["Content-Length"] = str(stat.st_size)
+            return Response(headers=headers, media_type=media_type)
+        if data is None:
+            STATIC_REQUESTS.inc(outcome="file")
+            return FileResponse(path, stat_result=stat, headers=headers, media_type=media_type)
+        return Response(data, headers=headers, media_type=media_type)
+
+    async def _ensure_variant(self, source: str, variant: str, width: int, source_stat: os.stat_result):
+        try:
+            if os.stat(variant).st_mtime_ns >= source_stat.st_mtime_ns:
+                return
+        except FileNotFoundError:
+            pass
+        building = self._building.get(variant)
+        if building is None:
+            STATIC_REQUESTS.inc(outcome="variant_built")
+            building = asyncio.ensure_future(run_in_threadpool(_build_variant, source, variant, width))
+            self._building[variant] = building
+            building.add_done_callback(lambda _: self._building.pop(variant, None))
+        await asyncio.shield(building)
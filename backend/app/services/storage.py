@@ -1,18 +1,34 @@
+import hashlib
 import os
+import re
 import uuid
+from app.config import settings
+from app.services.metrics import timed
+
+_EXTENSION = re.compile(r"^[a-z0-9]{1,5}$")
 
 def upload_mock_s3(content: bytes, filename: str) -> str:
-    """Mocks uploading a file to an S3 bucket and returning a public URL"""
-    upload_dir = "uploads"
+    """
+    Mocks uploading a file to an S3 bucket and returning a public URL.
+    Files are named by the hash of their content, so a URL's bytes never change (clients may cache them for good,
+    see app/services/static_files.py) and uploading the same photo again reuses the stored file.
+    """
+    upload_dir = settings.upload_dir
     os.makedirs(upload_dir, exist_ok=True)
     
     # Guard against None or empty filename
     fname = filename or "upload.jpg"
-    file_extension = fname.split(".")[-1] if "." in fname else "jpg"
-    safe_filename = f"{uuid.uuid4()}.{file_extension}"
+    file_extension = fname.rsplit(".", 1)[-1].lower() if "." in fname else "jpg"
+    if not _EXTENSION.match(file_extension):
+        file_extension = "jpg"
+    safe_filename = f"{hashlib.sha256(content).hexdigest()[:32]}.{file_extension}"
     file_path = os.path.join(upload_dir, safe_filename)
     
-    with open(file_path, "wb") as buffer:
-        buffer.write(content)
+    if not os.path.exists(file_path):
+        # Written aside and renamed in, so an immutable name is never served half-written
+        tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        with timed("storage_write"), open(tmp_path, "wb") as buffer:
+            buffer.write(content)
+        os.replace(tmp_path, file_path)
         
     return f"/static/{safe_filename}"
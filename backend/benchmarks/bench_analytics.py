@@ -0,0 +1,131 @@
+"""
+Benchmark: rollup-backed analytics vs. raw GROUP BY over the diagnoses table.
+
+Run from the backend directory:
+    python -m benchmarks.bench_analytics --rows 1000000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import Diagnosis
+from app.services.analytics import query_analytics, rebuild_rollups, record_diagnosis
+
+CROPS = ["tomato", "potato", "apple", "corn", "grape", "pepper", "peach", "cherry", "strawberry", "auto"]
+DISEASES = [f"disease-{i}" for i in range(38)]
+
+
+def _populate(engine, rows: int, days: int, seed: int):
+    rng = random.Random(seed)
+    now = datetime.datetime(2026, 1, 1)
+    chunk = 50000
+    with engine.begin() as conn:
+        for offset in range(0, rows, chunk):
+            batch = [
+                {
+                    "crop_type": rng.choice(CROPS),
+                    "disease_id": rng.choice(DISEASES),
+                    "confidence": rng.random(),
+                    "health_score": rng.randint(5, 100),
+                    "created_at": now - datetime.timedelta(seconds=rng.randint(0, days * 86400)),
+                }
+                for _ in range(min(chunk, rows - offset))
+            ]
+            conn.execute(insert(Diagnosis.__table__), batch)
+    return now
+
+
+def _time(fn, repeat: int):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return result, {"min_ms": round(samples[0], 2), "median_ms": round(samples[len(samples) // 2], 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="plantcare-bench-")
+    engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    t0 = time.perf_counter()
+    end = _populate(engine, args.rows, args.days, args.seed)
+    populate_s = time.perf_counter() - t0
+    start = end - datetime.timedelta(days=args.days)
+
+    db = Session()
+    t0 = time.perf_counter()
+    rebuild_rollups(db)
+    rebuild_s = time.perf_counter() - t0
+
+    def raw_query():
+        day = func.date(Diagnosis.created_at)
+        return db.query(
+            day, Diagnosis.crop_type, Diagnosis.disease_id,
+            func.count(Diagnosis.id), func.avg(Diagnosis.health_score)
+        ).filter(
+            Diagnosis.created_at >= start, Diagnosis.created_at < end
+        ).group_by(day, Diagnosis.crop_type, Diagnosis.disease_id).all()
+
+    def rollup_query(granularity: str):
+        return lambda: query_analytics(db, granularity, start, end)
+
+    raw_rows, raw_timing = _time(raw_query, args.repeat)
+    daily, daily_timing = _time(rollup_query("day"), args.repeat)
+    _, weekly_timing = _time(rollup_query("week"), args.repeat)
+    _, crop_timing = _time(lambda: query_analytics(db, "day", start, end, crop_type="tomato"), args.repeat)
+
+    # Incremental maintenance cost on the write path
+    writes = 1000
+    rng = random.Random(args.seed + 1)
+    t0 = time.perf_counter()
+    for _ in range(writes):
+        diagnosis = Diagnosis(crop_type=rng.choice(CROPS), disease_id=rng.choice(DISEASES),
+                              confidence=0.9, health_score=rng.randint(5, 100))
+        db.add(diagnosis)
+        record_diagnosis(db, diagnosis)
+        db.commit()
+    write_ms = (time.perf_counter() - t0) * 1000 / writes
+
+    t0 = time.perf_counter()
+    for _ in range(writes):
+        db.add(Diagnosis(crop_type="tomato", disease_id="disease-0", confidence=0.9, health_score=50))
+        db.commit()
+    plain_write_ms = (time.perf_counter() - t0) * 1000 / writes
+    db.close()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "days": args.days,
+        "populate_s": round(populate_s, 2),
+        "rebuild_rollups_s": round(rebuild_s, 2),
+        "raw_group_by": {**raw_timing, "result_rows": len(raw_rows)},
+        "rollup_day": {**daily_timing, "buckets": len(daily)},
+        "rollup_week": weekly_timing,
+        "rollup_day_single_crop": crop_timing,
+        "write_ms_with_rollups": round(write_ms, 3),
+        "write_ms_without_rollups": round(plain_write_ms, 3),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Accuracy parity, latency and memory of the inference backends, as a
+backend x batch size x threads matrix.
+
+Each backend runs in its own subprocess so import cost and RSS are measured
+cleanly (a TFLite worker should never pull in TensorFlow). The parent
+preprocesses the samples once with the production pipeline and hands the
+tensors over as a .npy file, then compares every backend's probabilities
+with the first (reference) backend.
+
+Samples come from --samples, a PlantVillage-style directory with one
+subdirectory per class. Labels are used for accuracy when the folder names
+are our class IDs, or when there are exactly 38 folders (PlantVillage
+folder names sort into the training index order). Without --samples the
+synthetic benchmark corpus is used and only parity is reported.
+
+Float backends (ONNX) must match the reference within --atol with identical
+top-1 predictions; the script exits non-zero if they don't.
+
+Run from the backend directory:
+    python -m app.model.convert_tflite --mode dynamic
+    python -m app.model.convert_tflite --mode int8 --calibration-dir data/plantvillage/train
+    python -m app.model.convert_onnx
+    python -m benchmarks.bench_backends --samples data/plantvillage/val --limit 500 \\
+        --backends keras,tflite:weights/model_dynamic.tflite,tflite:weights/model_int8.tflite,onnx \\
+        --batch-sizes 1,8,32 --threads 1,2,4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_PATHS = {"keras": "weights/model.keras", "tflite": "weights/model_int8.tflite", "onnx": "weights/model.onnx"}
+FLOAT_BACKENDS = ("keras", "onnx")
+
+
+def _rss_mb() -> Tuple[float, float]:
+    rss = hwm = 0.0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    hwm = int(line.split()[1]) / 1024
+    except OSError:
+        import resource
+        hwm = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rss, hwm
+
+
+def _parse_spec(spec: str) -> Tuple[str, Optional[str]]:
+    name, _, path = spec.partition(":")
+    return name, path or None
+
+
+# ---------------------------------------------------------------------------
+# Worker: one backend, one process
+# ---------------------------------------------------------------------------
+
+def run_worker(spec: str, tensors_path: str, preds_out: str, batch_sizes: List[int], threads: Optional[int],
+               use_xnnpack: bool, onnx_inter_threads: int, onnx_optimization: str, repeats: int) -> Dict:
+    rss_start, _ = _rss_mb()
+    t0 = time.perf_counter()
+    from app.model.backends import create_backend
+
+    name, path = _parse_spec(spec)
+    model_path = os.path.join(BACKEND_DIR, path or DEFAULT_MODEL_PATHS.get(name, "weights/model.keras"))
+    backend = create_backend(name, model_path=model_path, num_threads=threads, use_xnnpack=use_xnnpack,
+                             onnx_inter_op_threads=onnx_inter_threads, onnx_optimization=onnx_optimization)
+    load_s = time.perf_counter() - t0
+    rss_loaded, _ = _rss_mb()
+
+    tensors = np.load(tensors_path, mmap_mode="r")
+    backend.predict(np.ascontiguousarray(tensors[:1]))  # first call allocates / traces
+
+    latency = {}
+    for batch_size in batch_sizes:
+        if batch_size > len(tensors):
+            continue
+        batch = np.ascontiguousarray(tensors[:batch_size])
+        backend.predict(batch)
+        samples = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            backend.predict(batch)
+            samples.append(time.perf_counter() - t0)
+        samples.sort()
+        latency[str(batch_size)] = {
+            "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+            "images_per_s": round(batch_size / samples[len(samples) // 2], 1),
+        }
+
+    chunk = max(batch_sizes)
+    preds = np.concatenate([
+        backend.predict(np.ascontiguousarray(tensors[i:i + chunk])) for i in range(0, len(tensors), chunk)
+    ])
+    np.save(preds_out, preds.astype(np.float32))
+
+    rss_end, hwm = _rss_mb()
+    return {
+        "backend": spec,
+        "threads": threads,
+        "describe": backend.describe(),
+        "load_s": round(load_s, 2),
+        "rss_after_load_mb": round(rss_loaded, 1),
+        "model_rss_mb": round(rss_loaded - rss_start, 1),
+        "rss_end_mb": round(rss_end, 1),
+        "peak_rss_mb": round(hwm, 1),
+        "model_file_mb": round(os.path.getsize(model_path) / (1024 * 1024), 2) if os.path.isfile(model_path) else None,
+        "latency": latency,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Parent: sample loading and parity report
+# ---------------------------------------------------------------------------
+
+def load_samples(root: Optional[str], limit: int, seed: int, manifest) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    from app.model.inference import decode_image, image_to_tensor
+
+    if root is None:
+        from benchmarks.corpus import build_corpus
+        corpus = build_corpus(sizes=((224, 224), (640, 480), (1280, 960)), formats=("JPEG",), per_combo=limit // 3 or 1,
+                              seed=seed)
+        return np.stack([image_to_tensor(decode_image(item["bytes"]), manifest) for item in corpus[:limit]]), None
+
+    from app.model.convert_tflite import find_images
+    classes = list(manifest.classes)
+    class_dirs = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    if len(class_dirs) == len(classes):
+        label_of = {d: i for i, d in enumerate(class_dirs)}
+    else:
+        label_of = {d: classes.index(d) for d in class_dirs if d in classes}
+
+    paths = find_images(root)
+    rng = np.random.default_rng(seed)
+    rng.shuffle(paths)
+    tensors, labels = [], []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            try:
+                tensors.append(image_to_tensor(decode_image(f.read()), manifest))
+            except ValueError:
+                continue
+        top = os.path.relpath(path, root).split(os.sep)[0]
+        labels.append(label_of.get(top, -1))
+    labels = np.array(labels)
+    return np.stack(tensors), labels if (labels >= 0).any() else None
+
+
+def parity(reference: np.ndarray, preds: np.ndarray, labels: Optional[np.ndarray], atol: float, manifest) -> Dict:
+    from app.model.calibration import Calibration
+
+    # Uncalibrated acceptance at the manifest's threshold, like the API serves without a calibration file
+    calibration = Calibration(default_threshold=manifest.default_threshold)
+
+    def mapped(index, confidence):
+        return manifest.classes[index] if calibration.accept(index, confidence) else "unknown"
+
+    ref_top, top = reference.argmax(axis=1), preds.argmax(axis=1)
+    ref_conf, conf = reference.max(axis=1), preds.max(axis=1)
+    mapped_match = np.mean([
+        mapped(int(a), float(ca)) == mapped(int(b), float(cb))
+        for a, ca, b, cb in zip(ref_top, ref_conf, top, conf)
+    ])
+    diff = np.abs(reference - preds)
+    report = {
+        "top1_agreement": round(float(np.mean(ref_top == top)), 4),
+        "mapped_class_agreement": round(float(mapped_match), 4),
+        "mean_abs_prob_diff": round(float(diff.mean()), 5),
+        "max_abs_prob_diff": round(float(diff.max()), 5),
+        "mean_confidence_shift": round(float(np.mean(conf - ref_conf)), 5),
+        "equivalent": bool(np.array_equal(ref_top, top) and diff.max() <= atol),
+    }
+    if labels is not None:
+        known = labels >= 0
+        report["accuracy"] = round(float(np.mean(top[known] == labels[known])), 4)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="keras,tflite:weights/model_dynamic.tflite,tflite:weights/model_int8.tflite",
+                        help="Comma-separated name[:model path]; the first is the parity reference")
+    parser.add_argument("--samples", default=None)
+    parser.add_argument("--limit", type=int, default=300)
+    parser.add_argument("--batch-sizes", default="1,8,32", type=lambda v: [int(b) for b in v.split(",")])
+    parser.add_argument("--threads", default=None, type=lambda v: [int(t) for t in v.split(",")],
+                        help="Comma-separated thread counts (TFLite threads / ORT intra-op); default one per core")
+    parser.add_argument("--no-xnnpack", action="store_true")
+    parser.add_argument("--onnx-inter-threads", type=int, default=1)
+    parser.add_argument("--onnx-optimization", default="all", choices=("disable", "basic", "extended", "all"))
+    parser.add_argument("--atol", type=float, default=1e-4, help="Max abs probability diff for float backends")
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--tensors", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--preds-out", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_worker(args.worker, args.tensors, args.preds_out, args.batch_sizes,
+                            args.threads[0] if args.threads else None, not args.no_xnnpack,
+                            args.onnx_inter_threads, args.onnx_optimization, args.repeats)
+        print(json.dumps(result))
+        return
+
+    from app.model.manifest import load_manifest
+
+    manifest = load_manifest(os.path.join(BACKEND_DIR, DEFAULT_MODEL_PATHS["keras"]))
+    tensors, labels = load_samples(args.samples, args.limit, args.seed, manifest)
+    workdir = tempfile.mkdtemp(prefix="plantcare-backends-")
+    tensors_path = os.path.join(workdir, "tensors.npy")
+    np.save(tensors_path, tensors.astype(np.float32))
+
+    results, preds = [], []
+    runs = [(spec, threads) for spec in args.backends.split(",") for threads in (args.threads or [None])]
+    for i, (spec, threads) in enumerate(runs):
+        preds_out = os.path.join(workdir, f"preds_{i}.npy")
+        cmd = [sys.executable, "-m", "benchmarks.bench_backends", "--worker", spec, "--tensors", tensors_path,
+               "--preds-out", preds_out, "--batch-sizes", ",".join(map(str, args.batch_sizes)),
+               "--repeats", str(args.repeats), "--onnx-inter-threads", str(args.onnx_inter_threads),
+               "--onnx-optimization", args.onnx_optimization]
+        if threads:
+            cmd += ["--threads", str(threads)]
+        if args.no_xnnpack:
+            cmd.append("--no-xnnpack")
+        proc = subprocess.run(cmd, cwd=BACKEND_DIR, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{spec} (threads={threads}) failed:\n{proc.stderr[-2000:]}", file=sys.stderr)
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        preds.append(np.load(preds_out))
+
+    diverged = []
+    for result, pred in zip(results, preds):
+        report = parity(preds[0], pred, labels, args.atol, manifest)
+        result["parity_vs_" + results[0]["backend"]] = report
+        if _parse_spec(result["backend"])[0] in FLOAT_BACKENDS and not report["equivalent"]:
+            diverged.append(result["backend"])
+
+    matrix = [
+        {"backend": result["backend"], "threads": result["describe"].get("num_threads") or
+         result["describe"].get("intra_op_threads"), "batch": int(batch), **stats}
+        for result in results for batch, stats in result["latency"].items()
+    ]
+    print(json.dumps({
+        "samples": args.samples or "synthetic corpus",
+        "images": int(len(tensors)),
+        "labelled": labels is not None,
+        "matrix": matrix,
+        "results": results,
+        "diverged": diverged,
+    }, indent=2))
+    if diverged:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
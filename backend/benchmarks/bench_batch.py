@@ -0,0 +1,96 @@
+"""
+Throughput comparison: N single /analyze calls vs. one /analyze/batch call.
+
+Drives the FastAPI app in-process. Gemini is replaced by a stand-in with a
+fixed latency (or disabled with --gemini-latency-ms -1 to exercise the
+batched MobileNetV2 path).
+
+Run from the backend directory:
+    python -m benchmarks.bench_batch --images 50 --gemini-latency-ms 800
+    python -m benchmarks.bench_batch --images 50 --gemini-latency-ms -1
+"""
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+
+_workdir = tempfile.mkdtemp(prefix="plantcare-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_workdir, 'bench.db')}")
+os.environ.setdefault("OUTBREAK_WARM_START_DAYS", "0")
+os.environ.setdefault("ADMISSION_RATE_PER_MINUTE", "0")
+
+from PIL import Image
+from fastapi.testclient import TestClient
+
+import app.routes.analyze as analyze_route
+from app.main import app
+
+CANNED_GEMINI = {
+    "plant_name": "Tomato", "disease_name": "Early Blight", "disease_id": "tomato-early-blight",
+    "severity": "medium", "confidence": 0.91, "health_score": 62, "leaf_condition": 60,
+    "infection_severity": 40, "color_analysis": 65,
+}
+
+
+def _make_images(n: int, size: int):
+    images = []
+    for i in range(n):
+        img = Image.new("RGB", (size, size), color=(30 + i % 60, 120 + i % 100, 40))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=90)
+        images.append(buf.getvalue())
+    return images
+
+
+def _stub_gemini(latency_ms: int):
+    def fake_analyze_plant_image(image_bytes: bytes, max_retries: int = 2):
+        if latency_ms < 0:
+            return None
+        time.sleep(latency_ms / 1000)
+        return dict(CANNED_GEMINI)
+    analyze_route.analyze_plant_image = fake_analyze_plant_image
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--gemini-latency-ms", type=int, default=800)
+    args = parser.parse_args()
+
+    os.chdir(_workdir)  # keep benchmark uploads out of the repo
+    _stub_gemini(args.gemini_latency_ms)
+    images = _make_images(args.images, args.size)
+    client = TestClient(app)
+
+    # Warm-up: model load and first-call overheads
+    client.post("/analyze", files={"image": ("warm.jpg", images[0], "image/jpeg")})
+
+    t0 = time.perf_counter()
+    for i, data in enumerate(images):
+        res = client.post("/analyze", files={"image": (f"leaf{i}.jpg", data, "image/jpeg")})
+        res.raise_for_status()
+    single_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    files = [("images", (f"leaf{i}.jpg", data, "image/jpeg")) for i, data in enumerate(images)]
+    res = client.post("/analyze/batch", files=files)
+    res.raise_for_status()
+    batch_s = time.perf_counter() - t0
+    summary = res.json()["summary"]
+
+    print(json.dumps({
+        "images": args.images,
+        "image_size": args.size,
+        "gemini_latency_ms": args.gemini_latency_ms,
+        "single_calls": {"total_s": round(single_s, 3), "images_per_s": round(args.images / single_s, 2)},
+        "batch_call": {"total_s": round(batch_s, 3), "images_per_s": round(args.images / batch_s, 2)},
+        "speedup": round(single_s / batch_s, 2),
+        "batch_summary": summary,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
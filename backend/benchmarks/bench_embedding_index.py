@@ -0,0 +1,153 @@
+"""
+Query latency, recall and memory of the embedding index at 100k and 1M diagnoses.
+
+Fills a fresh app.services.embedding_index.EmbeddingIndex with synthetic
+unit-length embeddings (--dim, MobileNetV2's 1280 by default) drawn around
+--clusters centers, one label per center, half of them labeled by Gemini.
+Queries are new draws from the same centers: repeat photos of a known
+condition. Per --sizes value it reports:
+
+  build    appending every row (add(), in --append-batch chunks) and
+           training the IVF, in seconds
+  storage  size of the memory-mapped files (capacity doubles, so up to
+           twice the rows), the process's file-backed resident memory (index
+           pages, shared by every worker through the page cache) and the
+           IVF's own memory (lists, codes, centroids: per worker)
+  search   p50/p99 of an exact scan vs the IVF at each --nprobe, with the
+           IVF's recall@10 against the exact result
+  classify p50 of the kNN answer (Gemini-labeled neighbors only) and how
+           often it answered with the query's own label or a wrong one
+
+Synthetic clusters are tighter than real embeddings of field photos, so
+treat the kNN answer rate as an upper bound; the latency and memory side
+carries over.
+
+Run from the backend directory:
+    python -m benchmarks.bench_embedding_index
+    python -m benchmarks.bench_embedding_index --sizes 100000 --nprobe 4,8,16,32
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+
+def _pct(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 2)
+
+
+def _file_backed_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("RssFile:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def _draw(centers, labels, count, spread, rng):
+    picked = rng.integers(0, len(centers), count)
+    vectors = centers[picked] + spread * rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors, labels[picked]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000", type=lambda v: [int(n) for n in v.split(",")])
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--clusters", type=int, default=2000)
+    parser.add_argument("--spread", type=float, default=0.007,
+                        help="Per-dimension noise around a center (0.007 at 1280-d: ~0.94 cosine between two draws)")
+    parser.add_argument("--nprobe", default="4,8,16", type=lambda v: [int(n) for n in v.split(",")])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--exact-queries", type=int, default=20, help="Exact scans are slow at 1M; recall uses these")
+    parser.add_argument("--append-batch", type=int, default=50_000)
+    parser.add_argument("--dir", default=None, help="Where to build the index (default: a temp dir, removed after)")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+
+    from app.config import settings
+    from app.services.embedding_index import EmbeddingIndex
+
+    # Training is timed here, not left to the background thread
+    settings.embedding_ivf_min_vectors = 2 ** 62
+    rng = np.random.default_rng(args.seed)
+    centers = rng.standard_normal((args.clusters, args.dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = np.array([f"condition-{i}" for i in range(args.clusters)])
+    queries, query_labels = _draw(centers, labels, args.queries, args.spread, rng)
+
+    root = args.dir or tempfile.mkdtemp(prefix="plantcare-embeddings-")
+    report = {"dim": args.dim, "clusters": args.clusters, "queries": args.queries, "sizes": {}}
+    try:
+        for size in args.sizes:
+            directory = os.path.join(root, str(size))
+            shutil.rmtree(directory, ignore_errors=True)
+            index = EmbeddingIndex(directory)
+
+            started = time.perf_counter()
+            for start in range(0, size, args.append_batch):
+                count = min(args.append_batch, size - start)
+                vectors, vector_labels = _draw(centers, labels, count, args.spread, rng)
+                index.add([{"diagnosis_id": start + i + 1, "vector": vector, "label": label,
+                            "source": "gemini" if i % 2 else "local"}
+                           for i, (vector, label) in enumerate(zip(vectors, vector_labels))])
+            append_s = time.perf_counter() - started
+            started = time.perf_counter()
+            index.train()
+            train_s = time.perf_counter() - started
+
+            exact_times, exact_results = [], []
+            for query in queries[:args.exact_queries]:
+                started = time.perf_counter()
+                exact_results.append({r["diagnosis_id"] for r in index.search(query, 10, exact=True)})
+                exact_times.append(time.perf_counter() - started)
+            search = {"exact": {"p50_ms": _pct(exact_times, 50), "p99_ms": _pct(exact_times, 99)}}
+            for nprobe in args.nprobe:
+                settings.embedding_ivf_nprobe = nprobe
+                times, found = [], 0
+                for i, query in enumerate(queries):
+                    started = time.perf_counter()
+                    result = index.search(query, 10)
+                    times.append(time.perf_counter() - started)
+                    if i < len(exact_results):
+                        found += len(exact_results[i] & {r["diagnosis_id"] for r in result})
+                search[f"ivf_nprobe_{nprobe}"] = {
+                    "p50_ms": _pct(times, 50),
+                    "p99_ms": _pct(times, 99),
+                    "recall_at_10": round(found / (10 * len(exact_results)), 4) if exact_results else None,
+                }
+
+            settings.embedding_ivf_nprobe = args.nprobe[len(args.nprobe) // 2]
+            times, answered, wrong = [], 0, 0
+            for query, label in zip(queries, query_labels):
+                started = time.perf_counter()
+                match = index.classify(query)
+                times.append(time.perf_counter() - started)
+                answered += match is not None
+                wrong += match is not None and match["label"] != label
+
+            disk = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            described = index.describe()
+            report["sizes"][str(size)] = {
+                "build_s": {"append": round(append_s, 1), "ivf_train": round(train_s, 1)},
+                "ivf_lists": described["ivf_lists"],
+                "disk_mb": round(disk / 2 ** 20, 1),
+                "memory_mb": {"file_backed_rss": _file_backed_mb(), "ivf": round(described["ivf_bytes"] / 2 ** 20, 1)},
+                "search": search,
+                "classify": {"nprobe": settings.embedding_ivf_nprobe, "p50_ms": _pct(times, 50),
+                             "answered": round(answered / len(queries), 4), "wrong": wrong},
+            }
+            del index
+    finally:
+        if args.dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
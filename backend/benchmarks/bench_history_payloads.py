@@ -0,0 +1,218 @@
+"""
+Storage per diagnosis and detail-view latency of the stored analysis payloads.
+
+Payloads are AnalysisResponse JSON of two kinds, mixed by --gemini-share:
+
+  local   a curated diseases.json entry, as the local model answers, with
+          varying confidence, health score and heatmap regions
+  gemini  Gemini-style answers: disease info written fresh for every
+          diagnosis (sentences of words drawn from the curated texts, in an
+          order the dictionary never saw), so no phrase repeats verbatim
+
+Per codec (the JSON as is, plain gzip, zlib and, when installed, zstd with
+the configured shared dictionary) it reports:
+
+  payload  mean bytes per payload by kind, and p50 encode/decode time
+  sqlite   bytes per row of a --rows diagnoses table holding the payloads
+           (file size / rows, columns and page overhead included)
+  replay   p50/p99 of GET /api/history/{id} for random rows: through the
+           ASGI test client (most of it the client itself), and the handler
+           alone (row lookup and decompression); next to what re-validating
+           and re-serializing the stored JSON into an AnalysisResponse would
+           add per request
+
+Run from the backend directory:
+    python -m benchmarks.bench_history_payloads
+    python -m benchmarks.bench_history_payloads --rows 100000 --gemini-share 0.8
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+
+def _pct(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+def _sentence(rng, words, length):
+    return " ".join(rng.choice(words) for _ in range(length)).capitalize() + "."
+
+
+def _payloads(count, gemini_share, seed):
+    """(kind, AnalysisResponse JSON) pairs."""
+    from app.schemas.response import AnalysisResponse
+    from app.services.disease_mapper import disease_mapper
+    from app.services.health_score import calculate_health_score
+
+    rng = random.Random(seed)
+    curated = disease_mapper.diseases
+    words = sorted({w for w in re.findall(r"[a-z]{3,}", json.dumps(curated).lower())})
+    healthy = disease_mapper.map_prediction_to_disease("healthy", confidence=0.0)
+    payloads = []
+    for _ in range(count):
+        confidence = round(rng.uniform(0.55, 0.99), 4)
+        if rng.random() < gemini_share:
+            kind = "gemini"
+            plant, name = rng.choice(words).title(), f"{rng.choice(words).title()} {rng.choice(words)}"
+            disease = {
+                "id": f"{plant.lower()}-{name.lower().replace(' ', '-')}",
+                "name": f"{plant} — {name}",
+                "cropFamily": "auto",
+                "recommendations": [_sentence(rng, words, rng.randint(5, 10)) for _ in range(4)],
+                "severity": rng.choice(["low", "medium", "high"]),
+                "treatment": {
+                    "immediate": [_sentence(rng, words, rng.randint(5, 12)) for _ in range(3)],
+                    "organic": [_sentence(rng, words, rng.randint(5, 12)) for _ in range(3)],
+                    "chemical": [_sentence(rng, words, rng.randint(5, 12)) for _ in range(3)],
+                    "prevention": [_sentence(rng, words, rng.randint(5, 12)) for _ in range(3)],
+                    "recoveryTimeline": _sentence(rng, words, 8),
+                },
+                "beginnerDescription": " ".join(_sentence(rng, words, 12) for _ in range(3)),
+                "advancedDescription": " ".join(_sentence(rng, words, 15) for _ in range(5)),
+                "commonRegions": [],
+                "seasonalRisk": [],
+                "healthScoreImpact": rng.randint(0, 90),
+            }
+        else:
+            kind = "local"
+            disease = rng.choice(curated)
+        regions = [{"x": round(rng.random(), 4), "y": round(rng.random(), 4), "radius": round(rng.uniform(0.05, 0.3), 4),
+                    "intensity": round(rng.random(), 4), "diseaseId": disease["id"]} for _ in range(rng.randint(0, 4))]
+        payloads.append((kind, AnalysisResponse(
+            disease=disease,
+            confidence=confidence,
+            processingTime=rng.randint(300, 6000),
+            processingBreakdown={"decode": round(rng.uniform(5, 40), 2), "inference": round(rng.uniform(20, 200), 2)},
+            alternatives=[{"disease": healthy, "confidence": round((1 - confidence) * 0.7, 2)}],
+            healthScore=calculate_health_score(disease, confidence),
+            heatmapRegions=regions,
+            confidenceLevel="high" if confidence > 0.85 else "medium" if confidence > 0.6 else "low",
+            multiDiseaseWarning=len(regions) > 2,
+            similarCases=[{"diagnosisId": rng.randint(1, 10 ** 6), "diseaseId": disease["id"],
+                           "similarity": round(rng.uniform(0.8, 1.0), 4)} for _ in range(rng.randint(0, 5))],
+        ).model_dump_json().encode()))
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--gemini-share", type=float, default=0.5)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from starlette.requests import Request
+
+    from app.config import settings
+    from app.database import Base, get_db
+    from app.dependencies import get_current_user
+    from app.models import Diagnosis, User
+    from app.routes import history
+    from app.schemas.response import AnalysisResponse
+    from app.services import payload_store
+
+    payloads = _payloads(args.rows, args.gemini_share, args.seed)
+    dictionary = settings.payload_dictionary
+    codecs = ["json", "gzip", f"zlib:{dictionary}"]
+    if payload_store.zstandard is not None:
+        codecs.append(f"zstd:{dictionary}")
+
+    app = FastAPI()
+    app.include_router(history.router, prefix="/api")
+    user = User(id=1, email="bench@example.com")
+    app.dependency_overrides[get_current_user] = lambda: user
+    client = TestClient(app)
+
+    tmpdir = tempfile.mkdtemp(prefix="plantcare-payloads-")
+    report = {"rows": args.rows, "gemini_share": args.gemini_share, "dictionary": dictionary, "codecs": {}}
+    rng = random.Random(args.seed)
+    try:
+        for codec in codecs:
+            blobs, encode_s = [], []
+            for _, payload in payloads:
+                started = time.perf_counter()
+                blobs.append(payload if codec == "json" else payload_store.encode(payload, codec)[0])
+                encode_s.append(time.perf_counter() - started)
+            decode_s = []
+            for blob in blobs[:args.requests]:
+                started = time.perf_counter()
+                if codec != "json":
+                    payload_store.decode(blob, codec)
+                decode_s.append(time.perf_counter() - started)
+            by_kind = {}
+            for (kind, _), blob in zip(payloads, blobs):
+                by_kind.setdefault(kind, []).append(len(blob))
+
+            path = os.path.join(tmpdir, f"{codec.split(':')[0]}.db")
+            engine = create_engine(f"sqlite:///{path}")
+            Base.metadata.create_all(bind=engine)
+            with engine.begin() as conn:
+                conn.execute(insert(Diagnosis.__table__), [
+                    {"user_id": 1, "crop_type": "tomato", "disease_id": "tomato-early-blight", "confidence": 0.9,
+                     "health_score": 60, "image_url": f"/static/{i:032x}.jpg", "payload": blob,
+                     # The uncompressed baseline only counts bytes; the endpoint has no codec for it
+                     "payload_codec": codec if codec != "json" else None}
+                    for i, blob in enumerate(blobs)
+                ])
+            engine.dispose()
+            entry = {
+                "payload": {
+                    "bytes": {kind: round(float(np.mean(sizes))) for kind, sizes in by_kind.items()},
+                    "encode_p50_us": round(float(np.percentile(encode_s, 50)) * 1e6, 1),
+                    "decode_p50_us": round(float(np.percentile(decode_s, 50)) * 1e6, 1),
+                },
+                "sqlite_bytes_per_row": round(os.path.getsize(path) / args.rows),
+            }
+            if codec != "json":
+                engine = create_engine(f"sqlite:///{path}")
+                Session = sessionmaker(bind=engine)
+
+                def override_db():
+                    db = Session()
+                    try:
+                        yield db
+                    finally:
+                        db.close()
+
+                app.dependency_overrides[get_db] = override_db
+                times, handler, reserialize = [], [], []
+                request = Request({"type": "http", "headers": []})
+                for _ in range(args.requests):
+                    diagnosis_id = rng.randint(1, args.rows)
+                    started = time.perf_counter()
+                    # Without Accept-Encoding, so every codec is decompressed server-side
+                    response = client.get(f"/api/history/{diagnosis_id}", headers={"Accept-Encoding": "identity"})
+                    times.append(time.perf_counter() - started)
+                    assert response.status_code == 200 and response.content == payloads[diagnosis_id - 1][1]
+                    db = Session()
+                    started = time.perf_counter()
+                    history.get_history_item(diagnosis_id, request, db, user)
+                    handler.append(time.perf_counter() - started)
+                    db.close()
+                    started = time.perf_counter()
+                    AnalysisResponse.model_validate_json(response.content).model_dump_json()
+                    reserialize.append(time.perf_counter() - started)
+                entry["replay_ms"] = {"p50": _pct(times, 50), "p99": _pct(times, 99),
+                                      "handler_p50": _pct(handler, 50), "handler_p99": _pct(handler, 99),
+                                      "reserialize_p50": _pct(reserialize, 50)}
+                engine.dispose()
+            report["codecs"][codec.split(":")[0]] = entry
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
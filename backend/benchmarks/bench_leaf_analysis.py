@@ -0,0 +1,69 @@
+"""
+Per-image cost of the leaf-analysis stage behind the health score.
+
+Decodes each corpus image once (as the request path does), then times
+analyze_leaf on it, the downsample included, and reports p50/p99 per image
+size. Each image is analyzed twice to check the scores are deterministic,
+and the resulting health-score breakdowns are summarized.
+
+Run from the backend directory:
+    python -m benchmarks.bench_leaf_analysis --repeat 20
+    python -m benchmarks.bench_leaf_analysis --sizes 640x480,4000x3000 --per-combo 4
+"""
+import argparse
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks.corpus import DEFAULT_SIZES, build_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=None, help="Comma-separated WxH list (default: the corpus sizes)")
+    parser.add_argument("--per-combo", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10, help="Timed runs per image")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    from app.model.inference import decode_image
+    from app.services.health_score import calculate_health_score
+    from app.services.leaf_analysis import analyze_leaf
+
+    sizes = DEFAULT_SIZES
+    if args.sizes:
+        sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+    corpus = build_corpus(sizes=sizes, formats=("JPEG",), per_combo=args.per_combo, seed=args.seed)
+    disease = {"id": "tomato-early-blight", "severity": "medium"}
+
+    analyze_leaf(decode_image(corpus[0]["bytes"]))  # warm up OpenCV
+    timings = defaultdict(list)
+    breakdowns, mismatches = [], 0
+    for item in corpus:
+        img = decode_image(item["bytes"])
+        first = analyze_leaf(img)
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            stats = analyze_leaf(img)
+            timings[f"{item['width']}x{item['height']}"].append(time.perf_counter() - started)
+        mismatches += stats != first
+        breakdowns.append(calculate_health_score(disease, 0.8, stats)["breakdown"])
+
+    report = {
+        "images": len(corpus),
+        "repeat": args.repeat,
+        "deterministic": mismatches == 0,
+        "latency_ms": {
+            size: {"p50": round(float(np.percentile(samples, 50)) * 1000, 3),
+                   "p99": round(float(np.percentile(samples, 99)) * 1000, 3)}
+            for size, samples in timings.items()
+        },
+        "breakdown_mean": {key: round(float(np.mean([b[key] for b in breakdowns])), 1) for key in breakdowns[0]},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
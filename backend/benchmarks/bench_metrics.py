@@ -0,0 +1,78 @@
+"""
+Overhead of the stage-timing instrumentation.
+
+Measures the cost of one timed() stage (with and without a request timer
+active), of rendering /metrics, and what that adds to a request that times
+the usual ~8 stages.
+
+Run from the backend directory:
+    python -m benchmarks.bench_metrics --iterations 1000000
+"""
+import argparse
+import json
+import time
+
+from app.services.metrics import MetricsRegistry, registry, request_timer, timed
+
+STAGES_PER_REQUEST = 8  # read, decode, preprocess, forward, gemini, storage_write, db_commit, + DB queries
+
+
+def _per_call_ns(fn, iterations: int) -> float:
+    t0 = time.perf_counter_ns()
+    fn(iterations)
+    return (time.perf_counter_ns() - t0) / iterations
+
+
+def _baseline(n: int):
+    for _ in range(n):
+        pass
+
+
+def _timed_only(n: int):
+    for _ in range(n):
+        with timed("bench"):
+            pass
+
+
+def _timed_in_request(n: int):
+    with request_timer():
+        for _ in range(n):
+            with timed("bench"):
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    parser.add_argument("--request-ms", type=float, default=100.0,
+                        help="Reference request latency to express overhead against (local-only path)")
+    args = parser.parse_args()
+
+    baseline = _per_call_ns(_baseline, args.iterations)
+    bare = _per_call_ns(_timed_only, args.iterations) - baseline
+    with_timer = _per_call_ns(_timed_in_request, args.iterations) - baseline
+
+    # A realistic exposition: 20 stages x 15 buckets
+    scrape_registry = MetricsRegistry()
+    hist = scrape_registry.histogram("bench_stage_seconds", "bench", ("stage",))
+    for i in range(20):
+        hist.observe(0.01 * i, stage=f"stage{i}")
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        scrape_registry.render()
+    render_us = (time.perf_counter() - t0) / 1000 * 1e6
+
+    per_request_us = with_timer * STAGES_PER_REQUEST / 1000
+    print(json.dumps({
+        "iterations": args.iterations,
+        "timed_stage_ns": round(bare, 1),
+        "timed_stage_with_request_timer_ns": round(with_timer, 1),
+        "per_request_overhead_us": round(per_request_us, 2),
+        "overhead_pct_of_request": round(per_request_us / (args.request_ms * 1000) * 100, 4),
+        "render_metrics_us": round(render_us, 1),
+        "stage_histograms_in_process": len(registry.render().splitlines()),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Per-worker models vs one shared model server: memory and throughput.
+
+Simulates K API worker processes, each with T request threads sending
+single-image predictions for --seconds:
+
+  per-worker  every worker loads its own copy of the backend (today's
+              deployment with uvicorn --workers K)
+  shared      one app.model.server process owns the model and micro-batches
+              across workers; workers use the remote backend
+
+Memory is the summed PSS (proportional set size, so shared pages are not
+double counted) of all processes involved, sampled while under load.
+
+Run from the backend directory:
+    python -m benchmarks.bench_model_server --backend keras --workers 4 --threads 4
+    python -m benchmarks.bench_model_server --backend onnx --model-path weights/model.onnx --workers 4
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _memory_mb(pid: int) -> float:
+    """PSS when the kernel exposes it, RSS otherwise."""
+    for path, key in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(key):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            continue
+    return 0.0
+
+
+def _worker(mode: str, backend: str, model_path: Optional[str], socket_path: str, threads: int, seconds: float,
+            ready, start, results):
+    import threading
+    from app.model.backends import create_backend
+
+    if mode == "shared":
+        model = create_backend("remote", socket_path=socket_path)
+    else:
+        model = create_backend(backend, model_path=model_path or os.path.join(BACKEND_DIR, "weights/model.keras"),
+                               num_threads=1)
+    tensor = np.random.default_rng(os.getpid()).uniform(-1, 1, (1, 224, 224, 3)).astype(np.float32)
+    model.predict(tensor)
+    ready.release()
+    start.wait()
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def loop():
+        local = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            model.predict(tensor)
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=loop) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put(latencies)
+
+
+def run(mode: str, args) -> Dict:
+    ctx = mp.get_context("spawn")
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="plantcare-ms-"), "model.sock")
+    server = None
+    if mode == "shared":
+        cmd = [sys.executable, "-m", "app.model.server", "--socket", socket_path, "--backend", args.backend,
+               "--max-batch", str(args.max_batch), "--max-wait-ms", str(args.max_wait_ms)]
+        if args.model_path:
+            cmd += ["--model-path", args.model_path]
+        server = subprocess.Popen(cmd, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for _ in range(600):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.1)
+        else:
+            server.kill()
+            raise RuntimeError("Model server did not start")
+
+    ready, start, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(mode, args.backend, args.model_path, socket_path, args.threads,
+                                               args.seconds, ready, start, results))
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.acquire()
+
+    start.set()
+    time.sleep(args.seconds / 2)
+    pids = [p.pid for p in procs] + ([server.pid] if server else [])
+    memory = {pid: _memory_mb(pid) for pid in pids}
+
+    latencies = []
+    for _ in procs:
+        latencies.extend(results.get())
+    for p in procs:
+        p.join()
+    if server:
+        server.terminate()
+        server.wait(timeout=30)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "images_per_s": round(len(latencies) / args.seconds, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        "total_memory_mb": round(sum(memory.values()), 1),
+        "worker_memory_mb": round(sum(memory[p.pid] for p in procs) / len(procs), 1),
+        "server_memory_mb": round(memory[server.pid], 1) if server else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="keras")
+    parser.add_argument("--model-path", default=None)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent requests per worker")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    report = {
+        "backend": args.backend,
+        "workers": args.workers,
+        "threads_per_worker": args.threads,
+        "runs": [run("per-worker", args), run("shared", args)],
+    }
+    per_worker, shared = report["runs"]
+    report["memory_saved_mb"] = round(per_worker["total_memory_mb"] - shared["total_memory_mb"], 1)
+    report["throughput_ratio"] = round(shared["images_per_s"] / per_worker["images_per_s"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Replay benchmark for the streaming outbreak detector.
+
+Replays either historical diagnoses from a database (--database-url) or a
+synthetic stream with injected outbreaks, and reports throughput, memory and
+how many of the injected outbreaks were flagged.
+
+Run from the backend directory:
+    python -m benchmarks.bench_outbreak --regions 4000 --diseases 38 --days 14
+    python -m benchmarks.bench_outbreak --database-url sqlite:///./plantcare.db
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+import tracemalloc
+
+from app.services.outbreak import OutbreakDetector
+
+
+def _synthetic_stream(regions: int, diseases: int, days: int, events_per_hour: int,
+                      spikes: int, seed: int):
+    """Background traffic spread over all series, plus a few concentrated bursts."""
+    rng = random.Random(seed)
+    region_names = [f"region-{i}" for i in range(regions)]
+    disease_ids = [f"crop-disease-{i}" for i in range(diseases)]
+    start = datetime.datetime(2026, 5, 1, tzinfo=datetime.timezone.utc)
+    hours = days * 24
+
+    injected = set()
+    for _ in range(spikes):
+        # Only inject after the first day so the baseline has something to learn from
+        injected.add((rng.choice(region_names), rng.choice(disease_ids), rng.randint(24, hours - 1)))
+    spike_hours = {}
+    for region, disease, hour in injected:
+        spike_hours.setdefault(hour, []).append((region, disease))
+
+    events = []
+    for hour in range(hours):
+        base = start + datetime.timedelta(hours=hour)
+        for _ in range(events_per_hour):
+            ts = base + datetime.timedelta(seconds=rng.randint(0, 3599))
+            events.append((rng.choice(region_names), rng.choice(disease_ids), ts))
+        for region, disease in spike_hours.get(hour, []):
+            for _ in range(rng.randint(12, 25)):
+                ts = base + datetime.timedelta(seconds=rng.randint(0, 3599))
+                events.append((region, disease, ts))
+    events.sort(key=lambda e: e[2])
+    return events, {(r, d) for r, d, _ in injected}
+
+
+def _db_stream(database_url: str):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.models import Diagnosis, User
+
+    engine = create_engine(database_url)
+    db = sessionmaker(bind=engine)()
+    rows = db.query(User.region, Diagnosis.disease_id, Diagnosis.created_at).join(
+        User, Diagnosis.user_id == User.id
+    ).order_by(Diagnosis.created_at).all()
+    db.close()
+    return rows, set()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--regions", type=int, default=4000)
+    parser.add_argument("--diseases", type=int, default=38)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--events-per-hour", type=int, default=3000)
+    parser.add_argument("--spikes", type=int, default=50)
+    parser.add_argument("--max-series", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.database_url:
+        events, injected = _db_stream(args.database_url)
+    else:
+        events, injected = _synthetic_stream(args.regions, args.diseases, args.days,
+                                             args.events_per_hour, args.spikes, args.seed)
+
+    detector = OutbreakDetector(max_series=args.max_series)
+    flagged = set()
+
+    t0 = time.perf_counter()
+    for region, disease, ts in events:
+        alert = detector.observe(region, disease, ts)
+        if alert:
+            flagged.add((alert["region"], alert["disease_id"]))
+    elapsed = time.perf_counter() - t0
+
+    # Second pass purely for memory: tracemalloc distorts timings
+    tracemalloc.start()
+    OutbreakDetector(max_series=args.max_series).replay(events)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = {
+        "events": len(events),
+        "elapsed_s": round(elapsed, 3),
+        "events_per_s": round(len(events) / elapsed) if elapsed else None,
+        "us_per_event": round(elapsed / max(1, len(events)) * 1e6, 2),
+        "detector_peak_mb": round(peak / 1e6, 1),
+        "detector": detector.stats(),
+        "flagged_series": len(flagged),
+    }
+    if injected:
+        hits = len(injected & flagged)
+        report["injected_outbreaks"] = len(injected)
+        report["recall"] = round(hits / len(injected), 3)
+        report["false_alert_series"] = len(flagged - injected)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+What happens to /analyze when offered more load than it can serve?
+
+Drives the app in-process (ASGI transport, fake Gemini as in run_pipeline)
+with an open-loop arrival rate well above capacity, twice: once with the
+configured admission limits and once with them lifted. For each run it
+reports the latency of admitted (200) requests, how many were turned away
+with 429/503, how fast the rejections came back, and their Retry-After
+values. With admission on, admitted p99 should stay near the unloaded
+latency; without it every request queues and p99 grows with the backlog.
+
+All requests come from one client address, so the per-caller rate limit is
+off unless --rate-per-minute is given.
+
+Run from the backend directory:
+    python -m benchmarks.bench_overload --rps 80 --seconds 20 --gemini-latency-ms 900
+    python -m benchmarks.bench_overload --routing-policy local_only --rps 200 --max-in-flight-local 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fake_gemini import start_fake_gemini
+from benchmarks.run_pipeline import _server_env, percentile
+
+_UNLIMITED = 1 << 20
+
+
+async def _open_loop(client: httpx.AsyncClient, corpus: List[Dict], rps: float, seconds: float) -> Dict:
+    admitted: List[float] = []
+    rejected: List[float] = []
+    statuses: Counter = Counter()
+    retry_after: Counter = Counter()
+
+    async def one(i: int):
+        item = corpus[i % len(corpus)]
+        t0 = time.perf_counter()
+        try:
+            res = await client.post("/analyze", files={"image": (item["name"], item["bytes"], item["mime"])},
+                                    data={"cropType": "auto", "mode": "beginner"})
+        except httpx.HTTPError as e:
+            statuses[type(e).__name__] += 1
+            return
+        elapsed = (time.perf_counter() - t0) * 1000
+        statuses[str(res.status_code)] += 1
+        if res.status_code == 200:
+            admitted.append(elapsed)
+        elif res.status_code in (429, 503):
+            rejected.append(elapsed)
+            retry_after[res.headers.get("retry-after", "missing")] += 1
+
+    # Open loop: arrivals keep coming at the offered rate no matter how slowly the server answers
+    tasks, started = [], time.perf_counter()
+    for i in range(int(rps * seconds)):
+        delay = started + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i)))
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+
+    admitted.sort()
+    rejected.sort()
+
+    def summary(values: List[float]) -> Dict:
+        if not values:
+            return {"count": 0}
+        return {"count": len(values), "p50": round(percentile(values, 50), 1),
+                "p99": round(percentile(values, 99), 1), "max": round(values[-1], 1)}
+
+    return {
+        "offered": len(tasks),
+        "wall_s": round(wall, 2),
+        "goodput_rps": round(len(admitted) / wall, 2),
+        "status_counts": dict(statuses),
+        "admitted_ms": summary(admitted),
+        "rejected_ms": summary(rejected),
+        "retry_after_s": dict(retry_after),
+    }
+
+
+async def _run(corpus: List[Dict], args) -> List[Dict]:
+    from app.config import settings
+    from app.main import app
+
+    limits = {
+        "admission_rate_per_minute": args.rate_per_minute,
+        "admission_max_in_flight_gemini": args.max_in_flight_gemini or settings.admission_max_in_flight_gemini,
+        "admission_max_in_flight_local": args.max_in_flight_local or settings.admission_max_in_flight_local,
+        "admission_max_queue": settings.admission_max_queue,
+        "admission_queue_timeout_s": settings.admission_queue_timeout_s,
+    }
+    lifted = {"admission_rate_per_minute": 0.0, "admission_max_in_flight_gemini": _UNLIMITED,
+              "admission_max_in_flight_local": _UNLIMITED, "admission_max_queue": _UNLIMITED,
+              "admission_queue_timeout_s": 3600.0}
+
+    runs = []
+    # Unbounded concurrency eventually fails inside the app (e.g. DB pool timeouts); count those as 500s
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+        for name, values in (("admission", limits), ("no_admission", lifted)):
+            for key, value in values.items():
+                setattr(settings, key, value)
+            await _open_loop(client, corpus, 2, 2)  # warm up at a rate the server can keep up with
+            result = await _open_loop(client, corpus, args.rps, args.seconds)
+            runs.append({"run": name, **result})
+            print(f"{name}: admitted p50={result['admitted_ms'].get('p50')}ms "
+                  f"p99={result['admitted_ms'].get('p99')}ms {result['status_counts']}")
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=80.0, help="Offered arrival rate")
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--routing-policy", default="gemini_first", choices=("gemini_first", "cascade", "local_only"))
+    parser.add_argument("--cascade-threshold", type=float, default=None)
+    parser.add_argument("--rate-per-minute", type=float, default=0.0, help="Per-caller limit (default: off)")
+    parser.add_argument("--max-in-flight-gemini", type=int, default=None)
+    parser.add_argument("--max-in-flight-local", type=int, default=None)
+    parser.add_argument("--gemini-latency-ms", type=float, default=900)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--images", type=int, default=12)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    corpus = build_corpus(sizes=((640, 480), (1280, 960)), formats=("JPEG",), per_combo=max(1, args.images // 2),
+                          seed=args.seed)
+    gemini_server, _ = start_fake_gemini(0, latency_ms=args.gemini_latency_ms, jitter_ms=args.gemini_jitter_ms,
+                                         seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix="plantcare-overload-")
+    os.environ.update(_server_env(workdir, f"http://127.0.0.1:{gemini_server.server_port}", args))
+    os.chdir(workdir)  # uploads/ lands in the scratch directory, not the repo
+    try:
+        runs = asyncio.run(_run(corpus, args))
+    finally:
+        gemini_server.shutdown()
+    print(json.dumps({"offered_rps": args.rps, "seconds": args.seconds, "routing_policy": args.routing_policy,
+                      "runs": runs}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+What the image-quality gate rejects, what it costs, and what it saves.
+
+Starts from a set of usable photos: the synthetic leaf corpus plus, with
+--photos, real uploads (unreadable files are skipped). Each one is also
+degraded into the photos the gate is meant to stop: motion/focus blur, an
+underexposed and an overexposed shot, a thumbnail, and two plant-free
+variants (grayscale, and hue-rotated so the leaf turns blue-magenta).
+
+Reports, per category, how many images the gate rejected and with which
+code. Rejections among the usable photos are false rejects; rejections among
+the degraded ones are Gemini calls saved under gemini_first (one per image),
+priced at --cost-per-call. Gate latency is measured per image on the raw
+upload bytes, decode included.
+
+Run from the backend directory:
+    python -m benchmarks.bench_quality_gate
+    python -m benchmarks.bench_quality_gate --photos 'uploads/*' --repeat 5
+"""
+import argparse
+import glob
+import io
+import json
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+from benchmarks.corpus import build_corpus, encode
+
+
+def _hue_rotate(img: Image.Image) -> Image.Image:
+    h, s, v = img.convert("HSV").split()
+    h = h.point(lambda x: (x + 128) % 256)
+    return Image.merge("HSV", (h, s, v)).convert("RGB")
+
+
+DEGRADATIONS = {
+    "blurred": lambda img: img.filter(ImageFilter.GaussianBlur(radius=max(img.size) / 100)),
+    "dark": lambda img: ImageEnhance.Brightness(img).enhance(0.12),
+    "overexposed": lambda img: ImageEnhance.Brightness(img).enhance(4.0),
+    "thumbnail": lambda img: img.resize((max(1, img.width * 120 // max(img.size)),
+                                         max(1, img.height * 120 // max(img.size)))),
+    "grayscale": lambda img: img.convert("L").convert("RGB"),
+    "hue_rotated": _hue_rotate,
+}
+
+
+def _load_photos(pattern: str):
+    photos = []
+    for path in sorted(glob.glob(pattern)):
+        try:
+            img = Image.open(path)
+            img.load()
+        except Exception:
+            continue
+        photos.append((path, img.convert("RGB")))
+    return photos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--photos", default=None, help="Glob of real photos to add to the usable set")
+    parser.add_argument("--per-combo", type=int, default=4, help="Synthetic leaves per corpus size")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed gate runs per image")
+    parser.add_argument("--cost-per-call", type=float, default=0.0004, help="USD per Gemini vision call")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    from app.services.image_quality import assess_image
+
+    usable = [(item["name"], Image.open(io.BytesIO(item["bytes"])).convert("RGB"))
+              for item in build_corpus(formats=("JPEG",), per_combo=args.per_combo, seed=args.seed)]
+    if args.photos:
+        usable += _load_photos(args.photos)
+
+    samples = [("usable", name, encode(img, "JPEG")) for name, img in usable]
+    for category, degrade in DEGRADATIONS.items():
+        samples += [(category, name, encode(degrade(img), "JPEG")) for name, img in usable]
+
+    assess_image(samples[0][2])  # warm up OpenCV
+    verdicts = defaultdict(Counter)
+    timings = []
+    false_rejects = []
+    for category, name, image_bytes in samples:
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            report = assess_image(image_bytes)
+            timings.append(time.perf_counter() - started)
+        verdicts[category][report["code"] or "passed"] += 1
+        if category == "usable" and not report["ok"]:
+            false_rejects.append({"name": name, "code": report["code"], "checks": report["checks"]})
+
+    degraded = sum(sum(v.values()) for c, v in verdicts.items() if c != "usable")
+    caught = sum(n for c, v in verdicts.items() if c != "usable" for code, n in v.items() if code != "passed")
+    report = {
+        "usable_images": len(usable),
+        "degraded_images": degraded,
+        "verdicts": {category: dict(counts) for category, counts in verdicts.items()},
+        "false_reject_rate": round(len(false_rejects) / len(usable), 4),
+        "false_rejects": false_rejects,
+        "degraded_catch_rate": round(caught / degraded, 4),
+        "gemini_calls_saved": caught,
+        "gemini_cost_saved_usd": round(caught * args.cost_per_call, 4),
+        "gate_latency_ms": {
+            "p50": round(float(np.percentile(timings, 50)) * 1000, 3),
+            "p99": round(float(np.percentile(timings, 99)) * 1000, 3),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
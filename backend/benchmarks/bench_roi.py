@@ -0,0 +1,177 @@
+"""
+What leaf ROI cropping does to predictions, Gemini payloads and latency.
+
+Each leaf photo (--samples, a PlantVillage-style directory with one
+subdirectory per class, else the synthetic corpus) is pasted at a random
+spot into a larger field scene (--scene, soil-coloured noise with clutter)
+at --leaf-fraction of the scene's shorter side: the small-leaf-in-a-big-
+photo case. Then, per scene:
+
+  predictions  MobileNetV2 on the leaf photo alone (reference), on the
+               whole scene squashed to the input size, and on the ROI crop
+               of the full-resolution scene. Reported as agreement with the
+               reference and, when the folder names give labels (as in
+               bench_backends), as accuracy.
+  localization IoU of the ROI box with where the photo was pasted
+  payload      scene as a phone JPEG vs the Gemini payload from gemini_image
+  latency      added by locate + crop on the decoded scene, and by building
+               the Gemini payload from the upload bytes
+
+Run from the backend directory:
+    python -m benchmarks.bench_roi --images 30
+    python -m benchmarks.bench_roi --samples data/plantvillage/val --images 300 --backend onnx
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from benchmarks.bench_backends import BACKEND_DIR, DEFAULT_MODEL_PATHS, _parse_spec
+from benchmarks.corpus import build_corpus, encode
+
+
+def _scene_background(width: int, height: int, rng: random.Random) -> Image.Image:
+    base = np.array([rng.randint(90, 140), rng.randint(70, 100), rng.randint(40, 70)], dtype=np.int16)
+    # Soil grain at 1/8 scale, blown up so it costs nothing at 12 MP
+    grain = np.random.default_rng(rng.randint(0, 2 ** 31)).integers(-30, 30, (height // 8, width // 8, 1))
+    img = Image.fromarray(np.clip(base + grain, 0, 255).astype(np.uint8)).resize((width, height), Image.BILINEAR)
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):  # stones and dry debris
+        x, y, r = rng.randint(0, width), rng.randint(0, height), rng.randint(4, max(5, width // 60))
+        shade = tuple(int(c) + rng.randint(-50, 50) for c in base)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=shade)
+    return img.filter(ImageFilter.GaussianBlur(radius=1))
+
+
+def _load_leaves(root, limit, seed, manifest):
+    if root is None:
+        corpus = build_corpus(sizes=((640, 480), (1280, 960)), formats=("JPEG",), per_combo=limit // 2 or 1,
+                              seed=seed)
+        return [(Image.open(io.BytesIO(item["bytes"])).convert("RGB"), None) for item in corpus[:limit]]
+
+    from app.model.convert_tflite import find_images
+    from app.model.inference import decode_image
+    classes = list(manifest.classes)
+    class_dirs = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    label_of = {d: i for i, d in enumerate(class_dirs)} if len(class_dirs) == len(classes) \
+        else {d: classes.index(d) for d in class_dirs if d in classes}
+    paths = find_images(root)
+    random.Random(seed).shuffle(paths)
+    leaves = []
+    for path in paths[:limit]:
+        with open(path, "rb") as f:
+            try:
+                img = decode_image(f.read())
+            except ValueError:
+                continue
+        leaves.append((img, label_of.get(os.path.relpath(path, root).split(os.sep)[0])))
+    return leaves
+
+
+def _iou(a, b) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+def _pct(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="keras", help="name[:model path], as in bench_backends")
+    parser.add_argument("--samples", default=None)
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--scene", default="4032x3024", help="WxH of the field photo")
+    parser.add_argument("--leaf-fraction", type=float, default=0.3,
+                        help="Leaf photo's longer side as a share of the scene's shorter side")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    from app.model.backends import create_backend
+    from app.model.inference import decode_image, image_to_tensor
+    from app.model.manifest import load_manifest
+    from app.services.leaf_roi import gemini_image, locate_leaf
+
+    name, path = _parse_spec(args.backend)
+    model_path = os.path.join(BACKEND_DIR, path or DEFAULT_MODEL_PATHS[name])
+    backend = create_backend(name, model_path=model_path)
+    manifest = load_manifest(model_path)
+    width, height = (int(v) for v in args.scene.split("x"))
+    rng = random.Random(args.seed)
+
+    def predict(img):
+        return int(np.argmax(backend.predict(image_to_tensor(img, manifest)[None])[0]))
+
+    leaves = _load_leaves(args.samples, args.images, args.seed, manifest)
+    predict(leaves[0][0])  # warm up
+    rows, roi_timings, payload_timings = [], [], []
+    upload_bytes, payload_bytes = [], []
+    for leaf, label in leaves:
+        scale = args.leaf_fraction * min(width, height) / max(leaf.size)
+        leaf = leaf.resize((round(leaf.width * scale), round(leaf.height * scale)), Image.BILINEAR)
+        scene = _scene_background(width, height, rng)
+        x, y = rng.randint(0, width - leaf.width), rng.randint(0, height - leaf.height)
+        scene.paste(leaf, (x, y))
+        upload = encode(scene, "JPEG")
+        decoded = decode_image(upload)
+
+        started = time.perf_counter()
+        box = locate_leaf(decoded)
+        roi = decoded.crop(box) if box else decoded
+        roi_timings.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        payload, _ = gemini_image(upload)
+        payload_timings.append(time.perf_counter() - started)
+        upload_bytes.append(len(upload))
+        payload_bytes.append(len(payload))
+
+        rows.append({
+            "label": label,
+            "reference": predict(leaf),
+            "full_frame": predict(decoded),
+            "roi": predict(roi),
+            "iou": _iou(box, (x, y, x + leaf.width, y + leaf.height)) if box else 0.0,
+        })
+
+    def agreement(key):
+        return round(float(np.mean([r[key] == r["reference"] for r in rows])), 4)
+
+    labeled = [r for r in rows if r["label"] is not None]
+    report = {
+        "backend": backend.describe(),
+        "images": len(rows),
+        "scene": args.scene,
+        "leaf_fraction": args.leaf_fraction,
+        "agreement_with_leaf_photo": {"full_frame": agreement("full_frame"), "roi": agreement("roi")},
+        "localization": {
+            "cropped": sum(1 for r in rows if r["iou"] > 0),
+            "mean_iou": round(float(np.mean([r["iou"] for r in rows])), 3),
+        },
+        "gemini_payload": {
+            "upload_kb_mean": round(float(np.mean(upload_bytes)) / 1024, 1),
+            "payload_kb_mean": round(float(np.mean(payload_bytes)) / 1024, 1),
+            "saved": round(1 - sum(payload_bytes) / sum(upload_bytes), 4),
+        },
+        "added_latency_ms": {
+            "locate_and_crop": {"p50": _pct(roi_timings, 50), "p99": _pct(roi_timings, 99)},
+            "gemini_payload": {"p50": _pct(payload_timings, 50), "p99": _pct(payload_timings, 99)},
+        },
+    }
+    if labeled:
+        report["accuracy"] = {key: round(float(np.mean([r[key] == r["label"] for r in labeled])), 4)
+                              for key in ("reference", "full_frame", "roi")}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
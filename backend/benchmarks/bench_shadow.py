@@ -0,0 +1,100 @@
+"""
+Does shadowing a candidate model cost production latency?
+
+Runs the same closed-loop load (N threads calling run_inference on the
+synthetic corpus) three times: no shadow, shadow at --fraction with the
+configured rate limits, and shadow with the limits lifted. For each it
+reports production p50/p99 and the shadow outcome counts. The first two
+p99s should match; the third shows what the limits prevent.
+
+Run from the backend directory:
+    python -m benchmarks.bench_shadow --candidate weights/model.keras --threads 8 --seconds 20
+"""
+import argparse
+import json
+import threading
+import time
+from typing import Dict, List
+
+from benchmarks.corpus import build_corpus
+
+
+def _drive(images: List[bytes], threads: int, seconds: float) -> List[float]:
+    from app.model.inference import run_inference
+
+    latencies: List[float] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop(offset: int):
+        local, i = [], offset
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            run_inference(images[i % len(images)])
+            local.append((time.perf_counter() - t0) * 1000)
+            i += threads
+        with lock:
+            latencies.extend(local)
+
+    pool = [threading.Thread(target=loop, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return sorted(latencies)
+
+
+def _offers() -> Dict[str, float]:
+    from app.model.shadow import SHADOW_OFFERS
+
+    return {outcome: SHADOW_OFFERS.value(outcome=outcome)
+            for outcome in ("queued", "busy", "rate_limited", "queue_full", "incompatible", "error")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidate", default=None, help="Candidate weights (default: the production weights)")
+    parser.add_argument("--fraction", type=float, default=1.0)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--images", type=int, default=24)
+    args = parser.parse_args()
+
+    from app.config import settings
+    from app.model.loader import load_model, models
+    from app.model.shadow import shadow_evaluator
+
+    corpus = build_corpus(sizes=((640, 480), (1280, 960)), formats=("JPEG",), per_combo=max(1, args.images // 2))
+    images = [item["bytes"] for item in corpus][: args.images]
+    models.get()
+    _drive(images, args.threads, 2.0)  # warm up
+
+    candidate = load_model(settings.inference_backend, args.candidate)
+    limits = (settings.shadow_max_per_second, settings.shadow_max_active_requests)
+    runs = []
+    for name in ("baseline", "shadow", "shadow_unlimited"):
+        if name == "baseline":
+            models.clear_shadow()
+        else:
+            models.set_shadow(candidate, args.fraction)
+        if name == "shadow_unlimited":
+            settings.shadow_max_per_second, settings.shadow_max_active_requests = 1e9, 1 << 30
+        before = _offers()
+        latencies = _drive(images, args.threads, args.seconds)
+        after = _offers()
+        runs.append({
+            "run": name,
+            "requests": len(latencies),
+            "p50_ms": round(latencies[len(latencies) // 2], 2),
+            "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+            "shadow_offers": {k: int(after[k] - before[k]) for k in after if after[k] - before[k]},
+        })
+    settings.shadow_max_per_second, settings.shadow_max_active_requests = limits
+    time.sleep(1.0)  # let queued shadow work finish before summarizing
+    print(json.dumps({"threads": args.threads, "fraction": args.fraction,
+                      "limits": {"max_per_second": limits[0], "max_active_requests": limits[1]},
+                      "runs": runs, "shadow_evaluation": shadow_evaluator.describe()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
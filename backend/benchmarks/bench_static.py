@@ -0,0 +1,204 @@
+"""
+Throughput of /static (app/services/static_files.py) against a naive FileResponse route.
+
+Spawns one uvicorn worker serving a scratch upload directory two ways:
+
+  static  the UploadedFiles app, mounted at /static as in app/main.py
+  naive   @app.get("/naive/{name}") returning FileResponse(path), the
+          obvious implementation: a threadpool stat, open and chunked read
+          per request, no caching headers of its own
+
+Then --clients processes, each holding --connections keep-alive
+connections, fetch random images from the corpus for --seconds per
+scenario:
+
+  full        plain GETs
+  revalidate  GETs with If-None-Match set to the ETag the target sent
+              (a 304 for static, the whole file again for naive)
+  range       GETs for the first 64 KB (Range: bytes=0-65535)
+  variant     static only: ?w=256 thumbnails, after one cold build per
+              image, whose latency is reported separately
+
+Per target and scenario it reports requests/s, MB/s of bodies, p50/p99
+latency and the status codes. The clients share the machine with the
+server, so compare the targets against each other rather than reading the
+absolute numbers as capacity.
+
+Run from the backend directory:
+    python -m benchmarks.bench_static
+    python -m benchmarks.bench_static --clients 2 --connections 32 --seconds 10 --images 200
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+import numpy as np
+
+from benchmarks.corpus import build_corpus
+from benchmarks.run_pipeline import BACKEND_DIR, _free_port
+
+_RANGE = "bytes=0-65535"
+
+
+def build_app():
+    """The server side: uvicorn benchmarks.bench_static:build_app --factory."""
+    from fastapi import FastAPI
+    from fastapi.responses import FileResponse
+
+    from app.config import settings
+    from app.services.static_files import UploadedFiles
+
+    app = FastAPI()
+
+    @app.get("/naive/{name}")
+    def naive(name: str):
+        return FileResponse(os.path.join(settings.upload_dir, name))
+
+    app.mount("/static", UploadedFiles(), name="static")
+    return app
+
+
+async def _fetch(reader, writer, request: bytes):
+    writer.write(request)
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head[9:12])
+    length = 0
+    for line in head.split(b"\r\n")[1:]:
+        key, _, value = line.partition(b":")
+        if key.strip().lower() == b"content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status, length
+
+
+async def _client(port, requests, connections, seconds, seed):
+    rng = random.Random(seed)
+    latencies, statuses, body_bytes = [], Counter(), 0
+    deadline = time.perf_counter() + seconds
+
+    async def connection():
+        nonlocal body_bytes
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, limit=2 ** 20)
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status, length = await _fetch(reader, writer, rng.choice(requests))
+                latencies.append(time.perf_counter() - started)
+                statuses[status] += 1
+                body_bytes += length
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(connection() for _ in range(connections)))
+    return latencies, statuses, body_bytes
+
+
+def _run_client(job):
+    return asyncio.run(_client(*job))
+
+
+def _request(path, headers=None):
+    lines = [f"GET {path} HTTP/1.1", "Host: bench"] + [f"{k}: {v}" for k, v in (headers or {}).items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def _get(port, path, headers=None):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", headers=headers or {})
+    with urllib.request.urlopen(request) as response:
+        return response.headers, response.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--sizes", default="1280x960,2000x1500,4032x3024")
+    parser.add_argument("--clients", type=int, default=2, help="Client processes")
+    parser.add_argument("--connections", type=int, default=16, help="Keep-alive connections per client process")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="plantcare-static-")
+    upload_dir = os.path.join(workdir, "uploads")
+    os.environ["UPLOAD_DIR"] = upload_dir
+    from app.services.storage import upload_mock_s3
+
+    sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+    per_combo = max(1, args.images // len(sizes))
+    names = [upload_mock_s3(item["bytes"], item["name"]).rsplit("/", 1)[-1]
+             for item in build_corpus(sizes=sizes, formats=("JPEG",), per_combo=per_combo, seed=args.seed)]
+    file_sizes = [os.path.getsize(os.path.join(upload_dir, name)) for name in names]
+
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.bench_static:build_app", "--factory", "--app-dir", BACKEND_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env={**os.environ, "UPLOAD_DIR": upload_dir},
+    )
+    report = {"images": len(names), "mean_image_kb": round(float(np.mean(file_sizes)) / 1024, 1),
+              "clients": args.clients, "connections": args.clients * args.connections, "targets": {}}
+    try:
+        for _ in range(300):
+            try:
+                _get(port, f"/static/{names[0]}")
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("Benchmark server never came up")
+
+        cold = []
+        for name in names:
+            started = time.perf_counter()
+            _get(port, f"/static/{name}?w=256")
+            cold.append(time.perf_counter() - started)
+        report["variant_cold_build_ms"] = {"p50": round(float(np.percentile(cold, 50)) * 1000, 1),
+                                           "p99": round(float(np.percentile(cold, 99)) * 1000, 1)}
+
+        targets = {"static": "/static/{}", "naive": "/naive/{}"}
+        for target, pattern in targets.items():
+            etags = {name: _get(port, pattern.format(name))[0]["etag"] for name in names}
+            scenarios = {
+                "full": [_request(pattern.format(name)) for name in names],
+                "revalidate": [_request(pattern.format(name), {"If-None-Match": etags[name]}) for name in names],
+                "range": [_request(pattern.format(name), {"Range": _RANGE}) for name in names],
+            }
+            if target == "static":
+                scenarios["variant"] = [_request(pattern.format(name) + "?w=256") for name in names]
+            results = {}
+            for scenario, requests in scenarios.items():
+                jobs = [(port, requests, args.connections, args.seconds, args.seed + i) for i in range(args.clients)]
+                with multiprocessing.Pool(args.clients) as pool:
+                    outputs = pool.map(_run_client, jobs)
+                latencies = [value for output in outputs for value in output[0]]
+                statuses = sum((output[1] for output in outputs), Counter())
+                body_bytes = sum(output[2] for output in outputs)
+                results[scenario] = {
+                    "rps": round(len(latencies) / args.seconds),
+                    "mb_per_s": round(body_bytes / args.seconds / 2 ** 20, 1),
+                    "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                    "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 2),
+                    "statuses": {str(code): count for code, count in sorted(statuses.items())},
+                }
+            report["targets"][target] = results
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
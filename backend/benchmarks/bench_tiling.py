@@ -0,0 +1,138 @@
+"""
+Cost of tiled inference and how well the adaptive tile budget holds.
+
+Runs the single-image inference path (_run_inference: decode, ROI view,
+tiles, one forward pass, merge) over the corpus with tiling off, then on
+at each --budgets value. Per budget it reports the tiles chosen per image
+size, the forward time the tiles added over the untiled pass (which the
+budget bounds), the tile preparation time, end-to-end p50/p99, and how
+often regions and the multi-disease warning came out. The per-view cost
+the budget is based on is warmed up with a few requests first, as in a
+running worker; --view-cost-ms emulates a slower model on top of the one
+loaded. Also checks that the tile grid is a view into the resized
+image rather than a copy.
+
+Detection quality needs real weights and photos with known lesions; with
+the stand-in model only the cost side is meaningful.
+
+Run from the backend directory:
+    python -m benchmarks.bench_tiling --backend keras --budgets 50,150,300
+    python -m benchmarks.bench_tiling --view-cost-ms 8 --per-size 3
+    python -m benchmarks.bench_tiling --backend onnx --sizes 1280x960,4032x3024
+"""
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmarks.bench_backends import BACKEND_DIR, DEFAULT_MODEL_PATHS, _parse_spec
+from benchmarks.corpus import build_corpus
+
+
+def _pct(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 2) if samples else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="keras", help="name[:model path], as in bench_backends")
+    parser.add_argument("--budgets", default="50,150,300", type=lambda v: [float(b) for b in v.split(",")],
+                        help="Comma-separated tile_latency_budget_ms values")
+    parser.add_argument("--sizes", default="640x480,1280x960,2000x2000,4032x3024")
+    parser.add_argument("--per-size", type=int, default=5)
+    parser.add_argument("--view-cost-ms", type=float, default=0.0,
+                        help="Extra forward time per view, to emulate a slower model than the one loaded")
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    from app.config import settings
+    from app.model import inference
+    from app.model.loader import load_model
+    from app.model.tiling import image_tiles
+
+    name, path = _parse_spec(args.backend)
+    model = load_model(name, os.path.join(BACKEND_DIR, path or DEFAULT_MODEL_PATHS[name]))
+    sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+    corpus = build_corpus(sizes=sizes, formats=("JPEG",), per_combo=args.per_size, seed=args.seed)
+
+    # Time every forward pass the inference path makes
+    forward_times = []
+    forward = inference._forward
+
+    def timed_forward(loaded, batch):
+        started = time.perf_counter()
+        result = forward(loaded, batch)
+        time.sleep(len(batch) * args.view_cost_ms / 1000)
+        forward_times.append(time.perf_counter() - started)
+        return result
+
+    inference._forward = timed_forward
+
+    def run(item):
+        forward_times.clear()
+        started = time.perf_counter()
+        result = inference._run_inference(model, item["bytes"])
+        return result, time.perf_counter() - started, sum(forward_times)
+
+    settings.tiled_inference = False
+    for item in corpus[:3]:
+        run(item)  # warm up, and seed the per-view cost
+    untiled_forward = {}
+    untiled_total = []
+    for item in corpus:
+        _, total, forward_s = run(item)
+        untiled_forward[item["name"]] = forward_s
+        untiled_total.append(total)
+
+    report = {
+        "backend": model.backend.describe(),
+        "images": len(corpus),
+        "untiled_ms": {"p50": _pct(untiled_total, 50), "p99": _pct(untiled_total, 99)},
+        "budgets": {},
+    }
+    settings.tiled_inference = True
+    for budget in args.budgets:
+        settings.tile_latency_budget_ms = budget
+        for item in corpus[:3]:
+            run(item)
+        tiles_by_size = defaultdict(list)
+        added, totals, prep = [], [], []
+        with_regions = multi = over_budget = 0
+        for item in corpus:
+            img = inference.decode_image(item["bytes"])
+            started = time.perf_counter()
+            image_tiles(img, model.manifest)
+            prep.append(time.perf_counter() - started)
+            result, total, forward_s = run(item)
+            tiles = result.get("tiles", {}).get("analyzed", 0)
+            tiles_by_size[f"{item['width']}x{item['height']}"].append(tiles)
+            extra = forward_s - untiled_forward[item["name"]]
+            added.append(extra)
+            over_budget += extra * 1000 > budget
+            totals.append(total)
+            with_regions += bool(result.get("tiles") and result["heatmap"])
+            multi += result["multi_disease"]
+        report["budgets"][str(budget)] = {
+            "tiles_per_image": {size: round(float(np.mean(t)), 1) for size, t in tiles_by_size.items()},
+            "added_forward_ms": {"p50": _pct(added, 50), "p99": _pct(added, 99)},
+            "over_budget": over_budget,
+            "tile_prep_ms": {"p50": _pct(prep, 50), "p99": _pct(prep, 99)},
+            "end_to_end_ms": {"p50": _pct(totals, 50), "p99": _pct(totals, 99)},
+            "images_with_regions": with_regions,
+            "multi_disease_warnings": multi,
+        }
+
+    plan = image_tiles(inference.decode_image(corpus[-1]["bytes"]), model.manifest)
+    if plan:
+        grid = sliding_window_view(plan["image"], (plan["size"], plan["size"], 3))[::plan["stride"], ::plan["stride"], 0]
+        report["tile_grid_is_view"] = bool(np.shares_memory(grid, plan["image"]))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
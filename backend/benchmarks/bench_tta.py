@@ -0,0 +1,96 @@
+"""
+Per-request cost of test-time augmentation.
+
+For each image, compares one decode + single-view forward pass against the
+"flip" and "full" TTA modes (one decode, vectorized views, one batched
+forward pass) and against the naive alternative of N separate
+single-image forward passes. Also reports how often TTA changes the top
+class and how much it moves the confidence.
+
+Run from the backend directory:
+    python -m benchmarks.bench_tta --backend keras --images 50
+    python -m benchmarks.bench_tta --backend onnx:weights/model.onnx --threads 2
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.bench_backends import BACKEND_DIR, DEFAULT_MODEL_PATHS, _parse_spec
+from benchmarks.corpus import build_corpus
+
+
+def _median_ms(samples):
+    return round(float(np.median(samples)) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="keras", help="name[:model path], as in bench_backends")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--images", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    from app.model.backends import create_backend
+    from app.model.inference import _aggregate_views, decode_image, image_to_tensor, tta_views
+    from app.model.manifest import load_manifest
+
+    name, path = _parse_spec(args.backend)
+    model_path = os.path.join(BACKEND_DIR, path or DEFAULT_MODEL_PATHS[name])
+    backend = create_backend(name, model_path=model_path, num_threads=args.threads)
+    manifest = load_manifest(model_path)
+    corpus = build_corpus(sizes=((640, 480), (1280, 960), (2000, 2000)), formats=("JPEG",),
+                          per_combo=max(1, args.images // 3), seed=args.seed)[: args.images]
+    backend.predict(tta_views(decode_image(corpus[0]["bytes"]), "full", manifest))  # warm up every batch shape
+    backend.predict(tta_views(decode_image(corpus[0]["bytes"]), "flip", manifest))
+    backend.predict(image_to_tensor(decode_image(corpus[0]["bytes"]), manifest)[None])
+
+    timings = {"single": [], "flip": [], "full": [], "full_naive": []}
+    changed = {"flip": 0, "full": 0}
+    confidence_shift = {"flip": [], "full": []}
+    agreement = {"flip": [], "full": []}
+    for item in corpus:
+        t0 = time.perf_counter()
+        single = backend.predict(image_to_tensor(decode_image(item["bytes"]), manifest)[None])
+        timings["single"].append(time.perf_counter() - t0)
+        single_index, single_conf, _ = _aggregate_views(single)
+
+        for mode in ("flip", "full"):
+            t0 = time.perf_counter()
+            views = tta_views(decode_image(item["bytes"]), mode, manifest)
+            preds = backend.predict(views)
+            index, confidence, tta = _aggregate_views(preds)
+            timings[mode].append(time.perf_counter() - t0)
+            changed[mode] += int(index != single_index)
+            confidence_shift[mode].append(confidence - single_conf)
+            agreement[mode].append(tta["agreement"])
+
+        # What TTA would cost without batching: one forward pass per view
+        t0 = time.perf_counter()
+        views = tta_views(decode_image(item["bytes"]), "full", manifest)
+        for view in views:
+            backend.predict(view[None])
+        timings["full_naive"].append(time.perf_counter() - t0)
+
+    single_ms = _median_ms(timings["single"])
+    report = {"backend": backend.describe(), "images": len(corpus), "single_view_ms": single_ms, "modes": {}}
+    for mode, views in (("flip", 2), ("full", 8)):
+        ms = _median_ms(timings[mode])
+        report["modes"][mode] = {
+            "views": views,
+            "ms_per_request": ms,
+            "overhead_x_single": round(ms / single_ms, 2),
+            "naive_x_single_equivalent": views,
+            "top_class_changed": changed[mode],
+            "mean_confidence_shift": round(float(np.mean(confidence_shift[mode])), 4),
+            "mean_view_agreement": round(float(np.mean(agreement[mode])), 3),
+        }
+    report["modes"]["full"]["unbatched_ms_per_request"] = _median_ms(timings["full_naive"])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Cold-start budget check for the API worker.
+
+Imports app.main in fresh interpreters under `python -X importtime` and
+fails (exit code 1) when the best-of-N import time exceeds the budget or
+when a module that must stay lazy (TensorFlow, the Gemini SDK, ONNX
+Runtime, the AVIF plugin) is imported at startup. Prints the slowest
+imports so a regression points at its cause.
+
+Run from the backend directory (e.g. in CI):
+    python -m benchmarks.check_startup --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must only be imported on first use, never by `import app.main`
+LAZY_MODULES = ("tensorflow", "keras", "google.generativeai", "onnxruntime", "tflite_runtime", "ai_edge_litert",
+                "pillow_avif", "cv2")
+
+_LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+_PROBE = """
+import os, time
+t0 = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - t0
+rss = 0
+try:
+    with open("/proc/self/status") as f:
+        rss = next(int(l.split()[1]) for l in f if l.startswith("VmRSS:")) / 1024
+except (OSError, StopIteration):
+    pass
+print("PROBE", round(elapsed * 1000, 1), round(rss, 1))
+"""
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    entries = []
+    for line in stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            entries.append({
+                "module": match.group(4),
+                "self_ms": int(match.group(1)) / 1000,
+                "cumulative_ms": int(match.group(2)) / 1000,
+                "depth": len(match.group(3)) // 2,
+            })
+    return entries
+
+
+def run_once(env: Dict[str, str]) -> Dict:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE], cwd=BACKEND_DIR, env=env,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app.main failed:\n{proc.stderr[-3000:]}")
+    probe = next(line for line in proc.stdout.splitlines() if line.startswith("PROBE"))
+    _, wall_ms, rss_mb = probe.split()
+    entries = parse_importtime(proc.stderr)
+    app_main = next((e for e in entries if e["module"] == "app.main"), None)
+    return {
+        "import_ms": app_main["cumulative_ms"] if app_main else float(wall_ms),
+        "wall_ms": float(wall_ms),
+        "rss_mb": float(rss_mb),
+        "entries": entries,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="Max import time of app.main (best of runs)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # app.main runs create_all at import; keep the probe away from the real database
+    scratch = tempfile.mkdtemp(prefix="plantcare-startup-")
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1",
+           "DATABASE_URL": f"sqlite:///{os.path.join(scratch, 'startup.db')}"}
+    runs = [run_once(env) for _ in range(args.runs)]
+    best = min(runs, key=lambda r: r["import_ms"])
+
+    imported = {e["module"] for e in best["entries"]}
+    leaked = sorted(m for m in imported if any(m == lazy or m.startswith(lazy + ".") for lazy in LAZY_MODULES))
+    # Top-level packages by cumulative time are the actionable view
+    packages: Dict[str, float] = {}
+    for e in best["entries"]:
+        if e["depth"] == 0 or e["module"].startswith("app."):
+            packages[e["module"]] = max(packages.get(e["module"], 0.0), e["cumulative_ms"])
+    slowest = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)[: args.top]
+
+    over_budget = best["import_ms"] > args.budget_ms
+    print(json.dumps({
+        "import_ms": round(best["import_ms"], 1),
+        "import_ms_all_runs": [round(r["import_ms"], 1) for r in runs],
+        "budget_ms": args.budget_ms,
+        "rss_mb": best["rss_mb"],
+        "modules_imported": len(imported),
+        "lazy_modules_imported": leaked,
+        "slowest": [{"module": m, "cumulative_ms": round(ms, 1)} for m, ms in slowest],
+        "ok": not over_budget and not leaked,
+    }, indent=2))
+
+    if leaked:
+        print(f"FAIL: app.main eagerly imports {', '.join(leaked)}", file=sys.stderr)
+    if over_budget:
+        print(f"FAIL: app.main import took {best['import_ms']:.0f}ms (budget {args.budget_ms:.0f}ms)", file=sys.stderr)
+    sys.exit(1 if (leaked or over_budget) else 0)
+
+
+if __name__ == "__main__":
+    main()
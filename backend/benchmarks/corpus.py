@@ -0,0 +1,111 @@
+"""
+Deterministic synthetic image corpus for pipeline benchmarks.
+
+Each image is a leaf-like green ellipse with brown lesions on a textured
+background, rendered at several sizes and encoded as JPEG/PNG/WEBP/AVIF
+(AVIF only when pillow-avif-plugin is installed).
+
+Write it to disk from the backend directory:
+    python -m benchmarks.corpus --out /tmp/plantcare-corpus
+"""
+import argparse
+import io
+import os
+import random
+from typing import Dict, List, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+DEFAULT_SIZES: Sequence[Tuple[int, int]] = ((224, 224), (640, 480), (1280, 960), (2000, 2000), (4032, 3024))
+DEFAULT_FORMATS: Sequence[str] = ("JPEG", "PNG", "WEBP", "AVIF")
+_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "AVIF": "image/avif"}
+_EXT = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "AVIF": "avif"}
+
+
+def available_formats(formats: Sequence[str] = DEFAULT_FORMATS) -> List[str]:
+    """Drop encoders this Pillow build can't write (AVIF needs the plugin)."""
+    if "AVIF" in formats:
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            pass
+    Image.init()
+    return [fmt for fmt in formats if fmt in Image.SAVE]
+
+
+def render_leaf(width: int, height: int, seed: int) -> Image.Image:
+    rng = random.Random(seed)
+    bg = (rng.randint(60, 140), rng.randint(50, 110), rng.randint(30, 80))
+    img = Image.new("RGB", (width, height), bg)
+    draw = ImageDraw.Draw(img)
+
+    # Background clutter
+    for _ in range(40):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        r = rng.randint(2, max(3, width // 20))
+        shade = tuple(max(0, min(255, c + rng.randint(-40, 40))) for c in bg)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=shade)
+
+    # Leaf: a large green ellipse, not always centred
+    cx = width * rng.uniform(0.35, 0.65)
+    cy = height * rng.uniform(0.35, 0.65)
+    rx = width * rng.uniform(0.2, 0.4)
+    ry = height * rng.uniform(0.25, 0.45)
+    green = (rng.randint(40, 90), rng.randint(120, 190), rng.randint(30, 70))
+    draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=green)
+    draw.line((cx, cy - ry, cx, cy + ry), fill=(160, 200, 120), width=max(1, width // 300))
+
+    # Lesions: brown/yellow spots inside the leaf
+    for _ in range(rng.randint(0, 25)):
+        lx = cx + rng.uniform(-0.7, 0.7) * rx
+        ly = cy + rng.uniform(-0.7, 0.7) * ry
+        lr = max(2, min(width, height) * rng.uniform(0.005, 0.03))
+        color = rng.choice([(120, 80, 30), (90, 60, 20), (200, 190, 60)])
+        draw.ellipse((lx - lr, ly - lr, lx + lr, ly + lr), fill=color)
+
+    return img.filter(ImageFilter.GaussianBlur(radius=max(0.5, width / 1500)))
+
+
+def encode(img: Image.Image, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    kwargs = {"quality": 85} if fmt in ("JPEG", "WEBP", "AVIF") else {}
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+
+def build_corpus(sizes: Sequence[Tuple[int, int]] = DEFAULT_SIZES,
+                 formats: Sequence[str] = DEFAULT_FORMATS,
+                 per_combo: int = 2, seed: int = 1234) -> List[Dict]:
+    """Returns [{name, format, mime, width, height, bytes}] covering every size x format combination."""
+    corpus = []
+    formats = available_formats(formats)
+    for width, height in sizes:
+        for i in range(per_combo):
+            img = render_leaf(width, height, seed + width * 31 + height * 17 + i)
+            for fmt in formats:
+                corpus.append({
+                    "name": f"leaf_{width}x{height}_{i}.{_EXT[fmt]}",
+                    "format": fmt,
+                    "mime": _MIME[fmt],
+                    "width": width,
+                    "height": height,
+                    "bytes": encode(img, fmt),
+                })
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--per-combo", type=int, default=2)
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for item in build_corpus(per_combo=args.per_combo):
+        with open(os.path.join(args.out, item["name"]), "wb") as f:
+            f.write(item["bytes"])
+        print(f"{item['name']}: {len(item['bytes'])} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Local stand-in for the Gemini generateContent REST API.
+
+Serves POST /v1beta/models/<model>:generateContent with a canned plant
+analysis after a configurable latency, and injects 500s and 429s either at
+random or once a requests-per-minute budget is exhausted. Point the backend
+at it with:
+    GEMINI_API_KEY=fake GEMINI_API_ENDPOINT=http://127.0.0.1:8765
+
+Run standalone from the backend directory:
+    python -m benchmarks.fake_gemini --port 8765 --latency-ms 900 --jitter-ms 300 --rpm 60
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+ANALYSES = [
+    {
+        "plant_name": "Tomato", "disease_name": "Early Blight", "disease_id": "tomato-early-blight",
+        "severity": "medium", "confidence": 0.92, "health_score": 58, "leaf_condition": 55,
+        "infection_severity": 45, "color_analysis": 60,
+    },
+    {
+        "plant_name": "Potato", "disease_name": "Late Blight", "disease_id": "potato-late-blight",
+        "severity": "high", "confidence": 0.88, "health_score": 35, "leaf_condition": 30,
+        "infection_severity": 70, "color_analysis": 40,
+    },
+    {
+        "plant_name": "Rose", "disease_name": "Healthy", "disease_id": "rose-healthy",
+        "severity": "low", "confidence": 0.95, "health_score": 96, "leaf_condition": 95,
+        "infection_severity": 0, "color_analysis": 94,
+    },
+]
+for _analysis in ANALYSES:
+    _analysis.update({
+        "beginner_description": f"This looks like {_analysis['plant_name']} ({_analysis['disease_name']}).",
+        "advanced_description": "Synthetic response from the local Gemini stand-in.",
+        "recommendations": ["Monitor new growth", "Improve airflow", "Water at the base"],
+        "treatment": {
+            "immediate": ["Remove affected leaves"], "organic": ["Neem oil"], "chemical": ["Copper fungicide"],
+            "prevention": ["Rotate crops"], "recoveryTimeline": "2-3 weeks",
+        },
+    })
+
+TREATMENT = {
+    "immediate_action": ["Remove affected leaves", "Isolate the plant", "Stop overhead watering"],
+    "organic_treatment": ["Neem oil spray", "Copper soap"],
+    "chemical_treatment": ["Chlorothalonil", "Mancozeb"],
+    "prevention": ["Rotate crops", "Mulch", "Space plants for airflow"],
+}
+
+
+class FakeGeminiConfig:
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 0, error_rate: float = 0.0,
+                 rate_429: float = 0.0, rpm: Optional[int] = None, malformed_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.rpm = rpm
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "malformed": 0}
+
+    def decide(self) -> str:
+        """Pick the outcome for one request: ok, error, rate_limited or malformed."""
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            if self.rpm is not None and self.window_count > self.rpm:
+                outcome = "rate_limited"
+            else:
+                roll = self.rng.random()
+                if roll < self.rate_429:
+                    outcome = "rate_limited"
+                elif roll < self.rate_429 + self.error_rate:
+                    outcome = "errors"
+                elif roll < self.rate_429 + self.error_rate + self.malformed_rate:
+                    outcome = "malformed"
+                else:
+                    outcome = "ok"
+            self.stats[outcome] += 1
+            return outcome
+
+    def delay(self) -> float:
+        with self.lock:
+            jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+
+def _make_handler(config: FakeGeminiConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request_body = self.rfile.read(length)
+            if ":generateContent" not in self.path:
+                self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                return
+
+            outcome = config.decide()
+            if outcome == "rate_limited":
+                self._send(429, {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).",
+                                           "status": "RESOURCE_EXHAUSTED"}})
+                return
+            time.sleep(config.delay())
+            if outcome == "errors":
+                self._send(500, {"error": {"code": 500, "message": "Internal error", "status": "INTERNAL"}})
+                return
+
+            # Vision requests carry inline image data; treatment prompts are text only
+            if b"inlineData" in request_body or b"inline_data" in request_body:
+                digest = int(hashlib.md5(request_body[-4096:]).hexdigest(), 16)
+                text = json.dumps(ANALYSES[digest % len(ANALYSES)])
+            else:
+                text = json.dumps(TREATMENT)
+            if outcome == "malformed":
+                text = "```json\n" + text[: len(text) // 2]
+
+            self._send(200, {
+                "candidates": [{
+                    "content": {"parts": [{"text": text}], "role": "model"},
+                    "finishReason": "STOP",
+                    "index": 0,
+                }],
+                "usageMetadata": {"promptTokenCount": 600, "candidatesTokenCount": 250, "totalTokenCount": 850},
+            })
+
+    return Handler
+
+
+def start_fake_gemini(port: int = 0, **config_kwargs):
+    """Start the stand-in on a background thread. Returns (server, config); the bound port is server.server_port."""
+    config = FakeGeminiConfig(**config_kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, config = start_fake_gemini(
+        args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_429=args.rate_429, rpm=args.rpm, malformed_rate=args.malformed_rate,
+    )
+    print(f"Fake Gemini listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(json.dumps(config.stats))
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
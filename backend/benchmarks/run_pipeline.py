@@ -0,0 +1,466 @@
+"""
+Reproducible load benchmark for the /analyze pipeline.
+
+Drives the FastAPI app either in-process (ASGI transport, no sockets) or
+over HTTP against a uvicorn server this script spawns (or an existing
+--base-url). Gemini is served by benchmarks.fake_gemini with configurable
+latency, error rate and 429 behaviour, and images come from the synthetic
+corpus in benchmarks.corpus.
+
+For every concurrency level it reports end-to-end p50/p95/p99, RPS, status
+counts, server CPU time and RSS, plus per-stage latency taken from the
+/metrics histograms, and the routing decisions with the resulting Gemini
+call rate, estimated cost per 1k requests and the share of Gemini round trips
+wasted on unparseable responses. Results are written as JSON.
+Pass --baseline to diff against a run from another commit or policy.
+
+Run from the backend directory:
+    python -m benchmarks.run_pipeline --mode inproc --concurrency 1,4,16 --requests 200
+    python -m benchmarks.run_pipeline --mode http --workers 2 --gemini-latency-ms 1200 --gemini-rpm 60 \\
+        --output bench-$(git rev-parse --short HEAD).json --baseline bench-main.json
+    python -m benchmarks.run_pipeline --routing-policy cascade --output cascade.json --baseline gemini-first.json
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import platform
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.corpus import DEFAULT_FORMATS, DEFAULT_SIZES, build_corpus
+from benchmarks.fake_gemini import start_fake_gemini
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SAMPLE_RE = re.compile(r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>[^}]*)\})?\s+(?P<value>\S+)$')
+
+
+# ---------------------------------------------------------------------------
+# Statistics helpers
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def parse_metrics(text: str) -> Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]:
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        labels = tuple(sorted(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group("labels") or "")))
+        samples[(match.group("name"), labels)] = float(match.group("value"))
+    return samples
+
+
+def stage_stats(before: Dict, after: Dict, metric: str = "plantcare_stage_duration_seconds") -> Dict[str, Dict]:
+    """Per-stage count, mean and bucket-interpolated percentiles for the interval between two scrapes."""
+    buckets: Dict[str, List[Tuple[float, float]]] = defaultdict(list)
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for (name, labels), value in after.items():
+        delta = value - before.get((name, labels), 0.0)
+        label_map = dict(labels)
+        stage = label_map.get("stage")
+        if stage is None:
+            continue
+        if name == f"{metric}_bucket":
+            bound = float("inf") if label_map["le"] == "+Inf" else float(label_map["le"])
+            buckets[stage].append((bound, delta))
+        elif name == f"{metric}_sum":
+            sums[stage] = delta
+        elif name == f"{metric}_count":
+            counts[stage] = delta
+
+    stats = {}
+    for stage, count in counts.items():
+        if count <= 0:
+            continue
+        cumulative = sorted(buckets[stage])
+        entry = {"count": int(count), "mean_ms": round(sums.get(stage, 0.0) / count * 1000, 2)}
+        for pct in (50, 95, 99):
+            target = count * pct / 100
+            lower_bound, lower_count = 0.0, 0.0
+            value = None
+            for bound, cum in cumulative:
+                if cum >= target:
+                    if bound == float("inf"):
+                        value = lower_bound
+                    else:
+                        span = cum - lower_count
+                        frac = (target - lower_count) / span if span else 1.0
+                        value = lower_bound + (bound - lower_bound) * frac
+                    break
+                lower_bound, lower_count = bound, cum
+            entry[f"p{pct}_ms"] = round(value * 1000, 2) if value is not None else None
+        stats[stage] = entry
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# Process resource sampling (Linux /proc, falling back to getrusage for self)
+# ---------------------------------------------------------------------------
+
+def routing_stats(before: Dict, after: Dict, requests: int, cost_per_call: float) -> Dict:
+    """Routing decisions and Gemini spend for the interval between two scrapes."""
+    decisions: Dict[str, int] = defaultdict(int)
+    responses: Dict[str, int] = defaultdict(int)
+    calls = 0
+    for (name, labels), value in after.items():
+        delta = int(value - before.get((name, labels), 0.0))
+        label_map = dict(labels)
+        if name == "plantcare_routing_decisions_total" and delta:
+            decisions[f"{label_map.get('route')}:{label_map.get('reason')}"] += delta
+        # Every attempted call is billed, including ones that failed after reaching the API
+        elif name == "plantcare_gemini_calls_total" and label_map.get("outcome") != "unconfigured":
+            calls += delta
+        # Individual round trips, retries included, by how the response parsed
+        elif name == "plantcare_gemini_responses_total" and delta:
+            responses[f"{label_map.get('purpose')}:{label_map.get('outcome')}"] += delta
+    round_trips = sum(responses.values())
+    wasted = sum(n for key, n in responses.items() if key.split(":")[1] in ("invalid_json", "missing_keys"))
+    return {
+        "decisions": dict(decisions),
+        "gemini_responses": dict(responses),
+        "gemini_parse_failure_rate": round(wasted / round_trips, 3) if round_trips else None,
+        "gemini_calls": calls,
+        "gemini_call_rate": round(calls / requests, 3) if requests else None,
+        "cost_per_1k_requests_usd": round(calls / requests * 1000 * cost_per_call, 3) if requests else None,
+    }
+
+
+def _proc_tree(pid: int) -> List[int]:
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for child in f.read().split():
+                pids.extend(_proc_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def sample_process(pid: int) -> Dict[str, float]:
+    """CPU seconds and RSS (MB) summed over a process and its children."""
+    ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    cpu, rss, hwm = 0.0, 0.0, 0.0
+    found = False
+    for p in _proc_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / ticks
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) / 1024
+                    elif line.startswith("VmHWM:"):
+                        hwm += int(line.split()[1]) / 1024
+            found = True
+        except (OSError, IndexError, ValueError):
+            continue
+    if not found and pid == os.getpid():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = usage.ru_utime + usage.ru_stime
+        hwm = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return {"cpu_s": cpu, "rss_mb": rss, "peak_rss_mb": hwm}
+
+
+# ---------------------------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------------------------
+
+async def _drive(client: httpx.AsyncClient, corpus: List[Dict], endpoint: str, total: int, concurrency: int,
+                 crop_type: str = "auto"):
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            item = corpus[i % len(corpus)]
+            t0 = time.perf_counter()
+            try:
+                res = await client.post(
+                    endpoint,
+                    files={"image": (item["name"], item["bytes"], item["mime"])},
+                    data={"cropType": crop_type, "mode": "beginner"},
+                )
+                statuses[str(res.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - t0
+
+
+async def run_levels(client: httpx.AsyncClient, corpus: List[Dict], args, server_pid: int, gemini_config) -> List[Dict]:
+    # Warm-up: model load, first Gemini connection, SQLite file creation
+    await _drive(client, corpus, args.endpoint, min(len(corpus), args.warmup), 1, args.crop_type)
+
+    runs = []
+    for concurrency in args.concurrency:
+        before_metrics = parse_metrics((await client.get("/metrics")).text)
+        before_proc = sample_process(server_pid)
+        before_gemini = dict(gemini_config.stats) if gemini_config else {}
+
+        latencies, statuses, wall = await _drive(client, corpus, args.endpoint, args.requests, concurrency,
+                                                 args.crop_type)
+
+        after_proc = sample_process(server_pid)
+        after_metrics = parse_metrics((await client.get("/metrics")).text)
+        latencies.sort()
+        cpu = after_proc["cpu_s"] - before_proc["cpu_s"]
+        runs.append({
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "wall_s": round(wall, 3),
+            "rps": round(len(latencies) / wall, 2) if wall else None,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 1),
+                "p95": round(percentile(latencies, 95), 1),
+                "p99": round(percentile(latencies, 99), 1),
+                "mean": round(sum(latencies) / len(latencies), 1),
+                "max": round(latencies[-1], 1),
+            },
+            "status_counts": dict(statuses),
+            "server": {
+                "cpu_s": round(cpu, 2),
+                "cpu_util": round(cpu / wall, 2) if wall else None,
+                "rss_mb": round(after_proc["rss_mb"], 1),
+                "peak_rss_mb": round(after_proc["peak_rss_mb"], 1),
+            },
+            "stages": stage_stats(before_metrics, after_metrics),
+            "routing": routing_stats(before_metrics, after_metrics, len(latencies), args.gemini_cost_per_call),
+            "gemini": {k: v - before_gemini.get(k, 0) for k, v in gemini_config.stats.items()} if gemini_config else None,
+        })
+        print(f"concurrency={concurrency}: {runs[-1]['rps']} rps, p50={runs[-1]['latency_ms']['p50']}ms "
+              f"p99={runs[-1]['latency_ms']['p99']}ms gemini_rate={runs[-1]['routing']['gemini_call_rate']} "
+              f"{dict(statuses)}", file=sys.stderr)
+    return runs
+
+
+# ---------------------------------------------------------------------------
+# Targets
+# ---------------------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _server_env(workdir: str, gemini_url: Optional[str], args) -> Dict[str, str]:
+    env = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "OUTBREAK_WARM_START_DAYS": "0",
+        # Every benchmark request comes from one address; the per-caller rate limit would turn most of them away
+        "ADMISSION_RATE_PER_MINUTE": "0",
+    }
+    if args.routing_policy:
+        env["ROUTING_POLICY"] = args.routing_policy
+    if args.cascade_threshold is not None:
+        env["CASCADE_CONFIDENCE_THRESHOLD"] = str(args.cascade_threshold)
+    if gemini_url:
+        env.update({"GEMINI_API_KEY": "benchmark", "GEMINI_API_ENDPOINT": gemini_url})
+    else:
+        env.update({"GEMINI_API_KEY": ""})
+    return env
+
+
+async def run_inproc(corpus, args, gemini_url, gemini_config, workdir):
+    os.environ.update(_server_env(workdir, gemini_url, args))
+    os.chdir(workdir)  # uploads/ lands in the scratch directory, not the repo
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+        return await run_levels(client, corpus, args, os.getpid(), gemini_config)
+
+
+async def run_http(corpus, args, gemini_url, gemini_config, workdir):
+    proc = None
+    base_url = args.base_url
+    if not base_url:
+        port = _free_port()
+        env = {**os.environ, **_server_env(workdir, gemini_url, args)}
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--app-dir", BACKEND_DIR,
+             "--host", "127.0.0.1", "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=workdir, env=env,
+        )
+        base_url = f"http://127.0.0.1:{port}"
+
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout,
+                                     limits=httpx.Limits(max_connections=max(args.concurrency) * 2)) as client:
+            for _ in range(300):
+                try:
+                    if (await client.get("/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                await asyncio.sleep(0.2)
+            else:
+                raise RuntimeError(f"Server at {base_url} never became healthy")
+            return await run_levels(client, corpus, args, proc.pid if proc else -1, gemini_config)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict) -> List[Dict]:
+    """Latency/RPS deltas per concurrency level, as percentages against the baseline run."""
+    def pct(new, old):
+        return round((new - old) / old * 100, 1) if old else None
+
+    previous = {run["concurrency"]: run for run in baseline.get("runs", [])}
+    rows = []
+    for run in current["runs"]:
+        old = previous.get(run["concurrency"])
+        if not old:
+            continue
+        rows.append({
+            "concurrency": run["concurrency"],
+            "rps_pct": pct(run["rps"], old["rps"]),
+            "p50_pct": pct(run["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            "p95_pct": pct(run["latency_ms"]["p95"], old["latency_ms"]["p95"]),
+            "p99_pct": pct(run["latency_ms"]["p99"], old["latency_ms"]["p99"]),
+            "peak_rss_pct": pct(run["server"]["peak_rss_mb"], old["server"]["peak_rss_mb"]),
+        })
+        if "routing" in run and "routing" in old:
+            rows[-1]["gemini_call_rate"] = [old["routing"]["gemini_call_rate"], run["routing"]["gemini_call_rate"]]
+            rows[-1]["cost_per_1k_pct"] = pct(run["routing"]["cost_per_1k_requests_usd"],
+                                              old["routing"]["cost_per_1k_requests_usd"])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("inproc", "http"), default="inproc")
+    parser.add_argument("--base-url", default=None, help="Benchmark an already running server instead of spawning one")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--endpoint", default="/analyze", choices=("/analyze", "/analyze/stream"))
+    parser.add_argument("--concurrency", default="1,4,16", type=lambda v: [int(c) for c in v.split(",")])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--sizes", default=None, help="Comma-separated WxH list, e.g. 640x480,2000x2000")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS))
+    parser.add_argument("--per-combo", type=int, default=1)
+    parser.add_argument("--no-gemini", action="store_true", help="Run with Gemini unconfigured (local model only)")
+    parser.add_argument("--gemini-latency-ms", type=float, default=900)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-rate-429", type=float, default=0.0)
+    parser.add_argument("--gemini-rpm", type=int, default=None)
+    parser.add_argument("--gemini-malformed-rate", type=float, default=0.0)
+    parser.add_argument("--routing-policy", default=None, choices=("gemini_first", "cascade", "local_only"),
+                        help="Server ROUTING_POLICY (default: whatever the environment configures)")
+    parser.add_argument("--cascade-threshold", type=float, default=None)
+    parser.add_argument("--crop-type", default="auto", help="cropType form field sent with every request")
+    parser.add_argument("--gemini-cost-per-call", type=float, default=0.0004,
+                        help="USD per Gemini call for the cost estimate (~1k input + 800 output tokens on 2.0 Flash)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", default=None, help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", default=None, help="Previous JSON report to compare against")
+    args = parser.parse_args()
+
+    sizes = DEFAULT_SIZES
+    if args.sizes:
+        sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes.split(",")]
+    corpus = build_corpus(sizes=sizes, formats=args.formats.split(","), per_combo=args.per_combo, seed=args.seed)
+
+    gemini_url, gemini_config, gemini_server = None, None, None
+    if not args.no_gemini:
+        gemini_server, gemini_config = start_fake_gemini(
+            0, latency_ms=args.gemini_latency_ms, jitter_ms=args.gemini_jitter_ms,
+            error_rate=args.gemini_error_rate, rate_429=args.gemini_rate_429, rpm=args.gemini_rpm,
+            malformed_rate=args.gemini_malformed_rate, seed=args.seed,
+        )
+        gemini_url = f"http://127.0.0.1:{gemini_server.server_port}"
+
+    workdir = tempfile.mkdtemp(prefix="plantcare-bench-")
+    runner = run_inproc if args.mode == "inproc" else run_http
+    runs = asyncio.run(runner(corpus, args, gemini_url, gemini_config, workdir))
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": args.mode,
+            "endpoint": args.endpoint,
+            "routing_policy": args.routing_policy,
+            "cascade_threshold": args.cascade_threshold,
+            "crop_type": args.crop_type,
+            "workers": args.workers if args.mode == "http" else None,
+            "corpus": {
+                "images": len(corpus),
+                "formats": sorted({item["format"] for item in corpus}),
+                "sizes": [f"{w}x{h}" for w, h in sizes],
+                "total_bytes": sum(len(item["bytes"]) for item in corpus),
+            },
+            "gemini": None if args.no_gemini else {
+                "latency_ms": args.gemini_latency_ms, "jitter_ms": args.gemini_jitter_ms,
+                "error_rate": args.gemini_error_rate, "rate_429": args.gemini_rate_429,
+                "rpm": args.gemini_rpm, "malformed_rate": args.gemini_malformed_rate,
+            },
+        },
+        "runs": runs,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare(json.load(f), report)
+
+    if gemini_server:
+        gemini_server.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+from starlette.requests import Request
+
+from app.config import settings
+from app.services.admission import client_ip
+
+
+def _request(peer, forwarded=None):
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (peer, 4321), "headers": headers})
+
+
+def test_forwarded_for_ignored_without_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(settings, "trusted_proxies", [])
+    assert client_ip(_request("10.0.0.5", "203.0.113.7")) == "10.0.0.5"
+
+
+def test_any_peer_trusted_takes_the_hop_it_appended(monkeypatch):
+    monkeypatch.setattr(settings, "trusted_proxies", ["*"])
+    # The leftmost entry is whatever the client sent; only the last one was written by the proxy
+    assert client_ip(_request("10.0.0.5", "198.51.100.1, 203.0.113.7")) == "203.0.113.7"
+
+
+def test_trusted_networks_skip_inner_proxies(monkeypatch):
+    monkeypatch.setattr(settings, "trusted_proxies", ["10.0.0.0/8"])
+    assert client_ip(_request("10.0.0.5", "203.0.113.7, 10.2.2.2")) == "203.0.113.7"
+    assert client_ip(_request("192.0.2.9", "203.0.113.7")) == "192.0.2.9"
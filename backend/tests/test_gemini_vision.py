@@ -0,0 +1,38 @@
+from app.config import settings
+from app.services import gemini_vision
+from app.services.gemini_quota import INTERACTIVE, GeminiGovernor, MemoryQuotaStore
+
+ANSWER = {"plant_name": "Tomato", "disease_name": "Early blight", "confidence": 0.9, "health_score": 60}
+
+
+def _setup(monkeypatch, responses):
+    governor = GeminiGovernor(MemoryQuotaStore())
+    monkeypatch.setattr(gemini_vision, "gemini_governor", governor)
+    monkeypatch.setattr(gemini_vision, "gemini_enabled", lambda: True)
+    monkeypatch.setattr(gemini_vision, "gemini_image", lambda image_bytes: (image_bytes, "image/jpeg"))
+    monkeypatch.setattr(settings, "gemini_rpm_limit", 2000)
+    monkeypatch.setattr(settings, "gemini_quota_max_wait_s", 0.5)
+    calls = []
+
+    def generate(*contents):
+        calls.append(contents)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(gemini_vision.VISION_PROMPT, "generate", generate)
+    return governor, calls
+
+
+def test_retry_after_429_returns_gemini_result(monkeypatch):
+    _, calls = _setup(monkeypatch, [RuntimeError("429 Resource has been exhausted"), dict(ANSWER)])
+    assert gemini_vision.analyze_plant_image(b"leaf") == ANSWER
+    assert len(calls) == 2
+
+
+def test_backoff_paces_other_interactive_calls(monkeypatch):
+    governor, _ = _setup(monkeypatch, [])
+    governor.backoff(10)
+    # Another worker's call waits out the debt instead of falling back immediately
+    assert governor.acquire(1500, INTERACTIVE)
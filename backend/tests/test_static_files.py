@@ -0,0 +1,18 @@
+from PIL import Image
+
+from app.services.static_files import _build_variant
+
+
+def test_narrow_gif_variant_is_a_jpeg(tmp_path):
+    source, target = tmp_path / "a.gif", tmp_path / "variants" / "a.w480.jpg"
+    Image.new("RGB", (200, 100), (40, 160, 60)).save(source, "GIF")
+    _build_variant(str(source), str(target), 480)
+    with Image.open(target) as variant:
+        assert (variant.format, variant.size) == ("JPEG", (200, 100))
+
+
+def test_narrow_jpeg_variant_is_linked(tmp_path):
+    source, target = tmp_path / "a.jpg", tmp_path / "variants" / "a.w480.jpg"
+    Image.new("RGB", (200, 100), (40, 160, 60)).save(source, "JPEG")
+    _build_variant(str(source), str(target), 480)
+    assert target.read_bytes() == source.read_bytes()
@@ -2,7 +2,8 @@ import { useEffect } from 'react';
 import { useNavigate } from 'react-router';
 import { motion } from 'motion/react';
 import { Leaf } from 'lucide-react';
-import { analyzeImage } from '../services/plantAI';
+import { toast } from 'sonner';
+import { analyzeImage, PhotoQualityError } from '../services/plantAI';
 
 export function Analyzing() {
   const navigate = useNavigate();
@@ -31,7 +32,11 @@ export function Analyzing() {
       } catch (error) {
         console.error('Analysis failed:', error);
         // Show user-visible feedback before redirecting
-        sessionStorage.setItem('analysis-error', 'Analysis failed. Please try again with a different image.');
+        const message = error instanceof PhotoQualityError
+          ? error.message
+          : 'Analysis failed. Please try again with a different image.';
+        sessionStorage.setItem('analysis-error', message);
+        toast.error(message, { duration: 4000 });
         setTimeout(() => navigate('/home'), 2000);
       }
     };
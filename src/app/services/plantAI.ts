@@ -149,6 +149,22 @@ function dataURItoBlob(dataURI: string): Blob {
   return new Blob([ab], { type: mimeString });
 }
 
+/**
+ * The backend's quality gate rejected the photo (HTTP 422). The message says
+ * how to retake it and is meant to be shown to the user as-is.
+ */
+export class PhotoQualityError extends Error {
+  code: string;
+  checks: Record<string, unknown>;
+
+  constructor(detail: { code: string; message: string; checks?: Record<string, unknown> }) {
+    super(detail.message);
+    this.name = 'PhotoQualityError';
+    this.code = detail.code;
+    this.checks = detail.checks || {};
+  }
+}
+
 /**
  * Real AI model analysis function
  */
@@ -179,6 +195,13 @@ async function realAnalyzeImage(request: AnalysisRequest): Promise<AnalysisRespo
       body: formData,
     });
 
+    if (response.status === 422) {
+      // { detail: { code, message, checks } } from the quality gate
+      const body = await response.json().catch(() => null);
+      if (body?.detail?.message) {
+        throw new PhotoQualityError(body.detail);
+      }
+    }
     if (!response.ok) {
       throw new Error(`API request failed: ${response.statusText}`);
     }
@@ -190,6 +213,9 @@ async function realAnalyzeImage(request: AnalysisRequest): Promise<AnalysisRespo
 
   } catch (error) {
     console.error('Error calling AI model:', error);
+    if (error instanceof PhotoQualityError) {
+      throw error;
+    }
     throw new Error('Failed to analyze image. Please try again.');
   }
 }